@@ -1,11 +1,21 @@
 import sys
 import numpy as np
-import pygame
-from game import get_best_move, save_parameters
-from tetris import check_collision, spawn_piece, rotate, lock_piece, clear_lines, create_empty_grid, SHAPES, update_score, GRID_WIDTH, GRID_HEIGHT
+from utils import get_best_move, save_parameters
+from tetris import check_collision, spawn_piece, rotate, lock_piece, clear_lines, create_empty_grid, SHAPES, update_score, shape_key, GRID_WIDTH, GRID_HEIGHT
 from utils import score_parameters, load_parameters
+from simulator import simulate_games, play_game, PlacementTable, PLACEMENT_TABLE
+from engine import get_engine, parse_size
+from pieces import PieceSource, SequenceSource, SequenceBank
+from fitness_cache import FitnessCache
+from results_store import ResultsStore, import_text_results, UNKNOWN_SEED, UNKNOWN_GENERATION
+from checkpoint import save_checkpoint, load_checkpoint
+from replay import ReplayLog
+from optimizers import Optimizer, CMAES
+from functools import lru_cache
+import instrumentation
+import math
 import os
-import signal
+import time
 
 #Genetic Algorithm parameters
 POPULATION_SIZE = 50  #Further reduced population size for quicker testing
@@ -17,6 +27,59 @@ OFFSPRING_SIZE = int(0.3 * POPULATION_SIZE)  #Number of offspring to be generate
 REPLACEMENT_RATE = 0.3  #Keep replacement rate the same
 NUM_GAMES = 5         #Reduce the number of games for faster testing
 MAX_MOVES = 500       #Reduce the maximum number of moves allowed per game
+MAX_PIECES = 500      #Piece budget per game for the placement-level driver (simulator.play_game)
+USE_BITBOARD = True   #Play on the bitboard engine (bitboard.py) instead of the list-of-lists grid
+VECTORIZED_EVALUATION = False  #Play all games of a generation in lockstep with simulator.py (no rendering, LOOKAHEAD_DEPTH 1 only)
+LOOKAHEAD_DEPTH = 1          #Pieces searched per decision in unrendered games (search.py), 2 also uses the preview piece
+BEAM_WIDTH = 8               #Placements expanded per ply when LOOKAHEAD_DEPTH > 1
+PARALLEL_EVALUATION = False  #Spread (individual, game) tasks over a process pool (no rendering)
+WORKERS = os.cpu_count()     #Number of worker processes for PARALLEL_EVALUATION
+CHUNK_SIZE = 1               #Tasks handed to a worker at a time
+EVALUATION_SEED = 0          #Base seed for the per-game piece sequences
+COMMON_RANDOM_NUMBERS = True #Every individual of a generation plays the same NUM_GAMES piece sequences
+BAG_RANDOMIZER = False       #Deal pieces with the 7-bag randomizer instead of uniformly at random
+RESEED_EVERY_GENERATION = True  #False replays the same games every generation, so survivors are served from the cache
+RACING_EVALUATION = False    #Successive halving: weak individuals stop after their first games (unrendered games only)
+RACING_DROP_FRACTION = 0.5   #Share of the survivors dropped after every racing round
+RACING_MIN_SURVIVORS = 2     #Racing never drops below this many individuals
+EARLY_TERMINATION_HEIGHT = None  #End unrendered games once the stack is this many rows high, None plays to game over
+BOARD_WIDTH, BOARD_HEIGHT = GRID_WIDTH, GRID_HEIGHT  #Board of the fitness games (engine.py), other sizes are never rendered
+
+#Optimizer driving training (optimizers.py): "ga" is the genetic algorithm below, "cmaes" a batched CMA-ES that
+#ranks its samples by mean lines cleared over the unrendered fitness games (no rendering, no racing)
+OPTIMIZER = "ga"
+CMA_POPULATION_SIZE = 12  #Samples per CMA-ES generation, each plays NUM_GAMES games
+CMA_SIGMA = 0.3           #Initial CMA-ES step size, the samples live on the unit sphere
+TARGET_LINES = None       #cmaes stops once a sample's mean lines cleared per game reaches this, None runs all GENERATIONS
+
+#Fitness cache of unrendered game outcomes (fitness_cache.py)
+USE_FITNESS_CACHE = True
+FITNESS_CACHE_SIZE = 100000
+FITNESS_CACHE_FILE = "fitness_cache.sqlite"  #None keeps the cache in memory only
+fitness_cache = None  #Opened by get_fitness_cache on first use
+
+#Game results (results_store.py), game_results.txt is only read once to seed a new store
+RESULTS_FILE = "game_results.bin"
+LEGACY_RESULTS_FILE = "game_results.txt"  #None skips the import, e.g. for island stores
+results_store = None  #Opened by get_results_store on first use
+
+#Compact replays of every unrendered game that is played, not served from the cache (replay.py)
+RECORD_REPLAYS = False
+REPLAYS_FILE = "game_replays.bin"
+replay_log = None  #Opened by get_replay_log on first use
+
+#Full GA state written atomically every CHECKPOINT_EVERY generations (checkpoint.py), --resume continues from it
+CHECKPOINT_FILE = "ga_checkpoint.pkl"
+CHECKPOINT_EVERY = 1
+
+#Per-generation timing summaries (instrumentation.py), written as JSON lines to INSTRUMENTATION_LOG
+INSTRUMENT = False
+INSTRUMENTATION_LOG = "instrumentation.jsonl"
+
+#Rendering: HEADLESS never imports Pygame and runs unthrottled, otherwise only every Nth game / frame is drawn
+HEADLESS = False
+RENDER_EVERY_N_GAMES = 1
+RENDER_EVERY_N_FRAMES = 1
 
 
 # Colors for the Tetrimino shapes and background
@@ -44,27 +107,66 @@ def print_colored(text, color_code):
     print(f"\033[{color_code}m{text}\033[0m")  #Reset color after printing
     
     
-def draw_piece(screen, shape, x, y, color):  #Add color as a parameter
-    #Draw the piece at its position with the assigned color
-    for row_idx, row in enumerate(shape):
-        for col_idx, cell in enumerate(row):
-            if cell:
-                rect = pygame.Rect((x + col_idx) * BLOCK_SIZE, (y + row_idx) * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)
-                pygame.draw.rect(screen, color, rect.inflate(-2, -2), border_radius=5)
+def build_shape_colors():
+    #Color of every rotation of every shape, keyed by shape_key, so rotated pieces keep their color
+    shape_colors = {}
+    for name, shape in zip(SHAPE_NAMES, SHAPES):
+        for _ in range(4):
+            shape_colors[shape_key(shape)] = COLORS[name]
+            shape = rotate(shape)
+    return shape_colors
+
+SHAPE_COLORS = build_shape_colors()
 
 
-#Initialize Pygame
-pygame.init()
 SCREEN_WIDTH, SCREEN_HEIGHT = 400, 700
 BLOCK_SIZE = 30
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Tetris AI Game")
-clock = pygame.time.Clock()  #Create a clock to control the frame rate
+screen = None  #Created by init_display the first time a game is rendered
+clock = None
+renderer = None  #renderer.Renderer of the window, cell tiles and text are cached across frames
+board_view = None
 
 #Scoreboard position
 SCOREBOARD_X = SCREEN_WIDTH - 100
 SCOREBOARD_Y = 10
 
+def init_display():
+    #Initialize Pygame and open the window, only called when something is rendered
+    global screen, clock, renderer, board_view
+    if screen is None:
+        import pygame
+        from renderer import Renderer, rounded_tiles
+        pygame.init()
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("Tetris AI Game")
+        clock = pygame.time.Clock()  #Create a clock to control the frame rate
+        renderer = Renderer(screen, COLORS["BACKGROUND"])
+        board_view = renderer.add_board((0, 0), GRID_WIDTH, GRID_HEIGHT, BLOCK_SIZE, rounded_tiles(BLOCK_SIZE, COLORS["GRID"]), COLORS["WHITE"])
+        for name, position in (("score", (20, 660)), ("high_score", (20, 600)),
+                               ("generation", (SCOREBOARD_X, SCOREBOARD_Y + 60)), ("individual", (SCOREBOARD_X, SCOREBOARD_Y + 90)),
+                               ("moves", (SCOREBOARD_X, SCOREBOARD_Y + 120)), ("lines", (SCOREBOARD_X, SCOREBOARD_Y + 150))):
+            renderer.add_field(name, position, 28, COLORS["TEXT"])
+
+def handle_window_events():
+    #Exit cleanly when the window is closed
+    import pygame
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+
+def present_frame():
+    #Update the changed parts of the window and limit to 60 frames per second
+    renderer.present()
+    clock.tick(60)
+
+def should_render_game(individual_idx, generation_idx, game_idx):
+    #Render every RENDER_EVERY_N_GAMES-th game of the whole run, never when HEADLESS
+    if HEADLESS or (BOARD_WIDTH, BOARD_HEIGHT) != (GRID_WIDTH, GRID_HEIGHT):
+        return False
+    game_number = (generation_idx * POPULATION_SIZE + individual_idx) * NUM_GAMES + game_idx
+    return game_number % RENDER_EVERY_N_GAMES == 0
+
 #Define shape names for coloring
 SHAPE_NAMES = ["I", "O", "T", "S", "Z", "L", "J"]
 HIGH_SCORE_FILE = "high_score.txt"
@@ -80,29 +182,37 @@ def load_high_score():
 
 
 
-def save_game_results(parameters, score):
-    with open("game_results.txt", "a") as file:
-        file.write(f"{parameters.tolist()},{score}\n")
+def get_results_store():
+    #The binary results store, opened on first use; the legacy text file is imported into a new store once
+    global results_store
+    if results_store is None:
+        results_store = ResultsStore(RESULTS_FILE)
+        if len(results_store) == 0 and LEGACY_RESULTS_FILE is not None and os.path.exists(LEGACY_RESULTS_FILE):
+            imported, skipped = import_text_results(LEGACY_RESULTS_FILE, results_store)
+            print(f"Imported {imported} results from {LEGACY_RESULTS_FILE} ({skipped} lines skipped)")
+    return results_store
+
+def save_game_results(parameters, score, seed=UNKNOWN_SEED, generation=UNKNOWN_GENERATION):
+    with instrumentation.phase("persistence"):
+        get_results_store().append(parameters, score, seed, generation)
+
+def get_replay_log():
+    #The replay log, opened on first use
+    global replay_log
+    if replay_log is None:
+        replay_log = ReplayLog(REPLAYS_FILE)
+    return replay_log
+
+def record_replay(parameters, source, moves, lines_cleared, game_score, generation_idx, individual_idx, game_idx):
+    with instrumentation.phase("persistence"):
+        get_replay_log().append(parameters, source.seed, moves, lines_cleared, game_score, source.bag, generation_idx, individual_idx, game_idx,
+                                BOARD_WIDTH, BOARD_HEIGHT)
 
 def load_game_results():
-    results = []
-    try:
-        with open("game_results.txt", "r") as file:
-            for line in file:
-                line = line.strip()  #Remove any leading/trailing whitespace
-                if line:  #Only process non-empty lines
-                    try:
-                        param_str, score = line.split(',')
-                        results.append((np.array(eval(param_str)), float(score)))  #Convert to numpy array and score
-                    except ValueError:
-                        print(f"Skipping line due to ValueError: {line.strip()}")
-                    except SyntaxError:
-                        print(f"Skipping line due to SyntaxError: {line.strip()}")
-    except FileNotFoundError:
-        print("The file 'game_results.txt' was not found.")
-        return []
-    
-    return results
+    #All saved results as a memory-mapped RECORD_DTYPE array (fields parameters, score, seed, generation)
+    store = get_results_store()
+    store.flush()
+    return store.records()
 
 
 
@@ -115,37 +225,85 @@ def update_high_score(score, high_score):
 
 def save_high_score(high_score):
     #Save the high score to a file
-    with open(HIGH_SCORE_FILE, "w") as file:
+    with instrumentation.phase("persistence"), open(HIGH_SCORE_FILE, "w") as file:
         file.write(str(high_score))
         
-def draw_grid(screen, grid):
-    #Draw the grid background
-    screen.fill(COLORS["BACKGROUND"])
-
-    #Draw the grid cells with borders
-    for x in range(GRID_WIDTH): # type: ignore
-        for y in range(GRID_HEIGHT): # type: ignore
-            rect = pygame.Rect(x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)
-            pygame.draw.rect(screen, COLORS["GRID"], rect, border_radius=5)
-            if grid[y][x]:
-                pygame.draw.rect(screen, COLORS["WHITE"], rect.inflate(-2, -2), border_radius=5)
-
-
-def draw_scoreboard(screen, score, high_score, generation, individual, moves, lines_cleared):
-    font = pygame.font.SysFont(None, 28)
-    score_text = font.render(f"Score: {score}", True, COLORS["TEXT"])
-    high_score_text = font.render(f"High Score: {high_score}", True, COLORS["TEXT"])
-    generation_text = font.render(f"Gen: {generation}", True, COLORS["TEXT"])
-    individual_text = font.render(f"Ind: {individual}", True, COLORS["TEXT"])
-    moves_text = font.render(f"Moves: {moves}", True, COLORS["TEXT"])
-    lines_text = font.render(f"Lines: {lines_cleared}", True, COLORS["TEXT"])
-
-    screen.blit(score_text, (20, 660))
-    screen.blit(high_score_text, (20, 600))
-    screen.blit(generation_text, (SCOREBOARD_X, SCOREBOARD_Y + 60))
-    screen.blit(individual_text, (SCOREBOARD_X, SCOREBOARD_Y + 90))
-    screen.blit(moves_text, (SCOREBOARD_X, SCOREBOARD_Y + 120))
-    screen.blit(lines_text, (SCOREBOARD_X, SCOREBOARD_Y + 150))
+def draw_board(grid, shape, piece_x, piece_y):
+    #Draw the grid with the falling piece in its shape's color, only cells that changed since the last frame are redrawn
+    board_view.draw(grid, [(shape, piece_x, piece_y, SHAPE_COLORS[shape_key(shape)])])
+
+
+def draw_scoreboard(score, high_score, generation, individual, moves, lines_cleared):
+    #Text fields are only rendered again when their value changes
+    renderer.set_text("score", f"Score: {score}")
+    renderer.set_text("high_score", f"High Score: {high_score}")
+    renderer.set_text("generation", f"Gen: {generation}")
+    renderer.set_text("individual", f"Ind: {individual}")
+    renderer.set_text("moves", f"Moves: {moves}")
+    renderer.set_text("lines", f"Lines: {lines_cleared}")
+
+def play_rendered_game(parameters, individual_idx, generation_idx, high_score, total_lines_cleared, source=None):
+    #Play one game row by row with rendering, returns (game score, lines cleared)
+    init_display()
+    grid = create_empty_grid(bitboard=USE_BITBOARD)  #Initialize a new game grid
+    shape, piece_x, piece_y = spawn_piece(source)  #Spawn a new piece
+    moves = 0
+    game_score = 0
+    lines_cleared = 0
+    game_over = False
+
+    while moves < MAX_MOVES and not game_over:
+        render_frame = moves % RENDER_EVERY_N_FRAMES == 0
+        if render_frame:
+            if instrumentation.enabled:
+                render_start = instrumentation.clock()
+            handle_window_events()
+            draw_board(grid, shape, piece_x, piece_y)  #Draw the grid and the piece
+            if instrumentation.enabled:
+                instrumentation.add_time("rendering", instrumentation.clock() - render_start)
+
+        #Get the best move
+        if instrumentation.enabled:
+            decision_start = instrumentation.clock()
+        rotation, best_x, best_y = get_best_move(grid, shape, piece_x, piece_y, parameters)
+        if instrumentation.enabled:
+            instrumentation.record_decision(instrumentation.clock() - decision_start)
+
+        #Rotate the piece if needed
+        for _ in range(rotation):
+            shape = rotate(shape)
+
+        piece_x = best_x
+        piece_y = best_y
+
+        #Check for collision
+        if not check_collision(grid, shape, piece_x, piece_y + 1):
+            piece_y += 1
+        else:
+            if instrumentation.enabled:
+                lock_start = instrumentation.clock()
+            lock_piece(grid, shape, piece_x, piece_y)  #Lock the piece in place
+            num_lines_cleared = clear_lines(grid)  #Clear completed lines
+            if instrumentation.enabled:
+                instrumentation.add_time("lock_clear", instrumentation.clock() - lock_start)
+                instrumentation.count("pieces")
+            game_score = update_score(game_score, num_lines_cleared)  #Update score
+            lines_cleared += num_lines_cleared
+            shape, piece_x, piece_y = spawn_piece(source)  #Spawn a new piece
+
+            #Check for game over condition
+            if check_collision(grid, shape, piece_x, piece_y):
+                game_over = True  #End game if new piece collides
+
+        moves += 1
+
+        if render_frame:
+            with instrumentation.phase("rendering"):
+                #Draw the scoreboard
+                draw_scoreboard(game_score, high_score, generation_idx + 1, individual_idx + 1, moves, total_lines_cleared + lines_cleared)
+                present_frame()  #Update the display
+
+    return game_score, lines_cleared
 
 def fitness(parameters, individual_idx, generation_idx):
     total_lines_cleared = 0
@@ -158,61 +316,19 @@ def fitness(parameters, individual_idx, generation_idx):
     for game_idx in range(NUM_GAMES):
         print_colored(f"  Playing Game {game_idx + 1} for Individual {individual_idx + 1}", '36')
 
-        grid = create_empty_grid()  #Initialize a new game grid
-        shape, piece_x, piece_y = spawn_piece()  #Spawn a new piece
-        moves = 0
-        game_score = 0
-        game_over = False
-
-        while moves < MAX_MOVES and not game_over:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-            screen.fill(COLORS["BACKGROUND"])  #Clear screen
-            draw_grid(screen, grid)  #Draw the grid
-
-            shape_color = COLORS[SHAPE_NAMES[SHAPES.index(shape)]]
-            draw_piece(screen, shape, piece_x, piece_y, shape_color)  #Draw the piece
-
-            #Get the best move
-            rotation, best_x, best_y = get_best_move(grid, shape, piece_x, piece_y, parameters)
-
-            #Rotate the piece if needed
-            for _ in range(rotation):
-                shape = rotate(shape)
-
-            piece_x = best_x
-            piece_y = best_y
-
-            #Check for collision
-            if not check_collision(grid, shape, piece_x, piece_y + 1):
-                piece_y += 1
-            else:
-                lock_piece(grid, shape, piece_x, piece_y)  #Lock the piece in place
-                num_lines_cleared = clear_lines(grid)  #Clear completed lines
-                game_score = update_score(game_score, num_lines_cleared)  #Update score
-                total_lines_cleared += num_lines_cleared
-                shape, piece_x, piece_y = spawn_piece()  #Spawn a new piece
-
-                #Check for game over condition
-                if check_collision(grid, shape, piece_x, piece_y):
-                    game_over = True  #End game if new piece collides
-
-            moves += 1
-
-            #Draw the scoreboard
-            draw_scoreboard(screen, game_score, high_score, generation_idx + 1, individual_idx + 1, moves, total_lines_cleared)
-
-            pygame.display.flip()  #Update the display
-            clock.tick(60)  #Limit to 60 frames per second
+        source = piece_source(generation_idx, individual_idx, game_idx)
+        if should_render_game(individual_idx, generation_idx, game_idx):
+            game_score, lines_cleared = play_rendered_game(parameters, individual_idx, generation_idx, high_score, total_lines_cleared, source)
+        else:
+            #Unrendered games run placement by placement with a budget of MAX_PIECES pieces
+            lines_cleared, game_score = play_cached_game(parameters, source, (generation_idx, individual_idx, game_idx))
+        total_lines_cleared += lines_cleared
 
         #Update high score if needed
         high_score = update_high_score(game_score, high_score)
 
         #Save the game results after each game
-        save_game_results(parameters, game_score)
+        save_game_results(parameters, game_score, source.seed, generation_idx)
 
     print_colored(f"Finished Evaluating Individual {individual_idx + 1}", '35')
     print_colored(f"  Total Lines Cleared: {total_lines_cleared}", '33')
@@ -224,9 +340,9 @@ def fitness(parameters, individual_idx, generation_idx):
 
 def initialize_population():
     population = []
-    previous_results = load_game_results()
-    if previous_results:
-        best_parameters = max(previous_results, key=lambda x: x[1])[0]  #Best parameter from past games
+    previous_best = get_results_store().best()
+    if previous_best is not None:
+        best_parameters = previous_best[0]  #Best parameter from past games
         population.append(best_parameters)  #Start with the best found
     for _ in range(POPULATION_SIZE - 1):
         vec = np.random.randn(4)  #Create a random 4-dimensional vector
@@ -236,9 +352,238 @@ def initialize_population():
 
 
 def evaluate_population(population, generation_idx):
+    if RACING_EVALUATION:
+        return evaluate_population_racing(population, generation_idx)
+    if VECTORIZED_EVALUATION and LOOKAHEAD_DEPTH == 1:
+        return evaluate_population_vectorized(population, generation_idx)
+    if PARALLEL_EVALUATION:
+        return evaluate_population_parallel(population, generation_idx)
     scores = [fitness(individual, i, generation_idx) for i, individual in enumerate(population)]
     return scores
 
+def record_population_games(population, generation_idx, lines_cleared, game_scores):
+    #Save the results and high score of games played outside fitness() and score them like fitness()
+    #lines_cleared and game_scores are indexed [individual][game]
+    high_score = load_high_score()
+    scores = []
+    for individual_idx, parameters in enumerate(population):
+        for game_idx, game_score in enumerate(game_scores[individual_idx]):
+            high_score = update_high_score(int(game_score), high_score)
+            save_game_results(parameters, int(game_score), piece_source(generation_idx, individual_idx, game_idx).seed, generation_idx)
+        print_colored(f"Individual {individual_idx + 1} in Generation {generation_idx + 1}: "
+                      f"{sum(lines_cleared[individual_idx])} lines, best game {max(game_scores[individual_idx])}", '35')
+        scores.append(high_score)
+    return scores
+
+def evaluate_population_vectorized(population, generation_idx):
+    #Play NUM_GAMES games for every individual in one lockstep batch and score them like fitness()
+    outcomes = play_games_vectorized(population, generation_idx, all_games(population))
+    return record_outcomes(population, generation_idx, outcomes)
+
+def all_games(population):
+    #(individual_idx, game_idx) of every fitness game of a generation
+    return [(individual_idx, game_idx) for individual_idx in range(len(population)) for game_idx in range(NUM_GAMES)]
+
+def record_outcomes(population, generation_idx, outcomes):
+    #record_population_games for a {(individual_idx, game_idx): (lines, score)} dict, every individual's games
+    #must be a prefix 0..n-1 of its piece sources
+    lines_cleared = [[] for _ in population]
+    game_scores = [[] for _ in population]
+    for (individual_idx, game_idx), (lines, game_score) in sorted(outcomes.items()):
+        lines_cleared[individual_idx].append(lines)
+        game_scores[individual_idx].append(game_score)
+    return record_population_games(population, generation_idx, lines_cleared, game_scores)
+
+def play_games_vectorized(population, generation_idx, games):
+    #(lines cleared, score) of every (individual_idx, game_idx) in games, played in one lockstep batch
+    #Games found in the fitness cache are left out of the batch
+    outcomes = {}
+    missing = []
+    for individual_idx, game_idx in games:
+        source = piece_source(generation_idx, individual_idx, game_idx)
+        outcome = cached_outcome(population[individual_idx], source)
+        if outcome is None:
+            missing.append((individual_idx, game_idx, source))
+        else:
+            outcomes[individual_idx, game_idx] = outcome
+
+    if missing:
+        parameters = np.array([population[individual_idx] for individual_idx, _, _ in missing], dtype=np.float64)
+        sequences = np.stack([source.sequence for _, _, source in missing])
+        moves = [[] for _ in missing] if RECORD_REPLAYS else None
+        batch_lines, batch_scores = simulate_games(parameters, MAX_PIECES, table=placement_table(BOARD_WIDTH, BOARD_HEIGHT), sequences=sequences,
+                                                   max_height=EARLY_TERMINATION_HEIGHT, moves=moves)
+        for n, ((individual_idx, game_idx, source), lines, game_score) in enumerate(zip(missing, batch_lines.tolist(), batch_scores.tolist())):
+            outcomes[individual_idx, game_idx] = (lines, game_score)
+            if moves is not None:
+                record_replay(population[individual_idx], source, moves[n], lines, game_score, generation_idx, individual_idx, game_idx)
+            if USE_FITNESS_CACHE:
+                get_fitness_cache().put(game_cache_key(population[individual_idx], source), lines, game_score)
+    return outcomes
+
+def game_seed(generation_idx, individual_idx, game_idx):
+    #Deterministic piece-sequence seed of one game, independent of which worker plays it
+    if not RESEED_EVERY_GENERATION:
+        generation_idx = 0
+    return int(np.random.SeedSequence([EVALUATION_SEED, generation_idx, individual_idx, game_idx]).generate_state(1)[0])
+
+@lru_cache(maxsize=1)
+def generation_bank(generation_idx):
+    #The NUM_GAMES piece sequences shared by every individual of a generation
+    return SequenceBank.generate(NUM_GAMES, MAX_PIECES + 1, seed=game_seed(generation_idx, 0, 0), bag=BAG_RANDOMIZER)
+
+def piece_source(generation_idx, individual_idx, game_idx):
+    #Piece source of one fitness game: a shared bank sequence with COMMON_RANDOM_NUMBERS, else a private seed
+    if COMMON_RANDOM_NUMBERS:
+        return generation_bank(generation_idx).source(game_idx)
+    seed = game_seed(generation_idx, individual_idx, game_idx)
+    return SequenceSource(PieceSource(seed, BAG_RANDOMIZER).sequence(MAX_PIECES + 1), seed, BAG_RANDOMIZER)
+
+def game_rules():
+    #Rules of the unrendered fitness games, sent with every pool task: main() changes these settings in the
+    #parent only, and spawned or forkserver workers would otherwise play with the module defaults
+    return (MAX_PIECES, USE_BITBOARD, LOOKAHEAD_DEPTH, BEAM_WIDTH, EARLY_TERMINATION_HEIGHT, BOARD_WIDTH, BOARD_HEIGHT)
+
+def play_rules_game(parameters, source, rules, moves=None):
+    #Play one unrendered fitness game under rules (see game_rules), returns (lines cleared, score)
+    max_pieces, bitboard, lookahead_depth, beam_width, max_height, width, height = rules
+    #Standard-size games keep playing on the USE_BITBOARD engine
+    engine = None if (width, height) == (GRID_WIDTH, GRID_HEIGHT) else get_engine(width, height)
+    lines_cleared, game_score, _ = play_game(parameters, max_pieces, bitboard, source=source, lookahead_depth=lookahead_depth,
+                                             beam_width=beam_width, max_height=max_height, moves=moves, engine=engine)
+    return lines_cleared, game_score
+
+@lru_cache(maxsize=4)
+def placement_table(width, height):
+    #PlacementTable of the lockstep simulator for a board size
+    if (width, height) == (GRID_WIDTH, GRID_HEIGHT):
+        return PLACEMENT_TABLE
+    return PlacementTable(grid_width=width, grid_height=height)
+
+def get_fitness_cache():
+    #The fitness cache, opened the first time it is needed
+    global fitness_cache
+    if fitness_cache is None:
+        fitness_cache = FitnessCache(FITNESS_CACHE_SIZE, FITNESS_CACHE_FILE)
+    return fitness_cache
+
+def game_cache_key(parameters, source):
+    #Cache key of an unrendered game: parameters, the piece source's seed and the rules the game is played under
+    return get_fitness_cache().key(parameters, source.seed, source.bag, ("placement", MAX_PIECES, BOARD_WIDTH, BOARD_HEIGHT, LOOKAHEAD_DEPTH, BEAM_WIDTH, EARLY_TERMINATION_HEIGHT))
+
+def cached_outcome(parameters, source):
+    #Cached (lines cleared, score) of the game, None if it has not been played or caching is off
+    if not USE_FITNESS_CACHE:
+        return None
+    return get_fitness_cache().get(game_cache_key(parameters, source))
+
+def play_cached_game(parameters, source, game=None):
+    #Play an unrendered fitness game unless its outcome is already cached, returns (lines cleared, score)
+    #game is (generation_idx, individual_idx, game_idx), needed to record the game's replay
+    outcome = cached_outcome(parameters, source)
+    if outcome is None:
+        key = game_cache_key(parameters, source) if USE_FITNESS_CACHE else None
+        moves = [] if RECORD_REPLAYS and game is not None else None
+        outcome = play_rules_game(parameters, source, game_rules(), moves)
+        if key is not None:
+            get_fitness_cache().put(key, *outcome)
+        if moves is not None:
+            record_replay(parameters, source, moves, *outcome, *game)
+    return outcome
+
+def play_fitness_game(task):
+    #Worker side of evaluate_population_parallel, only plays the game and never touches the result files
+    #With instrument set the worker's timings are sent back with the result, with record the game's placements
+    #Everything the game depends on comes with the task, the worker reads no settings of this module
+    individual_idx, game_idx, parameters, source, instrument, record, rules = task
+    if instrument and not instrumentation.enabled:
+        instrumentation.enable(None)
+    moves = [] if record else None
+    lines_cleared, game_score = play_rules_game(parameters, source, rules, moves)
+    snapshot = instrumentation.take_snapshot() if instrument else None
+    return individual_idx, game_idx, lines_cleared, game_score, snapshot, moves
+
+def evaluate_population_parallel(population, generation_idx, workers=None, chunk_size=None):
+    #Play every (individual, game) task in a process pool, results are merged and saved in the parent
+    outcomes = play_games_parallel(population, generation_idx, all_games(population), workers, chunk_size)
+    return record_outcomes(population, generation_idx, outcomes)
+
+def play_games_parallel(population, generation_idx, games, workers=None, chunk_size=None):
+    #(lines cleared, score) of every (individual_idx, game_idx) in games, played in a process pool
+    #Games found in the fitness cache are not sent to the workers
+    outcomes = {}
+    tasks = []
+    rules = game_rules()
+    for individual_idx, game_idx in games:
+        parameters = population[individual_idx]
+        source = piece_source(generation_idx, individual_idx, game_idx)
+        outcome = cached_outcome(parameters, source)
+        if outcome is None:
+            tasks.append((individual_idx, game_idx, np.asarray(parameters), source, instrumentation.enabled, RECORD_REPLAYS, rules))
+        else:
+            outcomes[individual_idx, game_idx] = outcome
+
+    if tasks:
+        from concurrent.futures import ProcessPoolExecutor  #Imported here, workers never need it
+        keys = [game_cache_key(parameters, source) if USE_FITNESS_CACHE else None for _, _, parameters, source, _, _, _ in tasks]
+        with ProcessPoolExecutor(max_workers=workers or WORKERS) as executor:
+            results = executor.map(play_fitness_game, tasks, chunksize=chunk_size or CHUNK_SIZE)
+            for key, task, (individual_idx, game_idx, lines, game_score, snapshot, moves) in zip(keys, tasks, results):
+                if snapshot is not None:
+                    instrumentation.merge(snapshot)
+                outcomes[individual_idx, game_idx] = (lines, game_score)
+                if key is not None:
+                    get_fitness_cache().put(key, lines, game_score)
+                if moves is not None:
+                    record_replay(task[2], task[3], moves, lines, game_score, generation_idx, individual_idx, game_idx)
+    return outcomes
+
+def play_population_games(population, generation_idx, games):
+    #(lines cleared, score) of the given unrendered games with the configured evaluation backend
+    if VECTORIZED_EVALUATION and LOOKAHEAD_DEPTH == 1:
+        return play_games_vectorized(population, generation_idx, games)
+    if PARALLEL_EVALUATION:
+        return play_games_parallel(population, generation_idx, games)
+    return {(individual_idx, game_idx): play_cached_game(population[individual_idx], piece_source(generation_idx, individual_idx, game_idx),
+                                                         (generation_idx, individual_idx, game_idx))
+            for individual_idx, game_idx in games}
+
+def racing_schedule():
+    #Cumulative games per individual after each round of evaluate_population_racing: 1, 2, 4, ... up to NUM_GAMES
+    schedule = [1]
+    while schedule[-1] < NUM_GAMES:
+        schedule.append(min(NUM_GAMES, schedule[-1] * 2))
+    return schedule
+
+def evaluate_population_racing(population, generation_idx):
+    #Successive halving: everyone plays the first game, then after every round the RACING_DROP_FRACTION of the
+    #survivors with the lowest mean game score is dropped and the rest play up to the next racing_schedule() count
+    #All individuals play the same games first (common random numbers), so the means are compared on equal terms
+    survivors = list(range(len(population)))
+    outcomes = {}
+    played = 0
+    for round_idx, games_per_individual in enumerate(racing_schedule()):
+        if round_idx:
+            keep = max(RACING_MIN_SURVIVORS, math.ceil(len(survivors) * (1 - RACING_DROP_FRACTION)))
+            means = [np.mean([outcomes[individual_idx, game_idx][1] for game_idx in range(played)]) for individual_idx in survivors]
+            order = np.argsort(means, kind="stable")[::-1]
+            survivors = sorted(survivors[i] for i in order[:keep])
+        games = [(individual_idx, game_idx) for individual_idx in survivors for game_idx in range(played, games_per_individual)]
+        outcomes.update(play_population_games(population, generation_idx, games))
+        played = games_per_individual
+    print_colored(f"Racing: {len(outcomes)} of {len(population) * NUM_GAMES} games played, {len(survivors)} individuals played all {NUM_GAMES}", '90')
+    return record_outcomes(population, generation_idx, outcomes)
+
+def batch_fitness(population, generation_idx):
+    #Play every fitness game of the population (an (n, 4) matrix) in one batch on the configured unrendered backend
+    #Results and the high score are recorded like evaluate_population, returns the mean lines cleared per individual
+    outcomes = play_population_games(population, generation_idx, all_games(population))
+    record_outcomes(population, generation_idx, outcomes)
+    lines_cleared = np.zeros((len(population), NUM_GAMES))
+    for (individual_idx, game_idx), (lines, _) in outcomes.items():
+        lines_cleared[individual_idx, game_idx] = lines
+    return lines_cleared.mean(axis=1)
+
 def select_parents(population, scores):
     tournament_size = min(TOURNAMENT_SIZE, len(population))
     tournament_indices = np.random.choice(len(population), size=tournament_size, replace=False)
@@ -267,39 +612,233 @@ def delete_n_last_replacement(population, scores, offspring):
     new_population.extend(offspring)  #Add new offspring to the population
     return new_population
 
+def next_generation(population, scores):
+    #Breed OFFSPRING_SIZE children with the operators above and let them replace the weakest individuals
+    offspring = []
+    for _ in range(OFFSPRING_SIZE):
+        parent1, parent2 = select_parents(population, scores)
+        if np.random.rand() < CROSSOVER_RATE:
+            child = crossover(parent1, parent2)
+        else:
+            child = np.array(parent1, dtype=np.float64)  #mutate works in place, never on a parent
+        offspring.append(mutate(child))
+    return delete_n_last_replacement(population, scores, offspring)
+
+
+class GeneticOptimizer(Optimizer):
+    #The GA's population behind the optimizer interface. tell() keeps the population like the training loop
+    #always did, breeding with next_generation would need per-individual fitness rather than the high scores
+
+    def __init__(self, population):
+        self.population = list(population)
+
+    def ask(self):
+        return self.population
+
+    def tell(self, population, scores):
+        self.population = list(population)
+
+    def state(self):
+        return {"population": np.array(self.population, dtype=np.float64)}
+
+    def load_state(self, state):
+        self.population = list(state["population"])
+
+def create_optimizer(state=None):
+    #The OPTIMIZER backend, continued from a checkpointed optimizer state when one is given
+    if OPTIMIZER == "ga":
+        return GeneticOptimizer(initialize_population() if state is None else state["population"])
+    if OPTIMIZER == "cmaes":
+        if state is not None:
+            optimizer = CMAES(state["mean"], CMA_SIGMA, CMA_POPULATION_SIZE)
+            optimizer.load_state(state)
+            return optimizer
+        previous_best = get_results_store().best()
+        mean = previous_best[0] if previous_best is not None else np.random.randn(4)  #Start at the best found so far
+        return CMAES(mean, CMA_SIGMA, CMA_POPULATION_SIZE, seed=np.random.randint(2**31))
+    raise ValueError(f"Unknown optimizer: {OPTIMIZER}")
+
+
+def checkpoint_config():
+    #Settings a checkpoint is only valid for, resuming under different ones would not continue the same run
+    config = {"population_size": POPULATION_SIZE, "num_games": NUM_GAMES, "max_pieces": MAX_PIECES, "evaluation_seed": EVALUATION_SEED,
+            "common_random_numbers": COMMON_RANDOM_NUMBERS, "bag_randomizer": BAG_RANDOMIZER, "reseed": RESEED_EVERY_GENERATION,
+            "lookahead_depth": LOOKAHEAD_DEPTH, "beam_width": BEAM_WIDTH, "grid": (BOARD_WIDTH, BOARD_HEIGHT),
+            "racing": (RACING_EVALUATION, RACING_DROP_FRACTION, RACING_MIN_SURVIVORS), "early_termination_height": EARLY_TERMINATION_HEIGHT}
+    if OPTIMIZER != "ga":
+        config["optimizer"] = (OPTIMIZER, CMA_POPULATION_SIZE, CMA_SIGMA)
+    return config
+
+def save_ga_checkpoint(optimizer, scores, next_generation_idx, best_parameters, best_score, games_played):
+    #Checkpoint the state at the end of a generation, after the results store and the cache were flushed
+    state = {
+        "config": checkpoint_config(),
+        "generation": next_generation_idx,
+        "optimizer": optimizer.state(),
+        "scores": None if scores is None else np.array(scores),
+        "best_parameters": best_parameters,
+        "best_score": best_score,
+        "games_played": games_played,
+        "high_score": load_high_score(),
+        "results_count": len(get_results_store()),
+        "replays_count": len(get_replay_log()) if RECORD_REPLAYS else None,
+        "cache_entries": get_fitness_cache().export_entries() if USE_FITNESS_CACHE and FITNESS_CACHE_FILE is None else None,
+    }
+    save_checkpoint(CHECKPOINT_FILE, state)
+
+def resume_ga_checkpoint():
+    #Restore the RNGs, high score, results store and cache from the checkpoint and return its state, None without one
+    #Results saved after the checkpoint belong to the generation that is played again and are dropped
+    state = load_checkpoint(CHECKPOINT_FILE)
+    if state is None:
+        return None
+    if state["config"] != checkpoint_config():
+        print_colored(f"Warning: checkpoint settings {state['config']} differ from the current ones", '33')
+    save_high_score(state["high_score"])
+    get_results_store().truncate(state["results_count"])
+    if state.get("replays_count") is not None and RECORD_REPLAYS:
+        get_replay_log().truncate(state["replays_count"])
+    if state["cache_entries"] is not None and USE_FITNESS_CACHE:
+        get_fitness_cache().import_entries(state["cache_entries"])
+    if "optimizer" not in state:
+        state["optimizer"] = {"population": state["population"]}  #Checkpoints written before the optimizer interface
+    return state
+
+def optimize(resume=False):
+    #Train with the OPTIMIZER backend: ask it for a population, evaluate the population in one batch, tell it the
+    #scores. The GA is scored by evaluate_population, other optimizers by the mean lines cleared of batch_fitness.
+    state = resume_ga_checkpoint() if resume else None
+    if state is None:
+        if resume:
+            print_colored(f"No checkpoint at {CHECKPOINT_FILE}, starting a new run", '33')
+        optimizer = create_optimizer()
+        start_generation = 0
+        best_parameters = None
+        best_score = -float('inf')
+        games_played = 0
+    else:
+        optimizer = create_optimizer(state["optimizer"])
+        start_generation = state["generation"]
+        best_parameters = state["best_parameters"]
+        best_score = state["best_score"]
+        games_played = state.get("games_played", 0)
+        print(f"Resuming from {CHECKPOINT_FILE} at generation {start_generation + 1}/{GENERATIONS}, best score so far {best_score}")
 
-def genetic_algorithm():
-    population = initialize_population()
-    high_score = load_high_score()
-    best_parameters = None
-    best_score = -float('inf')
-    
     try:
-        for generation in range(GENERATIONS):
+        for generation in range(start_generation, GENERATIONS):
             print(f"Generation: {generation + 1}/{GENERATIONS}")
-            scores = evaluate_population(population, generation)
+            generation_start = time.perf_counter()
+            if instrumentation.enabled:
+                instrumentation.reset()
+            population = optimizer.ask()
+            results_before = len(get_results_store())
+            if isinstance(optimizer, GeneticOptimizer):
+                scores = evaluate_population(population, generation)
+            else:
+                scores = batch_fitness(population, generation)
+            games_played += len(get_results_store()) - results_before  #Every fitness game saves one result
+            with instrumentation.phase("persistence"):
+                get_results_store().flush()
+                if RECORD_REPLAYS:
+                    get_replay_log().flush()
+                if USE_FITNESS_CACHE:
+                    get_fitness_cache().flush()
+            if USE_FITNESS_CACHE:
+                hits, misses = get_fitness_cache().take_stats()
+                print_colored(f"Fitness cache: {hits} hits, {misses} misses", '90')
+            if instrumentation.enabled:
+                summary = instrumentation.summarize(generation, time.perf_counter() - generation_start)
+                if USE_FITNESS_CACHE:
+                    summary["cache_hits"], summary["cache_misses"] = hits, misses
+                instrumentation.write_summary(summary)
+                print_colored(f"Timing: {instrumentation.format_summary(summary)}", '90')
 
             # Check if the best score in this generation is better than the current best
             generation_best_idx = np.argmax(scores)
             generation_best_score = scores[generation_best_idx]
-            print(f"Best score this generation: {generation_best_score}")
+            print(f"Best score this generation: {generation_best_score}, {games_played} games played so far")
 
             if generation_best_score > best_score:
                 best_score = generation_best_score
-                best_parameters = population[generation_best_idx]
+                best_parameters = np.array(population[generation_best_idx], dtype=np.float64)
                 print(f"New best parameters found: {best_parameters}")
                 save_parameters(best_parameters)  # Save the best parameters found so far
 
+            optimizer.tell(population, scores)
+            reached_target = TARGET_LINES is not None and not isinstance(optimizer, GeneticOptimizer) and generation_best_score >= TARGET_LINES
+
+            if CHECKPOINT_EVERY and ((generation + 1) % CHECKPOINT_EVERY == 0 or generation + 1 == GENERATIONS or reached_target):
+                with instrumentation.phase("persistence"):
+                    save_ga_checkpoint(optimizer, scores, generation + 1, best_parameters, best_score, games_played)
+            if reached_target:
+                print(f"Reached {TARGET_LINES} lines per game after {games_played} games")
+                break
+
         print("Final Best Parameters:", best_parameters)
         return best_parameters
 
     except KeyboardInterrupt:
-        print("Genetic Algorithm interrupted. Saving best parameters found so far.")
+        print(f"Training interrupted. Saving best parameters found so far, resume with --resume from {CHECKPOINT_FILE}.")
         if best_parameters is not None:
             save_parameters(best_parameters)
+        get_results_store().flush()
+        if RECORD_REPLAYS:
+            get_replay_log().flush()
         sys.exit(0)
 
-if __name__ == "__main__":
-    best_params = genetic_algorithm()
+def main(argv=None):
+    #Command line of ai.py, also run by "python cli.py train"
+    import argparse
+    global CHECKPOINT_FILE, RACING_EVALUATION, EARLY_TERMINATION_HEIGHT, RECORD_REPLAYS, REPLAYS_FILE, PARALLEL_EVALUATION, WORKERS, CHUNK_SIZE
+    global HEADLESS, RENDER_EVERY_N_GAMES, RENDER_EVERY_N_FRAMES, BOARD_WIDTH, BOARD_HEIGHT, OPTIMIZER, CMA_POPULATION_SIZE, TARGET_LINES
+    parser = argparse.ArgumentParser(description="Train the Tetris AI with the genetic algorithm or CMA-ES")
+    parser.add_argument("--optimizer", choices=("ga", "cmaes"), default=OPTIMIZER, help="optimizer backend (optimizers.py)")
+    parser.add_argument("--cma-population", type=int, default=CMA_POPULATION_SIZE, metavar="N", help="samples per CMA-ES generation")
+    parser.add_argument("--target-lines", type=float, default=TARGET_LINES, metavar="LINES",
+                        help="cmaes: stop once a sample clears LINES lines per game on average")
+    parser.add_argument("--headless", action="store_true", help="never open a window, train as fast as possible")
+    parser.add_argument("--render-every-game", type=int, default=RENDER_EVERY_N_GAMES, metavar="N", help="only render every Nth game")
+    parser.add_argument("--render-every-frame", type=int, default=RENDER_EVERY_N_FRAMES, metavar="N", help="only draw every Nth move of a rendered game")
+    parser.add_argument("--workers", type=int, default=0, metavar="N", help="evaluate games in N worker processes (implies --headless)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, metavar="N", help="tasks sent to a worker at a time")
+    parser.add_argument("--instrument", nargs="?", const=INSTRUMENTATION_LOG, default=INSTRUMENTATION_LOG if INSTRUMENT else None, metavar="LOG",
+                        help="print per-generation timings and append them as JSON lines to LOG")
+    parser.add_argument("--racing", action="store_true", help="successive halving: drop weak individuals after their first games")
+    parser.add_argument("--early-termination", type=int, default=EARLY_TERMINATION_HEIGHT, metavar="ROWS",
+                        help="end unrendered games once the stack is higher than ROWS")
+    parser.add_argument("--record-replays", nargs="?", const=REPLAYS_FILE, default=REPLAYS_FILE if RECORD_REPLAYS else None, metavar="FILE",
+                        help="append a compact replay of every unrendered game to FILE (see replay.py)")
+    parser.add_argument("--board", type=parse_size, default=(BOARD_WIDTH, BOARD_HEIGHT), metavar="WxH",
+                        help="board size of the fitness games, e.g. 20x40 (other sizes than the window are never rendered)")
+    parser.add_argument("--resume", action="store_true", help=f"continue the run saved in {CHECKPOINT_FILE}")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, metavar="FILE", help="checkpoint file to write and resume from")
+    args = parser.parse_args(argv)
+    if args.early_termination is not None and args.early_termination < 0:
+        parser.error("--early-termination must be a number of rows >= 0")
+    CHECKPOINT_FILE = args.checkpoint
+    BOARD_WIDTH, BOARD_HEIGHT = args.board
+    OPTIMIZER = args.optimizer
+    CMA_POPULATION_SIZE = args.cma_population
+    TARGET_LINES = args.target_lines
+    RACING_EVALUATION = RACING_EVALUATION or args.racing
+    EARLY_TERMINATION_HEIGHT = args.early_termination
+    if args.record_replays:
+        RECORD_REPLAYS = True
+        REPLAYS_FILE = args.record_replays
+    if args.instrument:
+        instrumentation.enable(args.instrument)
+    if args.workers:
+        PARALLEL_EVALUATION = True
+        WORKERS = args.workers
+        CHUNK_SIZE = args.chunk_size
+    HEADLESS = args.headless
+    RENDER_EVERY_N_GAMES = args.render_every_game
+    RENDER_EVERY_N_FRAMES = args.render_every_frame
+
+    best_params = optimize(args.resume)
     loaded_params = load_parameters()  # Load parameters at the end
-    print("Best Parameters loaded after running GA:", loaded_params)
\ No newline at end of file
+    print("Best Parameters loaded after running GA:", loaded_params)
+    return best_params
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from tetris import check_collision, lock_piece, clear_lines, rotate, spawn_piece, create_empty_grid, copy_grid, GRID_WIDTH, GRID_HEIGHT
+from utils import get_best_move, score_parameters, generate_placements
+from bitboard import BitBoard
+from pieces import PieceSource
+from simulator import play_game
+from engine import get_engine, parse_size
+
+#Throughput benchmarks of the engine and AI hot paths. Every number is calls (or games, generations) per
+#second, best of several repeats, measured on a corpus of mid-game boards built from seeded games so runs
+#on different days and machines measure the same work. Results are JSON with machine metadata, and
+#--baseline compares a run against a stored one and flags slowdowns beyond --threshold.
+
+#Reasonable trained weights, so the corpus looks like boards the AI actually produces
+BENCHMARK_PARAMETERS = np.array([-0.510066, 0.760666, -0.35663, -0.184483])
+
+CORPUS_SIZE = 100
+CORPUS_SEED = 0
+REPEATS = 5
+MIN_TIME = 0.2  #Seconds each repeat runs for at least, short benchmarks are looped
+DEFAULT_THRESHOLD = 0.10  #Relative slowdown reported as a regression
+BOARD_SIZES = ((10, 20), (20, 40), (40, 80))  #Board sizes of the decisions benchmark (engine.py)
+
+
+def build_board_corpus(num_boards=CORPUS_SIZE, seed=CORPUS_SEED, parameters=BENCHMARK_PARAMETERS, min_pieces=10, max_pieces=80):
+    #Mid-game positions: board i comes from a game seeded with (seed, i) stopped after a random number of pieces
+    #Each entry is a dict with the list grid, the falling shape and spawn position, the AI's placement
+    #(rotated shape, x, y) and the grid with that placement locked but its lines not yet cleared
+    #A game that ends early contributes its last position
+    corpus = []
+    for board_idx in range(num_boards):
+        source = PieceSource(derived_seed(seed, board_idx))
+        stop_after = source.rng.randrange(min_pieces, max_pieces)
+        grid = create_empty_grid()
+        shape, piece_x, piece_y = spawn_piece(source)
+        entry = None
+        for _ in range(stop_after + 1):
+            move = get_best_move(grid, shape, piece_x, piece_y, parameters)
+            if move is None:
+                break
+            rotation, best_x, best_y = move
+            placed = shape
+            for _ in range(rotation):
+                placed = rotate(placed)
+            locked = copy_grid(grid)
+            lock_piece(locked, placed, best_x, best_y)
+            entry = {"grid": grid, "shape": shape, "piece_x": piece_x, "piece_y": piece_y,
+                     "placed": placed, "x": best_x, "y": best_y, "locked": locked}
+            grid = copy_grid(locked)
+            clear_lines(grid)
+            shape, piece_x, piece_y = spawn_piece(source)
+            if check_collision(grid, shape, piece_x, piece_y):
+                break
+        corpus.append(entry)
+    return corpus
+
+
+def derived_seed(seed, index):
+    return int(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+
+
+def measure(function, make_calls, repeats=REPEATS, min_time=MIN_TIME):
+    #Best-of-repeats throughput of function in calls per second
+    #make_calls() returns a fresh list of argument tuples for one pass, built outside the timer so
+    #mutating calls (lock_piece, clear_lines) always start from the same boards
+    def timed_pass():
+        calls = make_calls()
+        start = time.perf_counter()
+        for args in calls:
+            function(*args)
+        return time.perf_counter() - start, len(calls)
+
+    elapsed, count = timed_pass()
+    passes = max(1, math.ceil(min_time / max(elapsed, 1e-9)))
+    best = float("inf")
+    for _ in range(repeats):
+        total_elapsed = 0.0
+        total_count = 0
+        for _ in range(passes):
+            elapsed, count = timed_pass()
+            total_elapsed += elapsed
+            total_count += count
+        best = min(best, total_elapsed / total_count)
+    return {"ops_per_sec": 1 / best, "us_per_op": best * 1e6, "calls_per_repeat": passes * count}
+
+
+def engine_boards(corpus, engine, key="grid"):
+    #The corpus boards of one engine ("list" or "bitboard")
+    if engine == "bitboard":
+        return [BitBoard.from_grid(entry[key]) for entry in corpus]
+    return [entry[key] for entry in corpus]
+
+
+def copies(boards):
+    return [board.copy() if isinstance(board, BitBoard) else copy_grid(board) for board in boards]
+
+
+def bench_engine(corpus, engine, repeats=REPEATS):
+    #check_collision, lock_piece, clear_lines, score_parameters and get_best_move on one engine
+    boards = engine_boards(corpus, engine)
+    locked = engine_boards(corpus, engine, "locked")
+    parameters = BENCHMARK_PARAMETERS
+    results = {}
+    #Landing position and the blocked row below it, the two checks every drop ends with
+    collision_calls = [(board, entry["placed"], entry["x"], entry["y"] + dy) for board, entry in zip(boards, corpus) for dy in (0, 1)]
+    results["check_collision"] = measure(check_collision, lambda: collision_calls, repeats)
+    results["lock_piece"] = measure(lock_piece, lambda: [(board, entry["placed"], entry["x"], entry["y"]) for board, entry in zip(copies(boards), corpus)], repeats)
+    results["clear_lines"] = measure(clear_lines, lambda: [(board,) for board in copies(locked)], repeats)
+    score_calls = [(board, parameters) for board in locked]
+    results["score_parameters"] = measure(score_parameters, lambda: score_calls, repeats)
+    move_calls = [(board, entry["shape"], entry["piece_x"], entry["piece_y"], parameters) for board, entry in zip(boards, corpus)]
+    results["get_best_move"] = measure(get_best_move, lambda: move_calls, repeats)
+    return {f"{name}[{engine}]": result for name, result in results.items()}
+
+
+def bench_rotate(corpus, repeats=REPEATS):
+    rotate_calls = [(entry["shape"],) for entry in corpus]
+    return {"rotate": measure(rotate, lambda: rotate_calls, repeats)}
+
+
+def bench_games(num_games=20, max_pieces=500, seed=CORPUS_SEED, repeats=REPEATS):
+    #Full headless games (simulator.play_game on bitboards), games and pieces per second
+    best = float("inf")
+    pieces = 0
+    for _ in range(max(1, repeats // 2)):
+        start = time.perf_counter()
+        pieces = sum(play_game(BENCHMARK_PARAMETERS, max_pieces, seed=derived_seed(seed, game_idx))[2] for game_idx in range(num_games))
+        best = min(best, time.perf_counter() - start)
+    return {"games": {"ops_per_sec": num_games / best, "pieces_per_sec": pieces / best,
+                      "num_games": num_games, "max_pieces": max_pieces}}
+
+
+def bench_generation(population_size=10, num_games=None, seed=CORPUS_SEED):
+    #One complete, unrendered GA generation (ai.evaluate_population) with result files in a temporary directory
+    import ai
+
+    saved = {name: getattr(ai, name) for name in ("HEADLESS", "USE_FITNESS_CACHE", "RESULTS_FILE", "LEGACY_RESULTS_FILE",
+                                                   "HIGH_SCORE_FILE", "NUM_GAMES", "results_store")}
+    rng = np.random.default_rng(seed)
+    population = [vec / np.linalg.norm(vec) for vec in rng.standard_normal((population_size, 4))]
+    with tempfile.TemporaryDirectory() as directory:
+        ai.HEADLESS = True
+        ai.USE_FITNESS_CACHE = False
+        ai.RESULTS_FILE = os.path.join(directory, "game_results.bin")
+        ai.LEGACY_RESULTS_FILE = os.path.join(directory, "game_results.txt")
+        ai.HIGH_SCORE_FILE = os.path.join(directory, "high_score.txt")
+        ai.NUM_GAMES = num_games or ai.NUM_GAMES
+        ai.results_store = None
+        ai.generation_bank.cache_clear()
+        try:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ai.evaluate_population(population, 0)
+                ai.get_results_store().flush()
+            elapsed = time.perf_counter() - start
+            config = {"population_size": population_size, "num_games": ai.NUM_GAMES, "max_pieces": ai.MAX_PIECES}
+        finally:
+            for name, value in saved.items():
+                setattr(ai, name, value)
+            ai.generation_bank.cache_clear()
+    return {"ga_generation": {"ops_per_sec": 1 / elapsed, "seconds": elapsed, **config}}
+
+
+#Modules a pool worker or a headless run imports, measured in fresh interpreters
+STARTUP_MODULES = ("simulator", "ai", "islands", "game", "replay")
+
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, "pygame" in sys.modules)
+"""
+
+
+def bench_startup(modules=STARTUP_MODULES, repeats=REPEATS):
+    #Import time of each module in a fresh interpreter (what every spawned worker pays), best of repeats
+    #Also records whether the import pulled in pygame, which only the viewers may do
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        best = float("inf")
+        best_process = float("inf")
+        imports_pygame = False
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(module=module)], capture_output=True,
+                                    text=True, cwd=directory, check=True).stdout.split()
+            best_process = min(best_process, time.perf_counter() - start)
+            best = min(best, float(output[-2]))
+            imports_pygame = output[-1] == "True"
+        results[f"startup[{module}]"] = {"ops_per_sec": 1 / best, "import_seconds": best, "process_seconds": best_process,
+                                         "imports_pygame": imports_pygame}
+    return results
+
+
+def build_size_corpus(engine, num_boards=CORPUS_SIZE, seed=CORPUS_SEED, parameters=BENCHMARK_PARAMETERS):
+    #get_best_move calls of consecutive decisions of seeded games on the engine's boards, a lost game is
+    #followed by the next seed until num_boards decisions are collected
+    calls = []
+    game_idx = 0
+    while len(calls) < num_boards:
+        source = engine.piece_source(derived_seed(seed, game_idx))
+        board = engine.create_board()
+        shape, piece_x, piece_y = engine.spawn_piece(source)
+        while len(calls) < num_boards:
+            move = get_best_move(board, shape, piece_x, piece_y, parameters)
+            if move is None:
+                break
+            calls.append((board.copy(), shape, piece_x, piece_y, parameters))
+            rotation, best_x, best_y = move
+            for _ in range(rotation):
+                shape = rotate(shape)
+            board.lock_piece(shape, best_x, best_y)
+            board.clear_lines()
+            shape, piece_x, piece_y = engine.spawn_piece(source)
+            if board.check_collision(shape, piece_x, piece_y):
+                break
+        game_idx += 1
+    return calls
+
+
+def bench_board_sizes(sizes=BOARD_SIZES, num_boards=CORPUS_SIZE, seed=CORPUS_SEED, repeats=REPEATS):
+    #AI decisions (get_best_move on bitboards) per second at every board size
+    results = {}
+    for width, height in sizes:
+        engine = get_engine(width, height)
+        calls = build_size_corpus(engine, num_boards, seed)
+        placements = sum(len(list(generate_placements(board, shape, piece_y))) for board, shape, _, piece_y, _ in calls) / len(calls)
+        result = measure(get_best_move, lambda: calls, repeats)
+        result["placements_per_decision"] = placements
+        results[f"decisions[{width}x{height}]"] = result
+    return results
+
+
+def machine_metadata():
+    #Where and on what the numbers were measured
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "numpy": np.__version__,
+        "commit": commit or None,
+    }
+
+
+def run_benchmarks(corpus_size=CORPUS_SIZE, seed=CORPUS_SEED, repeats=REPEATS, num_games=20, population_size=10, skip_generation=False,
+                   skip_startup=False, sizes=BOARD_SIZES):
+    corpus = build_board_corpus(corpus_size, seed)
+    benchmarks = {}
+    benchmarks.update(bench_rotate(corpus, repeats))
+    for engine in ("list", "bitboard"):
+        benchmarks.update(bench_engine(corpus, engine, repeats))
+    benchmarks.update(bench_games(num_games, seed=seed, repeats=repeats))
+    if sizes:
+        benchmarks.update(bench_board_sizes(sizes, corpus_size, seed, repeats))
+    if not skip_generation:
+        benchmarks.update(bench_generation(population_size, seed=seed))
+    if not skip_startup:
+        benchmarks.update(bench_startup(repeats=repeats))
+    config = {"corpus_size": corpus_size, "seed": seed, "repeats": repeats, "min_time": MIN_TIME,
+              "grid": [GRID_WIDTH, GRID_HEIGHT]}
+    return {"metadata": machine_metadata(), "config": config, "benchmarks": benchmarks}
+
+
+def compare_results(baseline, results, threshold=DEFAULT_THRESHOLD):
+    #(name, baseline ops/sec, new ops/sec, relative change, regressed) for every benchmark in both runs
+    rows = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        old = baseline["benchmarks"][name]["ops_per_sec"]
+        new = result["ops_per_sec"]
+        change = new / old - 1
+        rows.append((name, old, new, change, change < -threshold))
+    return rows
+
+
+def print_results(results):
+    for name, result in results["benchmarks"].items():
+        note = "  (imports pygame)" if result.get("imports_pygame") else ""
+        print(f"{name:<28} {result['ops_per_sec']:>14,.1f} /s{note}")
+
+
+def print_comparison(rows, threshold):
+    for name, old, new, change, regressed in rows:
+        flag = "  SLOWER" if regressed else ""
+        print(f"{name:<28} {old:>14,.1f} -> {new:>14,.1f} /s  {change:+7.1%}{flag}")
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slowed down by more than {threshold:.0%}")
+    else:
+        print(f"No slowdown beyond {threshold:.0%}")
+    return regressions
+
+
+def load_results(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_results(results, path):
+    #Write through a temporary file so an interrupted run never leaves a truncated baseline
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(results, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def main(argv=None):
+    #Command line of benchmark.py, also run by "python cli.py bench"
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the Tetris engine and AI hot paths")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against a stored results file, exit 1 on a slowdown")
+    parser.add_argument("--compare", metavar="FILE", help="compare this results file with --baseline instead of running")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative slowdown that counts as a regression")
+    parser.add_argument("--corpus-size", type=int, default=CORPUS_SIZE, metavar="N", help="number of mid-game boards")
+    parser.add_argument("--seed", type=int, default=CORPUS_SEED, help="seed of the board corpus and games")
+    parser.add_argument("--repeats", type=int, default=REPEATS, metavar="N", help="repeats per benchmark, the best one counts")
+    parser.add_argument("--games", type=int, default=20, metavar="N", help="headless games in the games benchmark")
+    parser.add_argument("--population", type=int, default=10, metavar="N", help="population size of the GA generation benchmark")
+    parser.add_argument("--skip-generation", action="store_true", help="leave out the GA generation benchmark")
+    parser.add_argument("--skip-startup", action="store_true", help="leave out the module import time benchmarks")
+    parser.add_argument("--sizes", default=",".join(f"{width}x{height}" for width, height in BOARD_SIZES), metavar="WxH,...",
+                        help="board sizes of the decisions benchmark, empty to leave it out")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        if not args.baseline:
+            parser.error("--compare needs --baseline")
+        results = load_results(args.compare)
+    else:
+        results = run_benchmarks(args.corpus_size, args.seed, args.repeats, args.games, args.population, args.skip_generation,
+                                  args.skip_startup, [parse_size(size) for size in args.sizes.split(",") if size])
+        print_results(results)
+        if args.output:
+            save_results(results, args.output)
+
+    if args.baseline:
+        print(f"\nCompared with {args.baseline}:")
+        if print_comparison(compare_results(load_results(args.baseline), results, args.threshold), args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+from tetris import SHAPES, GRID_WIDTH, GRID_HEIGHT, ORIENTATIONS, rotate, shape_key, orientation_table
+
+#Bitboard engine: every row of the board is one integer, bit x set means column x is filled.
+#Pieces are stored as precomputed row masks for every orientation and column offset, so
+#collision, locking and line clearing are a handful of bitwise operations per piece row.
+
+
+def build_piece_masks(shapes, width):
+    #Precompute the row masks of every rotation of every shape at every column offset
+    #Returns {shape_key: {x: (row_mask, ...)}}, only legal (in-bounds) x offsets are present
+    masks = {}
+    for shape in shapes:
+        rotated = shape
+        for _ in range(4):
+            key = shape_key(rotated)
+            if key not in masks:
+                base = [sum(1 << col_idx for col_idx, cell in enumerate(row) if cell) for row in rotated]
+                masks[key] = {x: tuple(row_mask << x for row_mask in base) for x in range(width - len(rotated[0]) + 1)}
+            rotated = rotate(rotated)
+    return masks
+
+
+PIECE_MASKS = build_piece_masks(SHAPES, GRID_WIDTH)
+
+#(piece masks, orientation table) of SHAPES per board width, built once per width
+_tables = {GRID_WIDTH: (PIECE_MASKS, ORIENTATIONS)}
+
+
+#Piece masks by shape object: id(shape) -> (shape, piece mask table, {x: row masks}). Orientation shapes and
+#SHAPES are long-lived, so check_collision / lock_piece find them here without building a shape_key every call.
+#The entry keeps its shape alive, so its id cannot be reused while it is cached; shapes must not be changed in place.
+_masks_by_id = {}
+MASK_CACHE_SIZE = 4096
+
+
+def width_tables(width):
+    tables = _tables.get(width)
+    if tables is None:
+        tables = (build_piece_masks(SHAPES, width), orientation_table(width))
+        _tables[width] = tables
+    return tables
+
+
+class BitBoard:
+    #Tetris board stored as one integer bitmask per row (row 0 is the top row)
+    #engine (engine.py) supplies the piece set and its tables, without one the board plays SHAPES
+
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT, rows=None, engine=None):
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.rows = list(rows) if rows is not None else [0] * height
+        if engine is not None:
+            self.shapes = engine.shapes
+            self.piece_masks = engine.piece_masks
+            self.orientations = engine.orientations
+        else:
+            self.shapes = SHAPES
+            self.piece_masks, self.orientations = width_tables(width)
+
+    @classmethod
+    def from_grid(cls, grid, engine=None):
+        #Build a bitboard from a list-of-lists grid, playing with the tables of engine when one is given
+        width = len(grid[0])
+        rows = [sum(1 << x for x, cell in enumerate(row) if cell) for row in grid]
+        return cls(width, len(grid), rows, engine=engine)
+
+    def to_grid(self):
+        #Convert the bitboard back to a list-of-lists grid
+        return [[(row >> x) & 1 for x in range(self.width)] for row in self.rows]
+
+    def copy(self):
+        board = BitBoard.__new__(BitBoard)
+        board.width = self.width
+        board.height = self.height
+        board.full_row = self.full_row
+        board.rows = self.rows[:]
+        board.shapes = self.shapes
+        board.piece_masks = self.piece_masks
+        board.orientations = self.orientations
+        return board
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, y):
+        #Read-only row view so drawing and feature code can keep using grid[y][x]
+        row = self.rows[y]
+        return [(row >> x) & 1 for x in range(self.width)]
+
+    def __eq__(self, other):
+        if isinstance(other, BitBoard):
+            return self.rows == other.rows
+        return self.to_grid() == other
+
+    def masks_for(self, shape, x):
+        #Row masks of the shape placed at column x, None if the shape does not fit horizontally
+        entry = _masks_by_id.get(id(shape))
+        if entry is not None and entry[0] is shape and entry[1] is self.piece_masks:
+            return entry[2].get(x)
+        masks = self.piece_masks[shape_key(shape)]
+        if len(_masks_by_id) >= MASK_CACHE_SIZE:
+            _masks_by_id.clear()
+        _masks_by_id[id(shape)] = (shape, self.piece_masks, masks)
+        return masks.get(x)
+
+    def get_orientations(self, shape):
+        #Distinct orientations of the shape with the column range of this board's width
+        return self.orientations[shape_key(shape)]
+
+    def check_collision(self, shape, x, y):
+        #Same semantics as tetris.check_collision: walls, floor and filled cells collide
+        entry = _masks_by_id.get(id(shape))  #masks_for inlined, this is the hottest call of the row-by-row games
+        if entry is not None and entry[0] is shape and entry[1] is self.piece_masks:
+            masks = entry[2].get(x)
+        else:
+            masks = self.masks_for(shape, x)
+        if masks is None or y + len(masks) > self.height:
+            return True
+        rows = self.rows
+        for mask in masks:
+            if rows[y] & mask:
+                return True
+            y += 1
+        return False
+
+    def lock_piece(self, shape, x, y):
+        #OR the piece masks into the board rows
+        rows = self.rows
+        for mask in self.masks_for(shape, x):
+            rows[y] |= mask
+            y += 1
+
+    def column_heights(self):
+        #Height of every column, 0 for an empty column
+        heights = [0] * self.width
+        seen = 0
+        for row_idx, row in enumerate(self.rows):
+            new_cols = row & ~seen
+            while new_cols:
+                low = new_cols & -new_cols
+                heights[low.bit_length() - 1] = self.height - row_idx
+                new_cols ^= low
+            seen |= row
+        return heights
+
+    def column_profile(self):
+        #Height and number of holes of every column in one pass over the rows
+        #The holes of all columns are counted at once: every row's hole mask is added into bit-sliced
+        #counters (planes[k] holds bit k of every column's count), so the cost grows with the height and
+        #log(height) per column, not with the number of cells
+        heights = [0] * self.width
+        planes = []
+        seen = 0
+        for row_idx, row in enumerate(self.rows):
+            new_cols = row & ~seen
+            while new_cols:
+                low = new_cols & -new_cols
+                heights[low.bit_length() - 1] = self.height - row_idx
+                new_cols ^= low
+            carry = seen & ~row
+            plane_idx = 0
+            while carry:
+                if plane_idx == len(planes):
+                    planes.append(0)
+                plane = planes[plane_idx]
+                planes[plane_idx] = plane ^ carry
+                carry &= plane
+                plane_idx += 1
+            seen |= row
+        holes = [0] * self.width
+        for plane_idx, plane in enumerate(planes):
+            while plane:
+                low = plane & -plane
+                holes[low.bit_length() - 1] += 1 << plane_idx
+                plane ^= low
+        return heights, holes
+
+    def full_rows(self):
+        #Indices of the complete rows
+        full = self.full_row
+        return [i for i, row in enumerate(self.rows) if row == full]
+
+    def clear_lines(self):
+        #Remove complete rows and shift everything above them down
+        full = self.full_row
+        kept = [row for row in self.rows if row != full]
+        num_lines_cleared = self.height - len(kept)
+        if num_lines_cleared:
+            self.rows = [0] * num_lines_cleared + kept
+        return num_lines_cleared
+
+    def is_game_over(self):
+        #Game over when any block is in the top row
+        return self.rows[0] != 0
+
+    def features(self):
+        #Aggregate height (filled cells), complete lines, holes and bumpiness, matching utils.score_parameters
+        filled = 0
+        complete_lines = 0
+        holes = 0
+        seen = 0
+        heights = [0] * self.width
+        full = self.full_row
+        for row_idx, row in enumerate(self.rows):
+            filled += row.bit_count()
+            if row == full:
+                complete_lines += 1
+            holes += (seen & ~row).bit_count()
+            new_cols = row & ~seen
+            while new_cols:
+                low = new_cols & -new_cols
+                heights[low.bit_length() - 1] = self.height - row_idx
+                new_cols ^= low
+            seen |= row
+        bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(self.width - 1))
+        return filled, complete_lines, holes, bumpiness
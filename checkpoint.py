@@ -0,0 +1,44 @@
+import os
+import pickle
+import random
+import numpy as np
+
+#Atomic checkpoints of a training run. A checkpoint is one pickled dict written to a temporary file,
+#fsynced and renamed over the previous checkpoint, so a crash or preemption at any moment leaves either
+#the old or the new checkpoint on disk, never a torn one.
+
+CHECKPOINT_VERSION = 1
+
+
+def rng_state():
+    #States of the global NumPy and random generators, the only randomness the GA operators use
+    return {"numpy": np.random.get_state(), "random": random.getstate()}
+
+
+def restore_rng_state(state):
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+
+
+def save_checkpoint(path, state):
+    #Write state (a dict of picklable values) atomically, the RNG states are added automatically
+    state = dict(state, version=CHECKPOINT_VERSION, rng=rng_state())
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path, restore_rng=True):
+    #The saved state dict, None if there is no checkpoint; restores the RNG states unless restore_rng=False
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        state = pickle.load(file)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is a version {state.get('version')} checkpoint, expected version {CHECKPOINT_VERSION}")
+    if restore_rng:
+        restore_rng_state(state["rng"])
+    return state
@@ -0,0 +1,40 @@
+import sys
+
+#Single command line entry point. Every subcommand lives in its own module and is only imported when it is
+#run, so "python cli.py train --headless" never imports pygame and "python cli.py bench" measures the same
+#imports the workers pay. The arguments after the subcommand are handed to that module's main() unchanged.
+
+COMMANDS = {
+    "train": ("ai", "train the AI with the genetic algorithm"),
+    "play": ("game", "watch the trained AI play in a window"),
+    "replay": ("replay", "list, print or view recorded games"),
+    "bench": ("benchmark", "benchmark the engine and AI hot paths"),
+}
+
+
+def usage():
+    lines = ["usage: python cli.py <command> [arguments]", "", "commands:"]
+    for name, (_, description) in COMMANDS.items():
+        lines.append(f"  {name:<8} {description}")
+    lines.append("")
+    lines.append("python cli.py <command> --help shows the arguments of a command")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command = COMMANDS.get(argv[0])
+    if command is None:
+        print(f"unknown command: {argv[0]}\n\n{usage()}", file=sys.stderr)
+        return 2
+    import importlib
+    module = importlib.import_module(command[0])
+    result = module.main(argv[1:])
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import random
+
+from tetris import SHAPES, GRID_WIDTH, GRID_HEIGHT, shape_key, build_orientation_table
+from bitboard import BitBoard, build_piece_masks
+from pieces import PieceSource
+
+#Rules of one board size and piece set. An Engine owns the orientation table and bitboard piece masks of
+#its width and shapes, and every BitBoard it creates plays with them, so boards of several sizes (and
+#piece sets) can be used side by side in one process. The module constants GRID_WIDTH / GRID_HEIGHT /
+#SHAPES stay the defaults of everything that is not given an engine.
+
+
+class Engine:
+
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT, shapes=SHAPES):
+        self.width = width
+        self.height = height
+        self.shapes = shapes
+        self.orientations = build_orientation_table(shapes, width)
+        self.piece_masks = build_piece_masks(shapes, width)
+
+    def __repr__(self):
+        return f"Engine({self.width}x{self.height}, {len(self.shapes)} shapes)"
+
+    def create_board(self, rows=None):
+        return BitBoard(self.width, self.height, rows, engine=self)
+
+    def get_orientations(self, shape):
+        return self.orientations[shape_key(shape)]
+
+    def spawn_position(self, shape):
+        #(x, y) of a newly spawned shape, centered like tetris.spawn_piece
+        return self.width // 2 - len(shape[0]) // 2, 0
+
+    def spawn_piece(self, source=None):
+        #(shape, x, y) of the next piece from source, or from the global random module without one
+        shape = random.choice(self.shapes) if source is None else source.next_shape()
+        return (shape, *self.spawn_position(shape))
+
+    def piece_source(self, seed=None, bag=False):
+        return PieceSource(seed, bag, self.shapes)
+
+    def play_game(self, parameters, max_pieces=500, seed=None, source=None, **options):
+        #simulator.play_game on this engine's boards, returns (lines cleared, score, pieces placed)
+        from simulator import play_game
+        return play_game(parameters, max_pieces, seed=seed, source=source, engine=self, **options)
+
+
+_engines = {}
+
+
+def get_engine(width=GRID_WIDTH, height=GRID_HEIGHT):
+    #Shared engine of the standard piece set for a board size
+    engine = _engines.get((width, height))
+    if engine is None:
+        engine = Engine(width, height)
+        _engines[width, height] = engine
+    return engine
+
+
+def parse_size(text):
+    #"20x40" -> (20, 40)
+    width, height = text.lower().split("x")
+    return int(width), int(height)
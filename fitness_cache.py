@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+#Cache of game outcomes keyed by a quantized parameter vector, the game's piece seed and the rule settings.
+#Entries live in a bounded in-memory LRU and, optionally, in an SQLite file that survives restarts.
+
+
+class FitnessCache:
+
+    def __init__(self, max_size=100000, path=None, decimals=6):
+        self.max_size = max_size
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.path = path
+        self.db = None
+        if path is not None:
+            import sqlite3  #Only the persistent cache needs it
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS games (key TEXT PRIMARY KEY, lines INTEGER, score INTEGER)")
+
+    def key(self, parameters, seed, bag=False, rules=()):
+        #Parameters are rounded to `decimals` places so vectors that only differ by float noise share entries
+        quantized = ",".join(f"{round(float(value), self.decimals) + 0.0:.{self.decimals}f}" for value in parameters)
+        return f"{quantized}|{seed}|{int(bool(bag))}|{','.join(str(rule) for rule in rules)}"
+
+    def get(self, key):
+        #Cached (lines cleared, score) of a game, or None; counts a hit or a miss
+        outcome = self.entries.get(key)
+        if outcome is None and self.db is not None:
+            row = self.db.execute("SELECT lines, score FROM games WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                outcome = tuple(row)
+                self._remember(key, outcome)
+        if outcome is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return outcome
+
+    def put(self, key, lines_cleared, score):
+        outcome = (int(lines_cleared), int(score))
+        self._remember(key, outcome)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO games (key, lines, score) VALUES (?, ?, ?)", (key, *outcome))
+
+    def _remember(self, key, outcome):
+        #Insert into the in-memory LRU, evicting the least recently used entries beyond max_size
+        self.entries[key] = outcome
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def export_entries(self):
+        #The in-memory entries, least recently used first, for checkpoints of a cache without a file
+        return list(self.entries.items())
+
+    def import_entries(self, entries):
+        for key, outcome in entries:
+            self._remember(key, tuple(outcome))
+
+    def take_stats(self):
+        #Return (hits, misses) since the last call and reset the counters
+        stats = (self.hits, self.misses)
+        self.hits = 0
+        self.misses = 0
+        return stats
+
+    def flush(self):
+        #Commit pending writes to the on-disk store
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,12 +1,16 @@
 
+import math
 import time
-import pygame
 import numpy as np
-import signal
 import sys
-from tetris import draw_preview, check_collision, spawn_piece, rotate, lock_piece, clear_lines, create_empty_grid, SHAPES, update_score, GRID_WIDTH, GRID_HEIGHT
-from utils import *
-from ai import *
+from collections import namedtuple
+from tetris import check_collision, spawn_piece, rotate, lock_piece, clear_lines, create_empty_grid, SHAPES, update_score, fall_interval, shape_key, ORIENTATIONS, GRID_WIDTH, GRID_HEIGHT
+from tetris import BLOCK_SIZE as PREVIEW_BLOCK_SIZE
+from utils import save_parameters
+from ai import BLOCK_SIZE, COLORS, load_high_score, update_high_score
+from simulator import play_game
+from pieces import PieceSource
+from search import get_best_move_lookahead, AnytimePlanner
 
 class Colors:
     HEADER = '\033[95m'
@@ -18,15 +22,23 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-# Initialize Pygame
-pygame.init()
-
 # Screen dimensions
 SCREEN_WIDTH, SCREEN_HEIGHT = 400, 700
 PREVIEW_X, PREVIEW_Y = SCREEN_WIDTH - 100, 50
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Tetris Game")
+#Frames per second of the spectator window, it samples the latest state of the simulation every frame
+FRAME_RATE = 60
+
+#Play on the bitboard engine (bitboard.py) instead of the list-of-lists grid
+USE_BITBOARD = True
+
+#Search the current and the preview piece together (search.py), 1 is the plain one-piece search
+LOOKAHEAD_DEPTH = 2
+BEAM_WIDTH = 8
+
+#Let the AnytimePlanner (search.py) search as deep as the fall interval of the current level allows
+#instead of the fixed LOOKAHEAD_DEPTH / BEAM_WIDTH search
+ANYTIME_PLANNING = True
 
 # Define colors
 RED = (255, 0, 0)  #Color for the game over message
@@ -34,34 +46,47 @@ WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
 def signal_handler(sig, frame):
+    import pygame
     print(f"{Colors.WARNING}Exiting... Saving AI parameters.{Colors.ENDC}")
     save_parameters(best_parameters)  #Save the best parameters before exiting
     pygame.quit()
     sys.exit(0)  #Ensure the program exits cleanly
 
-def display_game_over(screen):
-    font = pygame.font.SysFont(None, 55)
-    text = font.render("Game Over", True, RED)
-    screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, SCREEN_HEIGHT // 2 - text.get_height() // 2))
-
-def draw_scoreboard(screen, score, high_score, level, total_completed_lines, time_played):
-    font = pygame.font.SysFont(None, 36)
-    score_text = font.render(f"Score: {score}", True, WHITE)
-    high_score_text = font.render(f"High Score: {high_score}", True, WHITE)
-    level_text = font.render(f"Level: {level}", True, WHITE)
-    lines_text = font.render(f"Lines: {total_completed_lines}", True, WHITE)
-    time_text = font.render(f"Time: {int(time_played)}s", True, WHITE)
-    
-    screen.blit(score_text, (10, SCREEN_HEIGHT - 50))
-    screen.blit(high_score_text, (10, SCREEN_HEIGHT - 90))
-    screen.blit(level_text, (10, SCREEN_HEIGHT - 130))
-    screen.blit(lines_text, (10, SCREEN_HEIGHT - 170))
-    screen.blit(time_text, (10, SCREEN_HEIGHT - 210))
-
-def reset_game():
-    grid = create_empty_grid()
-    shape, piece_x, piece_y = spawn_piece()
-    next_shape, next_piece_x, next_piece_y = spawn_piece()
+def init_display():
+    #Pygame is only imported and initialized by the spectator window, importing game.py opens nothing
+    import pygame
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Tetris Game")
+    return screen
+
+def create_renderer(screen):
+    #Cached-surface renderer of the window (renderer.py), returns it with the board and preview layers
+    from renderer import Renderer, rounded_tiles, solid_tiles
+    view = Renderer(screen, BLACK)
+    board = view.add_board((0, 0), GRID_WIDTH, GRID_HEIGHT, BLOCK_SIZE, rounded_tiles(BLOCK_SIZE, COLORS["GRID"]), COLORS["WHITE"])
+    preview = view.add_board((PREVIEW_X, PREVIEW_Y), 4, 2, PREVIEW_BLOCK_SIZE, solid_tiles(PREVIEW_BLOCK_SIZE, BLACK))
+    for name, offset in (("score", 50), ("high_score", 90), ("level", 130), ("lines", 170), ("time", 210)):
+        view.add_field(name, (10, SCREEN_HEIGHT - offset), 36, WHITE)
+    view.add_field("game_over", (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), 55, RED, center=True)
+    return view, board, preview
+
+def display_game_over(view, shown=True):
+    view.set_text("game_over", "Game Over" if shown else "")
+
+def draw_scoreboard(view, score, high_score, level, total_completed_lines, time_played):
+    #Text fields are only rendered again when their value changes
+    view.set_text("score", f"Score: {score}")
+    view.set_text("high_score", f"High Score: {high_score}")
+    view.set_text("level", f"Level: {level}")
+    view.set_text("lines", f"Lines: {total_completed_lines}")
+    view.set_text("time", f"Time: {int(time_played)}s")
+
+def reset_game(source=None):
+    #source is a piece source from pieces.py, the same source deals the same pieces in every mode
+    grid = create_empty_grid(bitboard=USE_BITBOARD)
+    shape, piece_x, piece_y = spawn_piece(source)
+    next_shape, next_piece_x, next_piece_y = spawn_piece(source)
     return grid, shape, piece_x, piece_y, next_shape, next_piece_x, next_piece_y
 
 def load_parameters_from_file():
@@ -78,25 +103,222 @@ def load_parameters_from_file():
         return np.array([-0.5, 0.6, 1.0, -0.2])
 
 
-def run_game_with_parameters(parameters, iteration_count):
-    grid, shape, piece_x, piece_y, next_shape, next_piece_x, next_piece_y = reset_game()
+def choose_move(planner, grid, shape, piece_x, piece_y, next_shape, level, time_budget=None):
+    #Ask the anytime planner, or run the fixed-depth search with the planner's table when ANYTIME_PLANNING is off
+    #time_budget overrides the planner's budget for the level, e.g. math.inf to always finish every search level
+    if ANYTIME_PLANNING:
+        return planner.plan(grid, shape, piece_x, piece_y, [next_shape], planner.time_budget(level) if time_budget is None else time_budget)
+    return get_best_move_lookahead(grid, shape, piece_x, piece_y, planner.parameters, [next_shape], LOOKAHEAD_DEPTH, BEAM_WIDTH, planner.table)
+
+def print_planner_stats(planner):
+    stats = planner.stats()
+    print(f"{Colors.OKBLUE}Decisions: {stats['decisions']}, deadline hit: {stats['deadline_hits']} "
+          f"({stats['deadline_hit_rate']:.1%}), mean decision time: {stats['mean_decision_ms']:.1f} ms{Colors.ENDC}")
+
+class RealClock:
+    #Wall-clock milliseconds since the clock was created, waiting sleeps until the time has come
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def now(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def wait_until(self, target):
+        delay = target - self.now()
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def decision_budget(self, planner, level):
+        return planner.time_budget(level)
+
+
+class VirtualClock:
+    #Simulated milliseconds: waiting jumps straight to the requested time, so a timed game runs as fast as the
+    #AI decides. Decisions take no simulated time and the planner always finishes, which is what the real-time
+    #game does whenever a decision fits in its budget.
+
+    def __init__(self):
+        self.time = 0
+
+    def now(self):
+        return self.time
+
+    def wait_until(self, target):
+        self.time = max(self.time, target)
+
+    def decision_budget(self, planner, level):
+        return math.inf
+
+
+def run_timed_game(parameters, planner=None, source=None, clock=None, max_pieces=None):
+    #Play one game row by row, moving the piece whenever the fall timer expires
+    #clock is a RealClock (play in real time) or a VirtualClock (default, same fall timing in simulated time)
+    #Returns (lines cleared, score, play time in seconds on the clock)
+    grid, shape, piece_x, piece_y, next_shape, next_piece_x, next_piece_y = reset_game(source)
+    if planner is None:
+        planner = AnytimePlanner(parameters)
+    if clock is None:
+        clock = VirtualClock()
     score = 0
     level = 5
     total_completed_lines = 0
+    pieces = 0
     game_over = False
-    start_time = time.time()
-    last_fall_time = pygame.time.get_ticks()
+    start_time = clock.now()
+    last_fall_time = start_time
 
     while not game_over:
-        current_time = pygame.time.get_ticks()
-        current_fall_speed = 500 - (level - 1) * 50
+        #The fall timer fires on the first millisecond past the fall interval
+        clock.wait_until(last_fall_time + fall_interval(level) + 1)
+        last_fall_time = clock.now()
+        #Get the best move from the AI
+        rotation, best_x, best_y = choose_move(planner, grid, shape, piece_x, piece_y, next_shape, level, clock.decision_budget(planner, level))
+        for _ in range(rotation):
+            shape = rotate(shape)  #Rotate the piece the correct number of times
+
+        piece_x = best_x
+        piece_y = best_y
+
+        if not check_collision(grid, shape, piece_x, piece_y + 1):
+            piece_y += 1
+        else:
+            lock_piece(grid, shape, piece_x, piece_y)
+            num_lines_cleared = clear_lines(grid)
+            total_completed_lines += num_lines_cleared
+            score = update_score(score, num_lines_cleared)
+            pieces += 1
+
+            if total_completed_lines >= level * 10:
+                level += 1
+
+            shape, piece_x, piece_y = next_shape, next_piece_x, next_piece_y
+            next_shape, next_piece_x, next_piece_y = spawn_piece(source)
+            if check_collision(grid, shape, piece_x, piece_y) or (max_pieces is not None and pieces >= max_pieces):
+                game_over = True
+
+    return total_completed_lines, score, (clock.now() - start_time) / 1000
+
+def run_game_with_parameters(parameters, iteration_count, placement_level=False, max_pieces=None, seed=None, realtime=False):
+    #Plays the game row by row on the fall timer, on a VirtualClock unless realtime is set
+    #placement_level asks the AI once per piece and hard-drops it (simulator.play_game) instead, with no fall timer
+    #and the fixed LOOKAHEAD_DEPTH / BEAM_WIDTH search; max_pieces bounds the game length in pieces and seed fixes
+    #the pieces of either game
+    planner = None
+    if placement_level:
+        total_completed_lines, _, _ = play_game(parameters, max_pieces, USE_BITBOARD, seed=seed, lookahead_depth=LOOKAHEAD_DEPTH,
+                                                beam_width=BEAM_WIDTH)
+    else:
+        planner = AnytimePlanner(parameters)
+        source = None if seed is None else PieceSource(seed)
+        total_completed_lines, _, play_time = run_timed_game(parameters, planner, source, RealClock() if realtime else VirtualClock(), max_pieces)
+
+    #Print iteration status and AI parameters
+    print(f"{Colors.HEADER}Game Iteration: {iteration_count}{Colors.ENDC}")
+    print(f"{Colors.OKBLUE}AI Parameters: {parameters}{Colors.ENDC}")
+    print(f"{Colors.OKGREEN}Total Lines Cleared: {total_completed_lines}{Colors.ENDC}")
+    if not placement_level:
+        print(f"{Colors.OKGREEN}{'Play' if realtime else 'Simulated play'} time: {play_time:.1f}s{Colors.ENDC}")
+    if planner is not None and planner.decisions:
+        print_planner_stats(planner)
+
+    return total_completed_lines  #Return the total number of lines cleared as fitness score
+
+#Spectator mode: the game is simulated in a worker thread (or process) that publishes an immutable GameSnapshot
+#after every step, and the window samples the latest snapshot FRAME_RATE times per second. Intermediate
+#snapshots are dropped, so a slow frame never delays the AI and a slow AI decision never freezes the window.
+
+GameSnapshot = namedtuple("GameSnapshot", ["step", "game", "rows", "shape", "piece_x", "piece_y", "next_shape", "score",
+                                           "high_score", "level", "lines", "time_played", "game_over"])
+
+#Every orientation of every shape in a fixed order, snapshots crossing a process boundary carry the index
+ORIENTATION_KEYS = sorted(ORIENTATIONS)
+ORIENTATION_INDEX = {key: idx for idx, key in enumerate(ORIENTATION_KEYS)}
+
+
+class LatestSnapshot:
+    #Snapshot channel between threads: publishing replaces one reference, which is atomic in CPython
+
+    def __init__(self):
+        self.snapshot = None
+        self.last_step = None
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot
+
+    def read(self):
+        #The newest snapshot, None if nothing was published since the last read
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.step == self.last_step:
+            return None
+        self.last_step = snapshot.step
+        return snapshot
+
+
+SHARED_FIELDS = 12  #GameSnapshot fields before the rows, see SharedSnapshot
+
+
+class SharedSnapshot:
+    #Snapshot channel between processes: one shared int64 array written and read under its lock
 
-        if current_time - last_fall_time > current_fall_speed:
-            last_fall_time = current_time
-            #Get the best move from the AI
-            rotation, best_x, best_y = get_best_move(grid, shape, piece_x, piece_y, parameters)
+    def __init__(self, grid_height=GRID_HEIGHT):
+        import multiprocessing
+        self.grid_height = grid_height
+        self.array = multiprocessing.Array("q", SHARED_FIELDS + grid_height)
+        self.array[0] = -1
+        self.last_step = None
+
+    def publish(self, snapshot):
+        values = [snapshot.step, snapshot.game, ORIENTATION_INDEX[snapshot.shape], snapshot.piece_x, snapshot.piece_y,
+                  ORIENTATION_INDEX[snapshot.next_shape], snapshot.score, snapshot.high_score, snapshot.level, snapshot.lines,
+                  int(snapshot.time_played * 1000), int(snapshot.game_over)]
+        with self.array.get_lock():
+            self.array[SHARED_FIELDS:] = list(snapshot.rows)
+            self.array[:SHARED_FIELDS] = values
+
+    def read(self):
+        with self.array.get_lock():
+            if self.array[0] < 0 or self.array[0] == self.last_step:
+                return None
+            values = self.array[:]
+        step, game, shape, piece_x, piece_y, next_shape, score, high_score, level, lines, time_ms, game_over = values[:SHARED_FIELDS]
+        self.last_step = step
+        return GameSnapshot(step, game, tuple(values[SHARED_FIELDS:]), ORIENTATION_KEYS[shape], piece_x, piece_y, ORIENTATION_KEYS[next_shape],
+                            score, high_score, level, lines, time_ms / 1000, bool(game_over))
+
+
+def board_rows(grid):
+    #Immutable row masks of either engine
+    if isinstance(grid, list):
+        return tuple(sum(1 << x for x, cell in enumerate(row) if cell) for row in grid)
+    return tuple(grid.rows)
+
+
+def run_spectator_games(parameters, channel, stop, realtime=True, max_games=None):
+    #Simulation side of the spectator: play games back to back and publish a snapshot after every step
+    #realtime=True moves the piece once per fall interval like the real game, False steps as fast as the AI decides
+    high_score = load_high_score()
+    step = 0
+    game_idx = 0
+    while not stop.is_set() and (max_games is None or game_idx < max_games):
+        grid, shape, piece_x, piece_y, next_shape, next_piece_x, next_piece_y = reset_game()
+        planner = AnytimePlanner(parameters)
+        score = 0
+        level = 5
+        total_completed_lines = 0
+        start_time = time.time()
+        next_fall_time = time.perf_counter() + fall_interval(level) / 1000
+        game_over = False
+
+        while not game_over and not stop.is_set():
+            if realtime:
+                delay = next_fall_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_fall_time = time.perf_counter() + fall_interval(level) / 1000
+            rotation, best_x, best_y = choose_move(planner, grid, shape, piece_x, piece_y, next_shape, level)
             for _ in range(rotation):
-                shape = rotate(shape)  #Rotate the piece the correct number of times
+                shape = rotate(shape)
 
             piece_x = best_x
             piece_y = best_y
@@ -108,6 +330,9 @@ def run_game_with_parameters(parameters, iteration_count):
                 num_lines_cleared = clear_lines(grid)
                 total_completed_lines += num_lines_cleared
                 score = update_score(score, num_lines_cleared)
+                if num_lines_cleared:
+                    print(f"{Colors.OKGREEN}Current Score: {score}{Colors.ENDC}")
+                    print(f"{Colors.WARNING}Total Lines Cleared: {total_completed_lines}{Colors.ENDC}")
 
                 if total_completed_lines >= level * 10:
                     level += 1
@@ -115,86 +340,75 @@ def run_game_with_parameters(parameters, iteration_count):
                 shape, piece_x, piece_y = next_shape, next_piece_x, next_piece_y
                 next_shape, next_piece_x, next_piece_y = spawn_piece()
                 if check_collision(grid, shape, piece_x, piece_y):
+                    high_score = update_high_score(score, high_score)
+                    print(f"{Colors.BOLD}Game over: score {score}, level {level}, {total_completed_lines} lines in {int(time.time() - start_time)} seconds{Colors.ENDC}")
+                    print_planner_stats(planner)
                     game_over = True
 
-    #Print iteration status and AI parameters
-    print(f"{Colors.HEADER}Game Iteration: {iteration_count}{Colors.ENDC}")
-    print(f"{Colors.OKBLUE}AI Parameters: {parameters}{Colors.ENDC}")
-    print(f"{Colors.OKGREEN}Total Lines Cleared: {total_completed_lines}{Colors.ENDC}")
+            step += 1
+            channel.publish(GameSnapshot(step, game_idx, board_rows(grid), shape_key(shape), piece_x, piece_y, shape_key(next_shape), score,
+                                         high_score, level, total_completed_lines, time.time() - start_time, game_over))
+        game_idx += 1
+
+
+def start_simulation(parameters, use_process=False, realtime=True):
+    #Start run_spectator_games in a daemon thread or process, returns (snapshot channel, stop event, worker)
+    if use_process:
+        import multiprocessing
+        channel = SharedSnapshot()
+        stop = multiprocessing.Event()
+        worker = multiprocessing.Process(target=run_spectator_games, args=(parameters, channel, stop, realtime), daemon=True)
+    else:
+        import threading
+        channel = LatestSnapshot()
+        stop = threading.Event()
+        worker = threading.Thread(target=run_spectator_games, args=(parameters, channel, stop, realtime), daemon=True)
+    worker.start()
+    return channel, stop, worker
+
+
+def draw_snapshot(view, board_view, preview_view, snapshot):
+    board_view.draw(snapshot, [(snapshot.shape, snapshot.piece_x, snapshot.piece_y, WHITE)])
+    preview_view.draw(None, [(snapshot.next_shape, 0, 0, WHITE)])
+    draw_scoreboard(view, snapshot.score, snapshot.high_score, snapshot.level, snapshot.lines, snapshot.time_played)
+    display_game_over(view, snapshot.game_over)
+
+def main(argv=None):
+    #Spectator window for AI play, also run by "python cli.py play"
+    import argparse
+    import signal
+    import pygame
+    global best_parameters
+    parser = argparse.ArgumentParser(description="Watch the Tetris AI play")
+    parser.add_argument("--process", action="store_true", help="simulate in a separate process instead of a thread")
+    parser.add_argument("--fast", action="store_true", help="do not wait for the fall timer, the window shows the latest state")
+    parser.add_argument("--fps", type=int, default=FRAME_RATE, help="frames per second of the window")
+    args = parser.parse_args(argv)
 
-    return total_completed_lines  #Return the total number of lines cleared as fitness score
-
-#Main game loop for AI play
-if __name__ == "__main__":
     #Register the signal handler
     signal.signal(signal.SIGINT, signal_handler)
-    
+
     #Load parameters from file or use defaults
     best_parameters = load_parameters_from_file()
     print(f"Loaded parameters: {best_parameters}")
 
-    high_score = load_high_score()  #Load high score once
-    game_counter = 0
+    view, board_view, preview_view = create_renderer(init_display())
+    frame_clock = pygame.time.Clock()
+    channel, stop, worker = start_simulation(best_parameters, args.process, not args.fast)
 
     while True:
-        #Reset game state
-        grid, shape, piece_x, piece_y, next_shape, next_piece_x, next_piece_y = reset_game()
-        score = 0
-        level = 5
-        total_completed_lines = 0
-        start_time = time.time()
-        last_fall_time = pygame.time.get_ticks()
-        game_over = False
-
-        while not game_over:
-            screen.fill(BLACK)
-            draw_grid(screen, grid)
-            draw_piece(screen, shape, piece_x, piece_y, WHITE)
-            draw_preview(screen, next_shape, PREVIEW_X, PREVIEW_Y)
-
-            current_time = pygame.time.get_ticks()
-            time_played = time.time() - start_time
-
-            if current_time - last_fall_time > 500 - (level - 1) * 50:
-                last_fall_time = current_time
-                rotation, best_x, best_y = get_best_move(grid, shape, piece_x, piece_y, best_parameters)
-                for _ in range(rotation):
-                    shape = rotate(shape)
-
-                piece_x = best_x
-                piece_y = best_y
-
-                if not check_collision(grid, shape, piece_x, piece_y + 1):
-                    piece_y += 1
-                else:
-                    lock_piece(grid, shape, piece_x, piece_y)
-                    num_lines_cleared = clear_lines(grid)
-                    total_completed_lines += num_lines_cleared
-                    score = update_score(score, num_lines_cleared)
-                    #Log game status
-                    print(f"{Colors.OKGREEN}Current Score: {score}{Colors.ENDC}")
-                    print(f"{Colors.OKBLUE}Level: {level}{Colors.ENDC}")
-                    print(f"{Colors.WARNING}Total Lines Cleared: {total_completed_lines}{Colors.ENDC}")
-                    print(f"{Colors.BOLD}Time Played: {int(time_played)} seconds{Colors.ENDC}")
-
-                    if total_completed_lines >= level * 10:
-                        level += 1
+        snapshot = channel.read()
+        if snapshot is not None:
+            draw_snapshot(view, board_view, preview_view, snapshot)
+            view.present()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                stop.set()
+                save_parameters(best_parameters)  #Save parameters when quitting
+                pygame.quit()
+                exit()
+        frame_clock.tick(args.fps)
 
-                    shape, piece_x, piece_y = next_shape, next_piece_x, next_piece_y
-                    next_shape, next_piece_x, next_piece_y = spawn_piece()
-                    if check_collision(grid, shape, piece_x, piece_y):
-                        high_score = update_high_score(score, high_score)
-                        display_game_over(screen)
-                        pygame.display.flip()
-
-                        game_over = True
-
-            draw_scoreboard(screen, score, high_score, level, total_completed_lines, time_played)
-            pygame.display.flip()
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    save_parameters(best_parameters)  #Save parameters when quitting
-                    save_high_score(high_score)  #Save high score when quitting
-                    pygame.quit()
-                    exit()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
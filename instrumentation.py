@@ -0,0 +1,140 @@
+import contextlib
+import json
+import time
+import numpy as np
+
+#Per-phase timers and counters for GA runs. Every call site tests the module flag `enabled` before doing
+#any timing, so with instrumentation off the cost is one attribute lookup per site. Times accumulate per
+#phase and are summarized once per generation to the console and as one JSON line per generation in the log.
+
+PHASES = ("move_generation", "feature_scoring", "lock_clear", "rendering", "persistence")
+
+enabled = False
+log_path = None
+
+clock = time.perf_counter
+phase_seconds = {}
+phase_calls = {}
+counters = {}
+decision_latencies = []
+
+_DISABLED_PHASE = contextlib.nullcontext()
+
+
+def enable(path="instrumentation.jsonl"):
+    #Start collecting, path=None keeps the summaries on the console only
+    global enabled, log_path
+    log_path = path
+    reset()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    phase_seconds.clear()
+    phase_calls.clear()
+    counters.clear()
+    decision_latencies.clear()
+
+
+def add_time(phase, seconds):
+    phase_seconds[phase] = phase_seconds.get(phase, 0.0) + seconds
+    phase_calls[phase] = phase_calls.get(phase, 0) + 1
+
+
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+def record_decision(seconds):
+    #Latency of one AI decision (one placement chosen for one piece)
+    decision_latencies.append(seconds)
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    start = clock()
+    try:
+        yield
+    finally:
+        add_time(name, clock() - start)
+
+
+def phase(name):
+    #Context manager timing a coarse phase (a frame, a flush), a shared no-op when instrumentation is off
+    if not enabled:
+        return _DISABLED_PHASE
+    return _timed_phase(name)
+
+
+def take_snapshot():
+    #Everything collected since the last reset as plain data (sent back by worker processes), then reset
+    snapshot = {
+        "phase_seconds": dict(phase_seconds),
+        "phase_calls": dict(phase_calls),
+        "counters": dict(counters),
+        "decision_latencies": list(decision_latencies),
+    }
+    reset()
+    return snapshot
+
+
+def merge(snapshot):
+    #Add a worker's snapshot to the numbers of this process
+    for name, seconds in snapshot["phase_seconds"].items():
+        phase_seconds[name] = phase_seconds.get(name, 0.0) + seconds
+    for name, calls in snapshot["phase_calls"].items():
+        phase_calls[name] = phase_calls.get(name, 0) + calls
+    for name, amount in snapshot["counters"].items():
+        count(name, amount)
+    decision_latencies.extend(snapshot["decision_latencies"])
+
+
+def summarize(generation, elapsed):
+    #Summary of one generation that took elapsed wall-clock seconds, resets the collected numbers
+    #Phase shares are of the wall-clock time; worker process times add up, so with a pool they can exceed 1
+    snapshot = take_snapshot()
+    latencies = np.array(snapshot["decision_latencies"]) * 1000
+    pieces = snapshot["counters"].get("pieces", 0)
+    placements = snapshot["counters"].get("placements", 0)
+    phases = {}
+    for name in list(PHASES) + sorted(set(snapshot["phase_seconds"]) - set(PHASES)):
+        seconds = snapshot["phase_seconds"].get(name, 0.0)
+        phases[name] = {"seconds": seconds, "calls": snapshot["phase_calls"].get(name, 0),
+                        "share": seconds / elapsed if elapsed > 0 else 0.0}
+    return {
+        "generation": generation,
+        "timestamp": time.time(),
+        "seconds": elapsed,
+        "pieces": pieces,
+        "pieces_per_sec": pieces / elapsed if elapsed > 0 else 0.0,
+        "placements": placements,
+        "placements_per_sec": placements / elapsed if elapsed > 0 else 0.0,
+        "decisions": len(latencies),
+        "decision_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "decision_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        "phases": phases,
+        "counters": snapshot["counters"],
+    }
+
+
+def write_summary(summary):
+    #Append the summary as one JSON line to the log
+    if log_path is not None:
+        with open(log_path, "a") as file:
+            file.write(json.dumps(summary) + "\n")
+
+
+def format_summary(summary):
+    #Console form of a summary
+    text = (f"{summary['pieces_per_sec']:,.0f} pieces/s, {summary['placements_per_sec']:,.0f} placements/s")
+    if summary["decisions"]:
+        text += f", decision p50 {summary['decision_p50_ms']:.2f} ms / p99 {summary['decision_p99_ms']:.2f} ms"
+    shares = ", ".join(f"{name} {phase_summary['share']:.0%}" for name, phase_summary in summary["phases"].items() if phase_summary["calls"])
+    if shares:
+        text += f" | {shares}"
+    return text
@@ -0,0 +1,207 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import numpy as np
+
+import ai
+from utils import save_parameters
+from results_store import ResultsStore
+from replay import ReplayLog
+
+#Island-model GA: the population is split into K islands, each evolved by its own worker process with the
+#operators of ai.py (select_parents, crossover, mutate, delete_n_last_replacement). Every M generations each
+#island sends copies of its best individuals to its neighbours (ring: the next island, full: all others) over
+#multiprocessing queues. Only migrants and one progress message per island and generation cross process
+#boundaries, every game is played inside its island. Islands rank their individuals for selection, replacement
+#and migration by each individual's own fitness, the mean lines cleared of its games (ai.batch_fitness).
+
+NUM_ISLANDS = os.cpu_count()
+MIGRATION_INTERVAL = 5  #Generations between migrations
+NUM_MIGRANTS = 2        #Best individuals sent to every neighbour
+TOPOLOGY = "ring"       #"ring" or "full"
+MIGRATION_TIMEOUT = 600  #Seconds an island waits for its neighbours' migrants before giving up
+ISLAND_SEED = 0
+
+
+def neighbours(island_idx, num_islands, topology):
+    #Islands that island_idx sends its migrants to
+    if num_islands < 2:
+        return []
+    if topology == "ring":
+        return [(island_idx + 1) % num_islands]
+    if topology == "full":
+        return [other for other in range(num_islands) if other != island_idx]
+    raise ValueError(f"Unknown topology: {topology}")
+
+
+def num_incoming(num_islands, topology):
+    #Migrant batches every island receives per migration
+    if num_islands < 2:
+        return 0
+    return 1 if topology == "ring" else num_islands - 1
+
+
+def island_file(path, island_idx):
+    return f"{path}.island{island_idx}"
+
+
+def replace_weakest(population, scores, migrants):
+    #Put the migrants in place of the weakest individuals
+    order = np.argsort(scores)
+    population = list(population)
+    scores = list(scores)
+    for slot, (parameters, score) in zip(order, migrants):
+        population[slot] = np.array(parameters, dtype=np.float64)
+        scores[slot] = score
+    return population, scores
+
+
+def run_island(island_idx, population, generations, migration_interval, num_migrants, topology, inboxes, reports, seed):
+    #Worker process: evolve one island and report (island, generation, best mean lines, best parameters) every generation
+    np.random.seed(np.random.SeedSequence([seed, island_idx]).generate_state(4))
+    random.seed(int(np.random.SeedSequence([seed, island_idx, 1]).generate_state(1)[0]))
+    num_islands = len(inboxes)
+    ai.HEADLESS = True
+    ai.PARALLEL_EVALUATION = False
+    ai.POPULATION_SIZE = len(population)
+    ai.OFFSPRING_SIZE = int(0.3 * len(population))
+    ai.RESULTS_FILE = island_file(ai.RESULTS_FILE, island_idx)
+    ai.LEGACY_RESULTS_FILE = None  #The main store already holds the legacy results, merge_island_files would append them again
+    ai.REPLAYS_FILE = island_file(ai.REPLAYS_FILE, island_idx)
+    ai.HIGH_SCORE_FILE = island_file(ai.HIGH_SCORE_FILE, island_idx)
+    ai.FITNESS_CACHE_FILE = None  #SQLite writers would contend across islands, each keeps its cache in memory
+    ai.results_store = None
+    ai.replay_log = None
+    ai.fitness_cache = None
+    sys.stdout = open(os.devnull, "w")  #The parent prints progress, per-individual prints of K islands would interleave
+
+    try:
+        for generation in range(generations):
+            scores = list(ai.batch_fitness(population, generation))
+            ai.get_results_store().flush()
+            if ai.RECORD_REPLAYS:
+                ai.get_replay_log().flush()
+            best_idx = int(np.argmax(scores))
+            reports.put((island_idx, generation, scores[best_idx], np.asarray(population[best_idx], dtype=np.float64)))
+
+            if generation + 1 < generations and (generation + 1) % migration_interval == 0 and num_islands > 1:
+                best = np.argsort(scores)[::-1][:num_migrants]
+                migrants = [(np.asarray(population[i], dtype=np.float64), scores[i]) for i in best]
+                for other in neighbours(island_idx, num_islands, topology):
+                    inboxes[other].put(migrants)
+                incoming = []
+                for _ in range(num_incoming(num_islands, topology)):
+                    incoming.extend(inboxes[island_idx].get(timeout=MIGRATION_TIMEOUT))
+                population, scores = replace_weakest(population, scores, incoming)
+
+            population = ai.next_generation(population, scores)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ai.get_results_store().flush()
+        if ai.RECORD_REPLAYS:
+            ai.get_replay_log().flush()
+        reports.put((island_idx, None, None, None))
+
+
+def merge_island_files(num_islands):
+    #Append the islands' game results and replays to the main files and keep the highest high score
+    store = ai.get_results_store()
+    high_score = ai.load_high_score()
+    for island_idx in range(num_islands):
+        results_path = island_file(ai.RESULTS_FILE, island_idx)
+        if os.path.exists(results_path):
+            store.extend(ResultsStore(results_path).records())
+            for path in (results_path, results_path + ".idx"):
+                os.remove(path)
+        replays_path = island_file(ai.REPLAYS_FILE, island_idx)
+        if os.path.exists(replays_path):
+            ai.get_replay_log().extend(ReplayLog(replays_path))
+            os.remove(replays_path)
+        high_score_path = island_file(ai.HIGH_SCORE_FILE, island_idx)
+        if os.path.exists(high_score_path):
+            with open(high_score_path, "r") as file:
+                content = file.read().strip()
+            if content:
+                high_score = max(high_score, int(content))
+            os.remove(high_score_path)
+    ai.save_high_score(high_score)
+    store.flush()
+
+
+def island_genetic_algorithm(num_islands=NUM_ISLANDS, island_size=None, generations=None, migration_interval=MIGRATION_INTERVAL,
+                             num_migrants=NUM_MIGRANTS, topology=TOPOLOGY, seed=ISLAND_SEED):
+    #Evolve num_islands islands of island_size individuals (default: ai.POPULATION_SIZE split evenly) in parallel
+    #Returns the global best parameters; they are saved whenever an island improves on them
+    neighbours(0, num_islands, topology)  #Reject an unknown topology before starting any process
+    generations = generations or ai.GENERATIONS
+    island_size = island_size or max(4, ai.POPULATION_SIZE // num_islands)
+    population_size = ai.POPULATION_SIZE
+    ai.POPULATION_SIZE = num_islands * island_size
+    population = ai.initialize_population()
+    ai.POPULATION_SIZE = population_size
+    high_score = ai.load_high_score()
+    for island_idx in range(num_islands):
+        with open(island_file(ai.HIGH_SCORE_FILE, island_idx), "w") as file:
+            file.write(str(high_score))
+
+    inboxes = [multiprocessing.Queue() for _ in range(num_islands)]
+    reports = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_island, args=(island_idx, population[island_idx * island_size:(island_idx + 1) * island_size],
+                                                                   generations, migration_interval, num_migrants, topology, inboxes, reports, seed))
+                 for island_idx in range(num_islands)]
+    print(f"Starting {num_islands} islands of {island_size} individuals, {topology} migration of {num_migrants} every {migration_interval} generations")
+    for process in processes:
+        process.start()
+
+    best_parameters = None
+    best_score = -float('inf')
+    finished = 0
+    try:
+        while finished < num_islands:
+            try:
+                island_idx, generation, score, parameters = reports.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break  #An island died without reporting
+                continue
+            if generation is None:
+                finished += 1
+                continue
+            print(f"Island {island_idx + 1} generation {generation + 1}/{generations}: best mean lines {score}")
+            if score > best_score:
+                best_score = score
+                best_parameters = parameters
+                print(f"New global best parameters found: {best_parameters}")
+                save_parameters(best_parameters)
+    except KeyboardInterrupt:
+        print("Island GA interrupted. Saving best parameters found so far.")
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        merge_island_files(num_islands)
+
+    print(f"Global best mean lines {best_score}, parameters: {best_parameters}")
+    return best_parameters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Tetris AI with an island-model genetic algorithm")
+    parser.add_argument("--islands", type=int, default=NUM_ISLANDS, metavar="K", help="number of islands (worker processes)")
+    parser.add_argument("--island-size", type=int, default=None, metavar="N", help="individuals per island")
+    parser.add_argument("--generations", type=int, default=ai.GENERATIONS, metavar="N", help="generations per island")
+    parser.add_argument("--migration-interval", type=int, default=MIGRATION_INTERVAL, metavar="M", help="generations between migrations")
+    parser.add_argument("--migrants", type=int, default=NUM_MIGRANTS, metavar="N", help="best individuals sent to every neighbour")
+    parser.add_argument("--topology", choices=("ring", "full"), default=TOPOLOGY, help="islands that receive an island's migrants")
+    parser.add_argument("--seed", type=int, default=ISLAND_SEED, help="seed of the islands' operator random numbers")
+    args = parser.parse_args()
+
+    best_params = island_genetic_algorithm(args.islands, args.island_size, args.generations, args.migration_interval,
+                                           args.migrants, args.topology, args.seed)
+    if best_params is None:
+        sys.exit(1)
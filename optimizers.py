@@ -0,0 +1,110 @@
+import numpy as np
+
+#Optimizers of the AI parameters behind one ask/tell interface. ask() proposes a whole population as an
+#(n, dim) matrix, the caller plays every game of it in one batch and hands the scores back to tell().
+#state() / load_state() capture everything the optimizer needs to continue, so ai.py checkpoints any
+#optimizer between generations the same way it checkpoints the GA.
+
+
+class Optimizer:
+    #Interface of the optimizers driven by ai.optimize, higher scores are better
+
+    def ask(self):
+        #The population to evaluate next, one parameter vector per row
+        raise NotImplementedError
+
+    def tell(self, population, scores):
+        #Update from the scores of a population returned by ask()
+        raise NotImplementedError
+
+    def state(self):
+        #Picklable state, load_state(state) on a freshly constructed optimizer continues the run
+        raise NotImplementedError
+
+    def load_state(self, state):
+        raise NotImplementedError
+
+
+class CMAES(Optimizer):
+    #Covariance matrix adaptation evolution strategy (Hansen's (mu/mu_w, lambda)-CMA-ES with the default settings).
+    #Every generation samples population_size vectors around the mean, moves the mean to the weighted average of
+    #the better half and adapts the step size and the covariance of the search distribution, all as matrix
+    #operations on the whole population. With normalize=True the samples and the mean are kept on the unit
+    #sphere, like the GA's individuals; the game only depends on the direction of the weights.
+
+    def __init__(self, mean, sigma=0.3, population_size=None, seed=None, normalize=True):
+        self.normalize = normalize
+        self.mean = self.project(np.array(mean, dtype=np.float64))
+        self.dim = n = len(self.mean)
+        self.population_size = population_size or 4 + int(3 * np.log(n))
+        self.mu = self.population_size // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mu_eff = 1 / np.sum(self.weights ** 2)
+
+        #Learning rates of the evolution paths, the covariance matrix and the step size
+        self.cc = (4 + self.mu_eff / n) / (n + 4 + 2 * self.mu_eff / n)
+        self.cs = (self.mu_eff + 2) / (n + self.mu_eff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mu_eff)
+        self.cmu = min(1 - self.c1, 2 * (self.mu_eff - 2 + 1 / self.mu_eff) / ((n + 2) ** 2 + self.mu_eff))
+        self.damps = 1 + 2 * max(0.0, np.sqrt((self.mu_eff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))  #Expected length of a standard normal vector
+
+        self.sigma = sigma
+        self.cov = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.generation = 0
+        self.rng = np.random.default_rng(seed)
+
+    def project(self, vectors):
+        if not self.normalize:
+            return vectors
+        return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    def eigen(self):
+        #B and D of cov = B diag(D^2) B^T
+        eigenvalues, basis = np.linalg.eigh(self.cov)
+        return basis, np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def ask(self):
+        basis, scales = self.eigen()
+        z = self.rng.standard_normal((self.population_size, self.dim))
+        return self.project(self.mean + self.sigma * (z * scales) @ basis.T)
+
+    def tell(self, population, scores):
+        population = np.asarray(population, dtype=np.float64)
+        order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")[:self.mu]
+        steps = (population[order] - self.mean) / self.sigma
+        step = self.weights @ steps
+
+        basis, scales = self.eigen()
+        inv_sqrt_cov = (basis / scales) @ basis.T
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mu_eff) * inv_sqrt_cov @ step
+        ps_norm = np.linalg.norm(self.ps)
+        #Stall the rank-one update while the step size is still growing fast
+        h_sigma = ps_norm / np.sqrt(1 - (1 - self.cs) ** (2 * (self.generation + 1))) < (1.4 + 2 / (self.dim + 1)) * self.chi_n
+        self.pc = (1 - self.cc) * self.pc + h_sigma * np.sqrt(self.cc * (2 - self.cc) * self.mu_eff) * step
+
+        rank_one = np.outer(self.pc, self.pc)
+        rank_mu = (steps.T * self.weights) @ steps
+        decay = 1 - self.c1 - self.cmu + (1 - h_sigma) * self.c1 * self.cc * (2 - self.cc)
+        self.cov = decay * self.cov + self.c1 * rank_one + self.cmu * rank_mu
+        self.cov = (self.cov + self.cov.T) / 2  #Keep it symmetric against rounding
+
+        self.mean = self.project(self.mean + self.sigma * step)
+        self.sigma *= np.exp(self.cs / self.damps * (ps_norm / self.chi_n - 1))
+        self.generation += 1
+
+    def state(self):
+        return {"mean": self.mean.copy(), "sigma": self.sigma, "cov": self.cov.copy(), "pc": self.pc.copy(), "ps": self.ps.copy(),
+                "generation": self.generation, "rng": self.rng.bit_generator.state}
+
+    def load_state(self, state):
+        self.mean = np.array(state["mean"], dtype=np.float64)
+        self.sigma = state["sigma"]
+        self.cov = np.array(state["cov"], dtype=np.float64)
+        self.pc = np.array(state["pc"], dtype=np.float64)
+        self.ps = np.array(state["ps"], dtype=np.float64)
+        self.generation = state["generation"]
+        self.rng.bit_generator.state = state["rng"]
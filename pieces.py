@@ -0,0 +1,92 @@
+import random
+import numpy as np
+
+from tetris import SHAPES
+
+#Piece sources replace the global random.choice in tetris.spawn_piece so that games are reproducible,
+#and a sequence bank lets every individual of a generation play the same games (common random numbers).
+
+
+class PieceSource:
+    #Seeded supplier of shapes, bag=True uses the 7-bag randomizer (every shape once per bag of len(shapes))
+
+    def __init__(self, seed=None, bag=False, shapes=SHAPES):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.bag = bag
+        self.shapes = shapes
+        self._bag = []
+
+    def next_index(self):
+        #Index into shapes of the next piece
+        if not self.bag:
+            return self.rng.randrange(len(self.shapes))
+        if not self._bag:
+            self._bag = list(range(len(self.shapes)))
+            self.rng.shuffle(self._bag)
+        return self._bag.pop()
+
+    def next_shape(self):
+        return self.shapes[self.next_index()]
+
+    def sequence(self, length):
+        #The next length piece indices as a uint8 array
+        return np.fromiter((self.next_index() for _ in range(length)), dtype=np.uint8, count=length)
+
+
+class SequenceSource:
+    #Replays a stored piece sequence generated by PieceSource(seed, bag), then continues that source
+    #if the game outlives the stored part, so it deals exactly the same pieces as PieceSource(seed, bag)
+
+    def __init__(self, sequence, seed=None, bag=False, shapes=SHAPES):
+        self.sequence = np.asarray(sequence, dtype=np.uint8)
+        self.position = 0
+        self.seed = seed
+        self.bag = bag
+        self.shapes = shapes
+        self._fallback = None
+
+    def next_index(self):
+        if self.position < len(self.sequence):
+            index = int(self.sequence[self.position])
+            self.position += 1
+            return index
+        if self._fallback is None:
+            self._fallback = PieceSource(self.seed, self.bag, self.shapes)
+            for _ in range(len(self.sequence)):
+                self._fallback.next_index()
+        return self._fallback.next_index()
+
+    def next_shape(self):
+        return self.shapes[self.next_index()]
+
+
+class SequenceBank:
+    #Pre-generated piece sequences stored compactly as a (num_games, length) uint8 array
+
+    def __init__(self, sequences, seeds, bag=False):
+        self.sequences = np.asarray(sequences, dtype=np.uint8)
+        self.seeds = list(seeds)
+        self.bag = bag
+
+    @classmethod
+    def generate(cls, num_games, length, seed=0, bag=False, shapes=SHAPES):
+        #Game i uses the seed derived from (seed, i), so banks with more games extend smaller ones
+        seeds = [int(np.random.SeedSequence([seed, game_idx]).generate_state(1)[0]) for game_idx in range(num_games)]
+        sequences = np.stack([PieceSource(game_seed, bag, shapes).sequence(length) for game_seed in seeds])
+        return cls(sequences, seeds, bag)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def source(self, game_idx):
+        #Piece source that replays game game_idx
+        return SequenceSource(self.sequences[game_idx], self.seeds[game_idx], self.bag)
+
+    def save(self, filename):
+        np.savez_compressed(filename, sequences=self.sequences, seeds=np.array(self.seeds, dtype=np.uint64), bag=self.bag)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data["sequences"], [int(seed) for seed in data["seeds"]], bool(data["bag"]))
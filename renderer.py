@@ -0,0 +1,194 @@
+import pygame
+
+#Cached-surface rendering for the Pygame views. Cell tiles are pre-rendered once per color, boards are drawn
+#onto an off-screen layer and only the cells that changed since the last frame are blitted again. Text fields
+#are rendered only when their text changes. present() recomposes the changed regions (layer, then the text
+#fields on top) and hands just those rectangles to pygame.display.update instead of flipping the whole screen.
+
+_fonts = {}
+
+
+def get_font(size):
+    #pygame.font.SysFont is slow (it scans the system fonts), so every size is created once
+    font = _fonts.get(size)
+    if font is None:
+        font = pygame.font.SysFont(None, size)
+        _fonts[size] = font
+    return font
+
+
+def rounded_tiles(block_size, grid_color):
+    #Tile factory of the ai.py style: a rounded grid square, filled cells get an inset rounded square on top
+    empty = pygame.Surface((block_size, block_size)).convert()
+    empty.fill((0, 0, 0))
+    pygame.draw.rect(empty, grid_color, empty.get_rect(), border_radius=5)
+
+    def tile(color):
+        surface = empty.copy()
+        if color is not None:
+            pygame.draw.rect(surface, color, surface.get_rect().inflate(-2, -2), border_radius=5)
+        return surface
+    return tile
+
+
+def solid_tiles(block_size, background=(0, 0, 0)):
+    #Tile factory of plain squares, empty cells show the background
+    def tile(color):
+        surface = pygame.Surface((block_size, block_size)).convert()
+        surface.fill(background if color is None else color)
+        return surface
+    return tile
+
+
+class BoardLayer:
+    #A width x height block of cells on the renderer's layer, remembers what every cell shows
+
+    def __init__(self, renderer, origin, width, height, block_size, tile_factory, filled_color=(255, 255, 255)):
+        self.renderer = renderer
+        self.origin = origin
+        self.width = width
+        self.height = height
+        self.block_size = block_size
+        self.tile_factory = tile_factory
+        self.filled_color = filled_color
+        self.tiles = {}
+        #Per row (row mask, piece cells in the row) of the last frame, None forces a redraw
+        self.row_keys = [None] * height
+        self.cells = [[False] * width for _ in range(height)]  #Color shown by every cell, False before the first draw
+
+    def tile(self, color):
+        tile = self.tiles.get(color)
+        if tile is None:
+            tile = self.tile_factory(color)
+            self.tiles[color] = tile
+        return tile
+
+    def invalidate(self):
+        self.row_keys = [None] * self.height
+        self.cells = [[False] * self.width for _ in range(self.height)]
+
+    def draw(self, grid, pieces=()):
+        #Show grid (list-of-lists, BitBoard or None for an empty board) with pieces ((shape, x, y, color), ...) on top
+        if grid is None:
+            rows = [0] * self.height
+        elif isinstance(grid, list):
+            rows = [sum(1 << x for x, cell in enumerate(row) if cell) for row in grid]
+        else:
+            rows = grid.rows
+        overlay = {}
+        for shape, piece_x, piece_y, color in pieces:
+            for row_idx, row in enumerate(shape):
+                y = piece_y + row_idx
+                if 0 <= y < self.height:
+                    for col_idx, cell in enumerate(row):
+                        if cell and 0 <= piece_x + col_idx < self.width:
+                            overlay.setdefault(y, {})[piece_x + col_idx] = color
+
+        layer = self.renderer.layer
+        origin_x, origin_y = self.origin
+        block_size = self.block_size
+        for y in range(self.height):
+            row_overlay = overlay.get(y)
+            key = (rows[y], tuple(sorted(row_overlay.items())) if row_overlay else ())
+            if key == self.row_keys[y]:
+                continue
+            self.row_keys[y] = key
+            row = rows[y]
+            shown = self.cells[y]
+            changed = None
+            for x in range(self.width):
+                color = row_overlay.get(x) if row_overlay else None
+                if color is None and (row >> x) & 1:
+                    color = self.filled_color
+                if color != shown[x]:
+                    shown[x] = color
+                    rect = layer.blit(self.tile(color), (origin_x + x * block_size, origin_y + y * block_size))
+                    changed = rect if changed is None else changed.union(rect)
+            if changed is not None:
+                self.renderer.dirty.append(changed)
+
+
+class TextField:
+
+    def __init__(self, position, size, color, center=False):
+        self.position = position
+        self.size = size
+        self.color = color
+        self.center = center
+        self.text = ""
+        self.surface = None
+        self.rect = None
+
+
+class Renderer:
+    #Compositor for one window: background layer with boards, text fields on top, dirty-rect presentation
+
+    def __init__(self, screen, background=(0, 0, 0)):
+        self.screen = screen
+        self.background = background
+        self.layer = pygame.Surface(screen.get_size()).convert()
+        self.layer.fill(background)
+        self.boards = []
+        self.fields = {}
+        self.dirty = []
+        self.full_redraw = True
+
+    def add_board(self, origin, width, height, block_size, tile_factory, filled_color=(255, 255, 255)):
+        board = BoardLayer(self, origin, width, height, block_size, tile_factory, filled_color)
+        self.boards.append(board)
+        return board
+
+    def add_field(self, name, position, size, color=(255, 255, 255), center=False):
+        #position is the top-left corner of the text, or its center with center=True
+        self.fields[name] = TextField(position, size, color, center)
+
+    def set_text(self, name, text):
+        #Render the field again only if its text changed, "" hides it
+        field = self.fields[name]
+        if text == field.text:
+            return
+        if field.rect is not None:
+            self.dirty.append(field.rect)
+        field.text = text
+        if text:
+            field.surface = get_font(field.size).render(text, True, field.color)
+            if field.center:
+                field.rect = field.surface.get_rect(center=field.position)
+            else:
+                field.rect = field.surface.get_rect(topleft=field.position)
+            self.dirty.append(field.rect)
+        else:
+            field.surface = None
+            field.rect = None
+
+    def invalidate(self):
+        #Redraw everything on the next present(), e.g. after something else drew on the screen
+        self.layer.fill(self.background)
+        for board in self.boards:
+            board.invalidate()
+        self.full_redraw = True
+
+    def present(self):
+        #Copy the changed regions to the screen and update only those, returns the number of rectangles updated
+        if self.full_redraw:
+            self.screen.blit(self.layer, (0, 0))
+            for field in self.fields.values():
+                if field.surface is not None:
+                    self.screen.blit(field.surface, field.rect)
+            pygame.display.flip()
+            self.full_redraw = False
+            self.dirty = []
+            return 1
+        dirty = self.dirty
+        if not dirty:
+            return 0
+        for rect in dirty:
+            self.screen.blit(self.layer, rect, rect)
+            for field in self.fields.values():
+                if field.surface is not None and field.rect.colliderect(rect):
+                    self.screen.set_clip(rect)
+                    self.screen.blit(field.surface, field.rect)
+                    self.screen.set_clip(None)
+        pygame.display.update(dirty)
+        self.dirty = []
+        return len(dirty)
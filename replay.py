@@ -0,0 +1,342 @@
+import os
+import numpy as np
+
+from tetris import SHAPES, GRID_WIDTH, GRID_HEIGHT, rotate, get_orientations, check_collision
+from utils import landing_row
+from bitboard import BitBoard
+from pieces import PieceSource
+
+#Compact game replays. A game is stored as a fixed-width header (rule version, board size, piece seed,
+#parameters, outcome) followed by one byte per placement: rotation in the top 2 bits, column in the low 6.
+#The pieces are dealt again from PieceSource(seed, bag) and every piece is hard-dropped into its column,
+#so replaying never runs the AI search. Records are appended back to back to one log per training run.
+
+#Version of the game rules a replay was recorded under: placement-level games (simulator.play_game /
+#simulate_games), SHAPES in tetris.py order, pieces hard-dropped from the spawn row
+RULES_VERSION = 1
+
+REPLAY_MAGIC = 0x4C505254  #"TRPL"
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "<u4"),
+    ("rules", "<u2"),
+    ("width", "<u1"),
+    ("height", "<u1"),
+    ("bag", "<u1"),
+    ("seed", "<u8"),
+    ("generation", "<i4"),
+    ("individual", "<i4"),
+    ("game", "<i4"),
+    ("parameters", "<f4", (4,)),
+    ("lines", "<i4"),
+    ("score", "<i4"),
+    ("num_moves", "<u4"),
+])
+
+#Boards kept every KEYFRAME_INTERVAL placements so seeking replays at most that many pieces
+KEYFRAME_INTERVAL = 64
+
+MAX_COLUMN = 63
+
+
+def encode_moves(moves):
+    #(rotation, x) pairs as one uint8 per placement
+    moves = np.asarray(moves, dtype=np.int64).reshape(-1, 2)
+    if len(moves) and (moves[:, 1].max() > MAX_COLUMN or moves[:, 1].min() < 0):
+        raise ValueError(f"Replay columns must be in 0..{MAX_COLUMN}")
+    return ((moves[:, 0] & 3) << 6 | moves[:, 1]).astype(np.uint8)
+
+
+def decode_moves(data):
+    #Inverse of encode_moves, returns (rotations, columns) arrays
+    data = np.asarray(data, dtype=np.uint8)
+    return data >> 6, data & MAX_COLUMN
+
+
+class ReplayLog:
+    #Append-only file of replay records, read back sequentially into an in-memory offset index
+
+    def __init__(self, path="game_replays.bin", buffer_size=256):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.offsets = self._scan()
+
+    def _scan(self):
+        #Byte offset of every complete record, a torn record at the end (crash during a write) is ignored
+        offsets = []
+        if not os.path.exists(self.path):
+            return offsets
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as file:
+            offset = 0
+            while offset + HEADER_DTYPE.itemsize <= size:
+                file.seek(offset)
+                header = np.frombuffer(file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)[0]
+                if header["magic"] != REPLAY_MAGIC:
+                    raise ValueError(f"{self.path} is not a replay log (bad record at byte {offset})")
+                end = offset + HEADER_DTYPE.itemsize + int(header["num_moves"])
+                if end > size:
+                    break
+                offsets.append(offset)
+                offset = end
+        return offsets
+
+    def append(self, parameters, seed, moves, lines_cleared=0, score=0, bag=False, generation=-1, individual=-1, game=-1,
+               width=GRID_WIDTH, height=GRID_HEIGHT):
+        #Buffer one game, written to disk every buffer_size games or on flush()
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header["magic"] = REPLAY_MAGIC
+        header["rules"] = RULES_VERSION
+        header["width"] = width
+        header["height"] = height
+        header["bag"] = bag
+        header["seed"] = seed
+        header["generation"] = generation
+        header["individual"] = individual
+        header["game"] = game
+        header["parameters"] = np.asarray(parameters, dtype=np.float32)
+        header["lines"] = lines_cleared
+        header["score"] = score
+        header["num_moves"] = len(moves)
+        self.buffer.append(header.tobytes() + encode_moves(moves).tobytes())
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.path, "ab") as file:
+            for record in self.buffer:
+                file.write(record)
+                self.offsets.append(offset)
+                offset += len(record)
+        self.buffer = []
+
+    def truncate(self, count):
+        #Drop every game after the first count, like ResultsStore.truncate
+        self.buffer = []
+        if count < len(self.offsets):
+            with open(self.path, "r+b") as file:
+                file.truncate(self.offsets[count])
+            del self.offsets[count:]
+
+    def read_record(self, game_idx):
+        #(header, encoded moves) of the game_idx-th stored game
+        self.flush()
+        with open(self.path, "rb") as file:
+            file.seek(self.offsets[game_idx])
+            header = np.frombuffer(file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)[0].copy()
+            moves = np.frombuffer(file.read(int(header["num_moves"])), dtype=np.uint8)
+        return header, moves
+
+    def read(self, game_idx):
+        #The Replay of the game_idx-th stored game
+        return Replay(*self.read_record(game_idx))
+
+    def extend(self, other):
+        #Append every game of another replay log, e.g. the log of one island
+        for game_idx in range(len(other)):
+            header, moves = other.read_record(game_idx)
+            self.buffer.append(header.tobytes() + moves.tobytes())
+        self.flush()
+
+    def headers(self):
+        #Headers of all stored games as a HEADER_DTYPE array
+        self.flush()
+        headers = np.zeros(len(self.offsets), dtype=HEADER_DTYPE)
+        with open(self.path, "rb") as file:
+            for game_idx, offset in enumerate(self.offsets):
+                file.seek(offset)
+                headers[game_idx] = np.frombuffer(file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)[0]
+        return headers
+
+    def __len__(self):
+        return len(self.offsets) + len(self.buffer)
+
+    def close(self):
+        self.flush()
+
+
+class Replay:
+    #Headless replayer of one recorded game on the bitboard engine
+
+    def __init__(self, header, moves):
+        if header["rules"] != RULES_VERSION:
+            raise ValueError(f"Replay was recorded under rules version {header['rules']}, this replayer knows version {RULES_VERSION}")
+        self.header = header
+        self.rotations, self.columns = decode_moves(moves)
+        self.width = int(header["width"])
+        self.height = int(header["height"])
+        self.orientations = {}
+        self._pieces = None
+        self._keyframes = None
+
+    def __len__(self):
+        return len(self.rotations)
+
+    @property
+    def parameters(self):
+        return self.header["parameters"].astype(np.float64)
+
+    def pieces(self):
+        #The shape of every placement in order, dealt by the game's piece source
+        source = PieceSource(int(self.header["seed"]), bool(self.header["bag"]))
+        return [source.next_shape() for _ in range(len(self))]
+
+    def _orientation(self, shape, rotation):
+        #Orientation of shape after rotation turns, with its landing profile for this board width
+        key = (id(shape), int(rotation))
+        orientation = self.orientations.get(key)
+        if orientation is None:
+            rotated = shape
+            for _ in range(rotation):
+                rotated = rotate(rotated)
+            orientations = get_orientations(rotated, self.width)
+            orientation = orientations[0]
+            self.orientations[key] = orientation
+        return orientation
+
+    def boards(self, start=0, board=None, pieces=None):
+        #Yield (piece index, shape, x, y, board after the placement and its line clears) from placement start on
+        #board is the board before placement start (an empty board when start is 0)
+        if board is None:
+            board = BitBoard(self.width, self.height)
+        if pieces is None:
+            pieces = self.pieces()
+        for piece_idx in range(start, len(self)):
+            orientation = self._orientation(pieces[piece_idx], self.rotations[piece_idx])
+            x = int(self.columns[piece_idx])
+            y = self._landing_row(board, orientation, x)
+            board.lock_piece(orientation.shape, x, y)
+            board.clear_lines()
+            yield piece_idx, orientation.shape, x, y, board
+
+    def _landing_row(self, board, orientation, x):
+        #Landing row of a placement, found like utils.generate_placements: from the column heights, or when that
+        #row is above the spawn row (the piece slid under an overhang) by dropping it step by step from the spawn row
+        y = landing_row(board.column_heights(), orientation, x, self.height)
+        if y < 0:
+            if check_collision(board, orientation.shape, x, 0):
+                raise ValueError(f"Placement in column {x} collides at the spawn row, the replay does not match its pieces")
+            y = 0
+            while not check_collision(board, orientation.shape, x, y + 1):
+                y += 1
+        return y
+
+    def _build_keyframes(self):
+        #Board rows before every KEYFRAME_INTERVAL-th placement
+        self._pieces = self.pieces()
+        self._keyframes = [[0] * self.height]
+        for piece_idx, _, _, _, board in self.boards(pieces=self._pieces):
+            if (piece_idx + 1) % KEYFRAME_INTERVAL == 0:
+                self._keyframes.append(board.rows[:])
+
+    def board_at(self, piece_idx):
+        #Board after the first piece_idx placements (0 is the empty board)
+        if not 0 <= piece_idx <= len(self):
+            raise IndexError(f"Piece index {piece_idx} outside 0..{len(self)}")
+        if self._keyframes is None:
+            self._build_keyframes()
+        keyframe = piece_idx // KEYFRAME_INTERVAL
+        board = BitBoard(self.width, self.height, self._keyframes[keyframe])
+        start = keyframe * KEYFRAME_INTERVAL
+        if piece_idx > start:
+            for placed, _, _, _, _ in self.boards(start, board, self._pieces):
+                if placed + 1 == piece_idx:
+                    break
+        return board
+
+    def final_board(self):
+        return self.board_at(len(self))
+
+
+def view_replay(replay, block_size=25, fps=30):
+    #Pygame viewer: Right/Left step, Up/Down change the playback speed, Space pauses, Home/End seek, Esc quits
+    import pygame
+
+    pygame.init()
+    screen = pygame.display.set_mode((replay.width * block_size + 160, replay.height * block_size))
+    pygame.display.set_caption("Tetris Replay")
+    font = pygame.font.SysFont(None, 24)
+    clock = pygame.time.Clock()
+    pieces = replay.pieces()
+    piece_idx = 0
+    speed = 1  #Placements per frame while playing
+    playing = True
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    pygame.quit()
+                    return
+                if event.key == pygame.K_SPACE:
+                    playing = not playing
+                elif event.key == pygame.K_RIGHT:
+                    piece_idx = min(piece_idx + 1, len(replay))
+                elif event.key == pygame.K_LEFT:
+                    piece_idx = max(piece_idx - 1, 0)
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed = max(1, speed // 2)
+                elif event.key == pygame.K_HOME:
+                    piece_idx = 0
+                elif event.key == pygame.K_END:
+                    piece_idx = len(replay)
+        if playing:
+            piece_idx = min(piece_idx + speed, len(replay))
+
+        board = replay.board_at(piece_idx)
+        screen.fill((0, 0, 0))
+        for y, row in enumerate(board.rows):
+            for x in range(replay.width):
+                rect = pygame.Rect(x * block_size, y * block_size, block_size, block_size)
+                pygame.draw.rect(screen, (255, 255, 255), rect, 0 if (row >> x) & 1 else 1)
+        text_x = replay.width * block_size + 10
+        lines = [f"Piece: {piece_idx}/{len(replay)}", f"Speed: {speed}x", f"Lines: {int(replay.header['lines'])}",
+                 f"Score: {int(replay.header['score'])}", "Paused" if not playing else ""]
+        if piece_idx < len(replay):
+            lines.append(f"Next: {SHAPES.index(pieces[piece_idx])}")
+        for line_idx, line in enumerate(lines):
+            screen.blit(font.render(line, True, (255, 255, 255)), (text_x, 10 + line_idx * 25))
+        pygame.display.flip()
+        clock.tick(fps)
+
+
+def format_board(board):
+    return "\n".join("".join("#" if (row >> x) & 1 else "." for x in range(board.width)) for row in board.rows)
+
+
+def main(argv=None):
+    #Command line of replay.py, also run by "python cli.py replay"
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay recorded Tetris games")
+    parser.add_argument("log", nargs="?", default="game_replays.bin", help="replay log written by ai.py --record-replays")
+    parser.add_argument("--game", type=int, default=None, metavar="N", help="game to replay, omitted lists the stored games")
+    parser.add_argument("--piece", type=int, default=None, metavar="K", help="print the board after K placements (default: the final board)")
+    parser.add_argument("--view", action="store_true", help="open the Pygame viewer")
+    args = parser.parse_args(argv)
+
+    log = ReplayLog(args.log)
+    if args.game is None:
+        for game_idx, header in enumerate(log.headers()):
+            print(f"{game_idx:>6}: generation {header['generation'] + 1} individual {header['individual'] + 1} game {header['game'] + 1}, "
+                  f"{header['num_moves']} pieces, {header['lines']} lines, score {header['score']}")
+        return
+    replay = log.read(args.game)
+    if args.view:
+        view_replay(replay)
+    else:
+        piece_idx = len(replay) if args.piece is None else args.piece
+        print(f"Board after {piece_idx} of {len(replay)} placements:")
+        print(format_board(replay.board_at(piece_idx)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import ast
+import os
+import sys
+import numpy as np
+
+#Append-only binary store of game results. Records are fixed-width rows written back to back with no
+#header, so the whole file can be opened with np.memmap without parsing. A small index file next to it
+#keeps the record count and the best record so "best parameters so far" is an O(1) lookup.
+
+RECORD_DTYPE = np.dtype([
+    ("parameters", "<f4", (4,)),
+    ("score", "<f4"),
+    ("seed", "<u8"),
+    ("generation", "<i4"),
+])
+
+INDEX_DTYPE = np.dtype([
+    ("count", "<i8"),
+    ("best_row", "<i8"),
+    ("best_score", "<f4"),
+    ("best_parameters", "<f4", (4,)),
+])
+
+UNKNOWN_SEED = 0
+UNKNOWN_GENERATION = -1
+
+
+class ResultsStore:
+
+    def __init__(self, path="game_results.bin", buffer_size=1024):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.index = self._load_index()
+
+    def _load_index(self):
+        #Read the index, rebuilding it from the records if it is missing or stale
+        index = np.zeros((), dtype=INDEX_DTYPE)
+        index["best_row"] = -1
+        if os.path.exists(self.index_path):
+            index = np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=1)[0].copy()
+        if index["count"] != self._records_on_disk():
+            index = self._rebuild_index()
+        return index
+
+    def _records_on_disk(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+
+    def _rebuild_index(self):
+        records = self.records()
+        index = np.zeros((), dtype=INDEX_DTYPE)
+        index["count"] = len(records)
+        index["best_row"] = -1
+        if len(records):
+            best_row = int(np.argmax(records["score"]))
+            index["best_row"] = best_row
+            index["best_score"] = records["score"][best_row]
+            index["best_parameters"] = records["parameters"][best_row]
+        return index
+
+    def _write_index(self):
+        #Write to a temporary file first so a crash never leaves a torn index
+        temp_path = self.index_path + ".tmp"
+        np.array([self.index], dtype=INDEX_DTYPE).tofile(temp_path)
+        os.replace(temp_path, self.index_path)
+
+    def append(self, parameters, score, seed=UNKNOWN_SEED, generation=UNKNOWN_GENERATION):
+        #Buffer one game result, written to disk every buffer_size records or on flush()
+        self.buffer.append((np.asarray(parameters, dtype=np.float32), score, seed, generation))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, records):
+        #Append a structured array of RECORD_DTYPE rows
+        self.flush()
+        self._write_records(np.asarray(records, dtype=RECORD_DTYPE))
+
+    def flush(self):
+        if self.buffer:
+            records = np.array(self.buffer, dtype=RECORD_DTYPE)
+            self.buffer = []
+            self._write_records(records)
+
+    def _write_records(self, records):
+        if not len(records):
+            return
+        first_row = int(self.index["count"])
+        with open(self.path, "ab") as file:
+            records.tofile(file)
+        best_row = int(np.argmax(records["score"]))
+        if self.index["best_row"] < 0 or records["score"][best_row] > self.index["best_score"]:
+            self.index["best_row"] = first_row + best_row
+            self.index["best_score"] = records["score"][best_row]
+            self.index["best_parameters"] = records["parameters"][best_row]
+        self.index["count"] = first_row + len(records)
+        self._write_index()
+
+    def truncate(self, count):
+        #Drop every record after the first count, e.g. the games of a generation that is being replayed
+        self.buffer = []
+        if count < self._records_on_disk():
+            with open(self.path, "r+b") as file:
+                file.truncate(count * RECORD_DTYPE.itemsize)
+            self.index = self._rebuild_index()
+            self._write_index()
+
+    def records(self):
+        #All flushed records as a read-only memory map (an empty array for an empty store)
+        count = self._records_on_disk()
+        if count == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", shape=(count,))
+
+    def best(self):
+        #(parameters, score) of the best game so far, None for an empty store
+        self.flush()
+        if self.index["best_row"] < 0:
+            return None
+        return self.index["best_parameters"].astype(np.float64), float(self.index["best_score"])
+
+    def __len__(self):
+        return int(self.index["count"]) + len(self.buffer)
+
+    def close(self):
+        self.flush()
+
+
+def parse_text_results(text_path):
+    #Parse the legacy "[p1, p2, p3, p4],score" lines of game_results.txt into RECORD_DTYPE rows
+    #The parameter list contains commas itself, so only the last comma separates the score
+    rows = []
+    skipped = 0
+    with open(text_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                param_str, score = line.rsplit(",", 1)
+                parameters = ast.literal_eval(param_str)
+                if len(parameters) != 4:
+                    raise ValueError(line)
+                rows.append((parameters, float(score), UNKNOWN_SEED, UNKNOWN_GENERATION))
+            except (ValueError, SyntaxError):
+                skipped += 1
+    return np.array(rows, dtype=RECORD_DTYPE), skipped
+
+
+def import_text_results(text_path, store):
+    #One-time import of a legacy text results file into the store, returns (imported, skipped) line counts
+    records, skipped = parse_text_results(text_path)
+    store.extend(records)
+    return len(records), skipped
+
+
+if __name__ == "__main__":
+    #Usage: python results_store.py game_results.txt [game_results.bin]
+    text_path = sys.argv[1] if len(sys.argv) > 1 else "game_results.txt"
+    store = ResultsStore(sys.argv[2] if len(sys.argv) > 2 else "game_results.bin")
+    imported, skipped = import_text_results(text_path, store)
+    print(f"Imported {imported} results from {text_path} ({skipped} lines skipped), best: {store.best()}")
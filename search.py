@@ -0,0 +1,201 @@
+import time
+from collections import Counter
+
+import instrumentation
+from tetris import check_collision, shape_key, fall_interval
+from bitboard import BitBoard
+from utils import BoardFeatures, generate_placements, weighted_score, dot_score, tie_tolerance
+
+#N-ply lookahead over the current piece, the preview piece(s) and, past the known pieces, the average
+#over all shapes. Boards are bitboards so an afterstate is identified by its tuple of row masks, and a
+#transposition table makes afterstates reached by different move orders get searched only once.
+
+DEFAULT_BEAM_WIDTH = 8
+
+#(depth, beam width) levels tried in order by AnytimePlanner, each one deeper or wider than the last
+DEFAULT_LEVELS = ((1, None), (2, 4), (2, 8), (2, 16), (3, 4), (3, 8))
+
+#Share of the fall interval the planner may spend on one decision, the rest is left for the game loop
+PLANNING_FRACTION = 0.5
+
+
+class SearchTimeout(Exception):
+    #Raised inside the search when the planner's deadline has passed
+    pass
+
+
+class TranspositionTable:
+    #Bounded map from (row masks, pieces still to place, beam width) to the searched value
+
+    def __init__(self, max_size=200000):
+        self.max_size = max_size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(self.entries) >= self.max_size:
+            self.entries.clear()  #Cheaper than LRU bookkeeping, the table refills within a few pieces
+        self.entries[key] = value
+
+
+def spawn_collides(board, shape):
+    #Whether a newly spawned shape immediately collides (the game-over test of the game loops)
+    return check_collision(board, shape, board.width // 2 - len(shape[0]) // 2, 0)
+
+
+def ranked_placements(board, shape, weights, piece_y=0, beam_width=None):
+    #(score, orientation, x, y) of the placements of shape, best first, cut to beam_width
+    features = BoardFeatures(board)
+    ranked = []
+    placements = []
+    for orientation, x, y in generate_placements(board, shape, piece_y, features.heights):
+        placement = features.placement_features(orientation, x, y)
+        ranked.append((weighted_score(weights, placement), orientation, x, y))
+        placements.append(placement)
+    if ranked:
+        #Near ties of the best are scored again with score_parameters' arithmetic, as get_best_move settles them
+        best_score = max(candidate[0] for candidate in ranked)
+        tolerance = tie_tolerance(weights, features.grid_width, features.grid_height)
+        near = [idx for idx, candidate in enumerate(ranked) if candidate[0] >= best_score - tolerance]
+        if any(placements[idx] != placements[near[0]] for idx in near):
+            for idx in near:
+                ranked[idx] = (dot_score(weights, placements[idx]),) + ranked[idx][1:]
+    #Stable sort keeps get_best_move's enumeration order among equal scores
+    ranked.sort(key=lambda candidate: -candidate[0])
+    if instrumentation.enabled:
+        instrumentation.count("placements", len(ranked))
+    return ranked if beam_width is None else ranked[:beam_width]
+
+
+def afterstate(board, orientation, x, y):
+    #Board after locking the placement and clearing lines, and the number of lines cleared
+    child = board.copy()
+    child.lock_piece(orientation.shape, x, y)
+    return child, child.clear_lines()
+
+
+def search_value(board, shapes, depth, weights, beam_width, table, deadline=None):
+    #Best achievable score of the next `depth` placements from a board where no piece is falling yet
+    #shapes are the known upcoming pieces, plies past them average over all shapes of the board's piece set
+    #Raises SearchTimeout once time.perf_counter() passes deadline, unfinished nodes are never stored
+    if deadline is not None and time.perf_counter() > deadline:
+        raise SearchTimeout()
+    known = tuple(shape_key(shape) for shape in shapes[:depth])
+    key = (tuple(board.rows), known, depth, beam_width)
+    value = table.get(key)
+    if value is not None:
+        return value
+
+    if shapes:
+        value = shape_value(board, shapes[0], shapes[1:], depth, weights, beam_width, table, deadline)
+    else:
+        value = sum(shape_value(board, shape, (), depth, weights, beam_width, table, deadline) for shape in board.shapes) / len(board.shapes)
+    table.put(key, value)
+    return value
+
+
+def shape_value(board, shape, next_shapes, depth, weights, beam_width, table, deadline=None):
+    #Best value of placing shape and then searching depth - 1 further plies
+    if spawn_collides(board, shape):
+        return -float('inf')
+    ranked = ranked_placements(board, shape, weights, beam_width=None if depth == 1 else beam_width)
+    if not ranked:
+        return -float('inf')
+    if depth == 1:
+        return ranked[0][0]
+    return max(child_value(board, candidate, next_shapes, depth - 1, weights, beam_width, table, deadline) for candidate in ranked)
+
+
+def child_value(board, candidate, next_shapes, depth, weights, beam_width, table, deadline=None):
+    #Value of a placement followed by `depth` more plies, lines cleared on the way count as the lines feature
+    _, orientation, x, y = candidate
+    child, lines_cleared = afterstate(board, orientation, x, y)
+    return search_value(child, next_shapes, depth, weights, beam_width, table, deadline) + weights[1] * lines_cleared
+
+
+def get_best_move_lookahead(grid, shape, piece_x, piece_y, parameters, next_shapes=(), depth=2, beam_width=DEFAULT_BEAM_WIDTH, table=None, deadline=None):
+    #Best (rotation, x, y) for shape looking `depth` pieces ahead, next_shapes are the preview pieces
+    #depth=1 picks the same move as utils.get_best_move; deeper plies only expand the beam_width best placements
+    #With a deadline (time.perf_counter() value) the search raises SearchTimeout when it runs out of time
+    board = grid if isinstance(grid, BitBoard) else BitBoard.from_grid(grid)
+    weights = [float(weight) for weight in parameters]
+    if table is None:
+        table = TranspositionTable()
+
+    ranked = ranked_placements(board, shape, weights, piece_y, None if depth == 1 else beam_width)
+    if not ranked:
+        return None
+    if depth == 1:
+        _, orientation, x, y = ranked[0]
+        return orientation.rotation, x, y
+
+    best_value = -float('inf')
+    best_move = None
+    for candidate in ranked:
+        value = child_value(board, candidate, tuple(next_shapes), depth - 1, weights, beam_width, table, deadline)
+        if best_move is None or value > best_value:
+            best_value = value
+            _, orientation, x, y = candidate
+            best_move = (orientation.rotation, x, y)
+    return best_move
+
+
+class AnytimePlanner:
+    #Deadline-aware planner: searches increasingly deep / wide levels and returns the move of the deepest
+    #level that finished before the deadline. The first level (plain one-piece search) always runs to completion.
+
+    def __init__(self, parameters, levels=DEFAULT_LEVELS, table=None, planning_fraction=PLANNING_FRACTION):
+        self.parameters = parameters
+        self.levels = levels
+        self.planning_fraction = planning_fraction
+        self.table = table if table is not None else TranspositionTable()
+        self.decisions = 0
+        self.deadline_hits = 0
+        self.levels_completed = Counter()
+        self.total_time = 0.0
+
+    def time_budget(self, level):
+        #Seconds available for one decision at the given game level
+        return max(fall_interval(level), 0) * self.planning_fraction / 1000
+
+    def plan(self, grid, shape, piece_x, piece_y, next_shapes=(), time_budget=0.1):
+        #Best move found within time_budget seconds
+        start = time.perf_counter()
+        deadline = start + time_budget
+        best_move = None
+        completed = None
+        for level_idx, (depth, beam_width) in enumerate(self.levels):
+            try:
+                move = get_best_move_lookahead(grid, shape, piece_x, piece_y, self.parameters, next_shapes, depth,
+                                               beam_width or DEFAULT_BEAM_WIDTH, self.table, None if level_idx == 0 else deadline)
+            except SearchTimeout:
+                self.deadline_hits += 1
+                break
+            best_move = move
+            completed = (depth, beam_width)
+            if move is None or time.perf_counter() > deadline:
+                break
+
+        self.decisions += 1
+        self.levels_completed[completed] += 1
+        self.total_time += time.perf_counter() - start
+        return best_move
+
+    def stats(self):
+        #Summary of the decisions made so far
+        return {
+            "decisions": self.decisions,
+            "deadline_hits": self.deadline_hits,
+            "deadline_hit_rate": self.deadline_hits / self.decisions if self.decisions else 0.0,
+            "mean_decision_ms": 1000 * self.total_time / self.decisions if self.decisions else 0.0,
+            "levels_completed": {str(level): count for level, count in self.levels_completed.items()},
+        }
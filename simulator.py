@@ -0,0 +1,328 @@
+import math
+import numpy as np
+
+from tetris import SHAPES, GRID_WIDTH, GRID_HEIGHT, get_orientations, create_empty_grid, spawn_piece, check_collision, lock_piece, clear_lines, rotate, update_score
+from utils import get_best_move, rescore_near_ties
+from pieces import PieceSource
+import instrumentation
+from search import get_best_move_lookahead, TranspositionTable, DEFAULT_BEAM_WIDTH
+
+#play_game drives a single game one placement per piece. The lockstep simulator holds B boards as one
+#(B, GRID_HEIGHT, GRID_WIDTH) uint8 array and advances all of them one piece per step with batched
+#move generation, scoring, locking and line clearing.
+
+#Points per number of lines cleared at once, same values as tetris.update_score
+SCORE_TABLE = np.array([0, 100, 300, 600, 1000], dtype=np.int64)
+
+
+def play_game(parameters, max_pieces=500, bitboard=True, seed=None, source=None, lookahead_depth=1, beam_width=DEFAULT_BEAM_WIDTH, planner=None, max_height=None, moves=None, engine=None):
+    #Play one game placement by placement: the AI is asked once per spawned piece and the piece is
+    #hard-dropped to the chosen landing row, max_pieces=None plays until game over.
+    #Pieces come from source (pieces.py), or from a PieceSource seeded with seed, or from the global random module.
+    #lookahead_depth > 1 searches with one preview piece (search.py), the piece order is unchanged.
+    #planner (search.AnytimePlanner) decides instead with an unlimited budget, every search level finishes: this
+    #driver has no fall timer, and a wall-clock deadline would make the moves depend on the machine's load.
+    #max_height ends the game early once the stack is higher than max_height rows.
+    #moves, if given, is a list every placement is appended to as (rotation, x), see replay.py.
+    #engine (engine.py) plays on its board size and piece set, always on bitboards.
+    #Returns (lines cleared, score, pieces placed)
+    if engine is None:
+        if source is None and seed is not None:
+            source = PieceSource(seed)
+        grid = create_empty_grid(bitboard=bitboard)
+        next_piece = spawn_piece
+        grid_width = GRID_WIDTH
+    else:
+        if source is None and seed is not None:
+            source = engine.piece_source(seed)
+        grid = engine.create_board()
+        next_piece = engine.spawn_piece
+        grid_width = engine.width
+    preview = lookahead_depth > 1 or planner is not None
+    shape, piece_x, piece_y = next_piece(source)
+    next_shape = next_piece(source)[0] if preview else None
+    table = TranspositionTable() if lookahead_depth > 1 else None
+    lines_cleared = 0
+    score = 0
+    pieces = 0
+
+    while max_pieces is None or pieces < max_pieces:
+        if instrumentation.enabled:
+            decision_start = instrumentation.clock()
+        if planner is not None:
+            move = planner.plan(grid, shape, piece_x, piece_y, [next_shape], math.inf)
+        elif lookahead_depth > 1:
+            move = get_best_move_lookahead(grid, shape, piece_x, piece_y, parameters, [next_shape], lookahead_depth, beam_width, table)
+        else:
+            move = get_best_move(grid, shape, piece_x, piece_y, parameters)
+        if move is None:
+            break
+        rotation, best_x, best_y = move
+        for _ in range(rotation):
+            shape = rotate(shape)
+        if moves is not None:
+            moves.append((rotation, best_x))
+        if instrumentation.enabled:
+            lock_start = instrumentation.clock()
+            instrumentation.record_decision(lock_start - decision_start)
+        lock_piece(grid, shape, best_x, best_y)
+        num_lines_cleared = clear_lines(grid)
+        if instrumentation.enabled:
+            instrumentation.add_time("lock_clear", instrumentation.clock() - lock_start)
+            instrumentation.count("pieces")
+        lines_cleared += num_lines_cleared
+        score = update_score(score, num_lines_cleared)
+        pieces += 1
+
+        if preview:
+            shape, piece_x, piece_y = next_shape, *spawn_position(next_shape, grid_width)
+            next_shape = next_piece(source)[0]
+        else:
+            shape, piece_x, piece_y = next_piece(source)
+        if check_collision(grid, shape, piece_x, piece_y):
+            break
+        if max_height is not None and stack_higher_than(grid, max_height):
+            break
+
+    return lines_cleared, score, pieces
+
+
+def stack_higher_than(grid, height):
+    #Whether any cell is more than height rows above the floor
+    top_rows = max(0, len(grid) - height)  #A height of the whole board or more never ends the game
+    if isinstance(grid, list):
+        return any(any(row) for row in grid[:top_rows])
+    return any(grid.rows[:top_rows])
+
+
+def spawn_position(shape, grid_width=GRID_WIDTH):
+    #(x, y) where tetris.spawn_piece places a shape
+    return grid_width // 2 - len(shape[0]) // 2, 0
+
+
+class PlacementTable:
+    #Every distinct placement (orientation, x) of every shape, padded into arrays indexed [shape, placement, ...]
+
+    def __init__(self, shapes=SHAPES, grid_width=GRID_WIDTH, grid_height=GRID_HEIGHT):
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        per_shape = []
+        for shape in shapes:
+            orientations = get_orientations(shape, grid_width)
+            per_shape.append([(orientation, x) for orientation in orientations for x in orientation.x_range])
+        num_shapes = len(shapes)
+        num_placements = max(len(placements) for placements in per_shape)
+        max_width = max(orientation.width for placements in per_shape for orientation, _ in placements)
+        max_height = max(orientation.height for placements in per_shape for orientation, _ in placements)
+        max_cells = max(sum(orientation.row_cells) for placements in per_shape for orientation, _ in placements)
+
+        self.valid = np.zeros((num_shapes, num_placements), dtype=bool)
+        self.rotation = np.zeros((num_shapes, num_placements), dtype=np.int64)
+        self.x = np.zeros((num_shapes, num_placements), dtype=np.int64)
+        self.num_cells = np.zeros((num_shapes, num_placements), dtype=np.int64)
+        #Per piece column: mask, bottom / top filled row and cell count
+        self.column_mask = np.zeros((num_shapes, num_placements, max_width), dtype=bool)
+        self.bottom = np.zeros((num_shapes, num_placements, max_width), dtype=np.int64)
+        self.top = np.zeros((num_shapes, num_placements, max_width), dtype=np.int64)
+        self.column_cells = np.zeros((num_shapes, num_placements, max_width), dtype=np.int64)
+        #Per piece row: cell count (0 for padding rows)
+        self.row_mask = np.zeros((num_shapes, num_placements, max_height), dtype=bool)
+        self.row_cells = np.zeros((num_shapes, num_placements, max_height), dtype=np.int64)
+        #Cell offsets relative to the placement's top-left corner
+        self.cell_mask = np.zeros((num_shapes, num_placements, max_cells), dtype=bool)
+        self.cell_rows = np.zeros((num_shapes, num_placements, max_cells), dtype=np.int64)
+        self.cell_cols = np.zeros((num_shapes, num_placements, max_cells), dtype=np.int64)
+
+        for s, placements in enumerate(per_shape):
+            for p, (orientation, x) in enumerate(placements):
+                self.valid[s, p] = True
+                self.rotation[s, p] = orientation.rotation
+                self.x[s, p] = x
+                self.num_cells[s, p] = sum(orientation.row_cells)
+                width = orientation.width
+                self.column_mask[s, p, :width] = True
+                self.bottom[s, p, :width] = orientation.bottom
+                self.top[s, p, :width] = orientation.top
+                self.column_cells[s, p, :width] = orientation.column_cells
+                self.row_mask[s, p, :orientation.height] = True
+                self.row_cells[s, p, :orientation.height] = orientation.row_cells
+                cells = [(row_idx, col_idx) for row_idx, row in enumerate(orientation.shape) for col_idx, cell in enumerate(row) if cell]
+                self.cell_mask[s, p, :len(cells)] = True
+                self.cell_rows[s, p, :len(cells)] = [row_idx for row_idx, _ in cells]
+                self.cell_cols[s, p, :len(cells)] = [col_idx for _, col_idx in cells]
+
+        #Spawn position and cells of every shape, as in tetris.spawn_piece
+        max_spawn_cells = max(sum(sum(row) for row in shape) for shape in shapes)
+        self.spawn_mask = np.zeros((num_shapes, max_spawn_cells), dtype=bool)
+        self.spawn_rows = np.zeros((num_shapes, max_spawn_cells), dtype=np.int64)
+        self.spawn_cols = np.zeros((num_shapes, max_spawn_cells), dtype=np.int64)
+        for s, shape in enumerate(shapes):
+            spawn_x = grid_width // 2 - len(shape[0]) // 2
+            cells = [(row_idx, spawn_x + col_idx) for row_idx, row in enumerate(shape) for col_idx, cell in enumerate(row) if cell]
+            self.spawn_mask[s, :len(cells)] = True
+            self.spawn_rows[s, :len(cells)] = [row_idx for row_idx, _ in cells]
+            self.spawn_cols[s, :len(cells)] = [col_idx for _, col_idx in cells]
+
+
+PLACEMENT_TABLE = PlacementTable()
+
+
+def column_heights(boards):
+    #Height of every column of a (B, H, W) board stack, 0 for an empty column
+    grid_height = boards.shape[1]
+    return np.where(boards.any(axis=1), grid_height - boards.argmax(axis=1), 0)
+
+
+def choose_placements(boards, shape_idx, parameters, table=PLACEMENT_TABLE):
+    #Best placement per board, scored like utils.get_best_move for a piece spawned at the top
+    #Returns (placement index, landing row, has a legal placement) arrays of shape (B,)
+    num_boards, grid_height, grid_width = boards.shape
+    board_idx = np.arange(num_boards)[:, np.newaxis]
+
+    heights = column_heights(boards)
+    row_counts = boards.sum(axis=2, dtype=np.int64)
+    column_counts = boards.sum(axis=1, dtype=np.int64)
+    column_holes = heights - column_counts
+
+    #Gather the placement table rows of every board's current piece
+    x = table.x[shape_idx]
+    column_mask = table.column_mask[shape_idx]
+    num_columns = column_mask.shape[2]
+    columns = np.minimum(x[:, :, np.newaxis] + np.arange(num_columns), grid_width - 1)
+    column_heights_at = heights[board_idx[:, :, np.newaxis], columns]
+
+    #Landing row from the bottom profile against the column heights
+    landing = np.where(column_mask, grid_height - column_heights_at - 1 - table.bottom[shape_idx], grid_height).min(axis=2)
+    legal = table.valid[shape_idx] & (landing >= 0)
+    landing = np.maximum(landing, 0)
+
+    aggregate_height = boards.sum(axis=(1, 2), dtype=np.int64)[:, np.newaxis] + table.num_cells[shape_idx]
+
+    row_mask = table.row_mask[shape_idx]
+    rows = np.minimum(landing[:, :, np.newaxis] + np.arange(row_mask.shape[2]), grid_height - 1)
+    completed = row_mask & (row_counts[board_idx[:, :, np.newaxis], rows] + table.row_cells[shape_idx] == grid_width)
+    complete_lines = (row_counts == grid_width).sum(axis=1)[:, np.newaxis] + completed.sum(axis=2)
+
+    #New column heights and holes, only the piece columns change
+    piece_heights = np.maximum(column_heights_at, grid_height - landing[:, :, np.newaxis] - table.top[shape_idx])
+    column_counts_at = column_counts[board_idx[:, :, np.newaxis], columns]
+    column_holes_at = column_holes[board_idx[:, :, np.newaxis], columns]
+    hole_delta = piece_heights - column_counts_at - table.column_cells[shape_idx] - column_holes_at
+    holes = column_holes.sum(axis=1)[:, np.newaxis] + np.where(column_mask, hole_delta, 0).sum(axis=2)
+
+    new_heights = np.repeat(heights[:, np.newaxis, :], x.shape[1], axis=1)
+    for col_idx in range(num_columns):
+        b, p = np.nonzero(column_mask[:, :, col_idx])
+        new_heights[b, p, columns[b, p, col_idx]] = piece_heights[b, p, col_idx]
+    bumpiness = np.abs(np.diff(new_heights, axis=2)).sum(axis=2)
+
+    features = np.stack([aggregate_height, complete_lines, holes, bumpiness], axis=2)
+    #Summed term by term in utils.weighted_score order, near ties are settled like in get_best_move
+    scores = features[:, :, 0] * parameters[:, 0, np.newaxis]
+    for feature_idx in range(1, 4):
+        scores = scores + features[:, :, feature_idx] * parameters[:, feature_idx, np.newaxis]
+    scores[~legal] = -np.inf
+    rescore_near_ties(scores, features, parameters, grid_width, grid_height)
+    placement = scores.argmax(axis=1)
+    return placement, landing[np.arange(num_boards), placement], legal.any(axis=1)
+
+
+def lock_placements(boards, shape_idx, placement, landing, table=PLACEMENT_TABLE):
+    #Write the chosen placements into the boards in place
+    x = table.x[shape_idx, placement]
+    cell_mask = table.cell_mask[shape_idx, placement]
+    b, c = np.nonzero(cell_mask)
+    boards[b, landing[b] + table.cell_rows[shape_idx, placement][b, c], x[b] + table.cell_cols[shape_idx, placement][b, c]] = 1
+
+
+def clear_full_lines(boards):
+    #Clear complete rows of every board in place, returns the number of lines cleared per board
+    full = boards.all(axis=2)
+    num_lines_cleared = full.sum(axis=1)
+    cleared = np.nonzero(num_lines_cleared)[0]
+    if len(cleared):
+        #Stable sort puts the full rows on top while keeping the order of the other rows
+        order = np.argsort(~full[cleared], axis=1, kind="stable")
+        compacted = np.take_along_axis(boards[cleared], order[:, :, np.newaxis], axis=1)
+        compacted[np.arange(boards.shape[1])[np.newaxis, :] < num_lines_cleared[cleared, np.newaxis]] = 0
+        boards[cleared] = compacted
+    return num_lines_cleared
+
+
+def spawn_collides(boards, shape_idx, table=PLACEMENT_TABLE):
+    #Whether each board's newly spawned piece collides, i.e. tetris.check_collision at the spawn position
+    b, c = np.nonzero(table.spawn_mask[shape_idx])
+    collides = np.zeros(len(boards), dtype=bool)
+    np.logical_or.at(collides, b, boards[b, table.spawn_rows[shape_idx][b, c], table.spawn_cols[shape_idx][b, c]] > 0)
+    return collides
+
+
+def simulate_games(parameters, max_pieces=500, seed=None, table=PLACEMENT_TABLE, sequences=None, max_height=None, moves=None):
+    #Play one game per parameter row in lockstep, returns (lines cleared, score) arrays of shape (B,)
+    #sequences is an optional (B, L) uint8 array of piece indices (see pieces.SequenceBank), pieces
+    #past its end and all pieces without it are drawn from a NumPy generator seeded with seed
+    #max_height ends a game once its stack is higher than max_height rows, like play_game
+    #moves, if given, is a list of B lists, every game's placements are appended to its list as (rotation, x)
+    parameters = np.atleast_2d(np.asarray(parameters, dtype=np.float64))
+    num_games = len(parameters)
+    rng = np.random.default_rng(seed)
+    num_shapes = table.valid.shape[0]
+
+    def next_pieces(boards_idx, piece_number):
+        if sequences is not None and piece_number < sequences.shape[1]:
+            return sequences[boards_idx, piece_number].astype(np.int64)
+        return rng.integers(num_shapes, size=len(boards_idx))
+
+    boards = np.zeros((num_games, table.grid_height, table.grid_width), dtype=np.uint8)
+    lines = np.zeros(num_games, dtype=np.int64)
+    scores = np.zeros(num_games, dtype=np.int64)
+    active = np.ones(num_games, dtype=bool)
+    shape_idx = next_pieces(np.arange(num_games), 0)
+
+    for piece_number in range(max_pieces):
+        playing = np.nonzero(active)[0]
+        if not len(playing):
+            break
+        if instrumentation.enabled:
+            step_start = instrumentation.clock()
+        placement, landing, has_move = choose_placements(boards[playing], shape_idx[playing], parameters[playing], table)
+        active[playing[~has_move]] = False
+        if instrumentation.enabled:
+            #Placements come from the precomputed table, so the batch step is all feature scoring
+            lock_start = instrumentation.clock()
+            instrumentation.add_time("feature_scoring", lock_start - step_start)
+            instrumentation.count("placements", int(table.valid[shape_idx[playing]].sum()))
+        playing, placement, landing = playing[has_move], placement[has_move], landing[has_move]
+        if moves is not None:
+            placed_shapes = shape_idx[playing]
+            for game_idx, rotation, x in zip(playing.tolist(), table.rotation[placed_shapes, placement].tolist(), table.x[placed_shapes, placement].tolist()):
+                moves[game_idx].append((rotation, x))
+
+        step_boards = boards[playing]
+        lock_placements(step_boards, shape_idx[playing], placement, landing, table)
+        num_lines_cleared = clear_full_lines(step_boards)
+        boards[playing] = step_boards
+        if instrumentation.enabled:
+            instrumentation.add_time("lock_clear", instrumentation.clock() - lock_start)
+            instrumentation.count("pieces", len(playing))
+        lines[playing] += num_lines_cleared
+        scores[playing] += SCORE_TABLE[np.minimum(num_lines_cleared, 4)]
+
+        #Spawn the next pieces, finished games are masked out
+        shape_idx[playing] = next_pieces(playing, piece_number + 1)
+        active[playing[spawn_collides(boards[playing], shape_idx[playing], table)]] = False
+        if max_height is not None:
+            active[playing[boards[playing, :max(0, table.grid_height - max_height)].any(axis=(1, 2))]] = False
+
+    return lines, scores
+
+
+def simulate_population(population, num_games=5, max_pieces=500, seed=None, table=PLACEMENT_TABLE, bank=None):
+    #Play num_games games for every individual in one lockstep batch
+    #With a pieces.SequenceBank every individual plays the same num_games piece sequences
+    #Returns (lines cleared, score) arrays of shape (len(population), num_games)
+    population = np.asarray(population, dtype=np.float64)
+    parameters = np.repeat(population, num_games, axis=0)
+    sequences = None if bank is None else np.tile(bank.sequences[:num_games], (len(population), 1))
+    lines, scores = simulate_games(parameters, max_pieces, seed, table, sequences)
+    return lines.reshape(len(population), num_games), scores.reshape(len(population), num_games)
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+import tetris
+from tetris import SHAPES, GRID_WIDTH, GRID_HEIGHT, rotate
+from utils import get_best_move, score_parameters, calculate_aggregate_height, count_holes, calculate_bumpiness
+from bitboard import BitBoard
+from engine import get_engine
+
+#Parity of the bitboard engine with the list grid: AI-driven games are played on both side by side and every
+#step must give identical results, the move get_best_move picks, the features and score_parameters of the
+#board, and the board after every lock and line clear
+
+PARITY_PARAMETERS = (-0.510066, 0.760666, -0.35663, -0.184483)  #A tuned player, plays games of a few hundred pieces
+
+
+def list_features(grid):
+    #The four score_parameters features of a list-of-lists grid, computed cell by cell
+    complete_lines = sum(all(row) for row in grid)
+    return calculate_aggregate_height(grid), complete_lines, count_holes(grid), calculate_bumpiness(grid)
+
+
+@pytest.mark.parametrize("size", [None, (14, 30)], ids=["default", "14x30"])
+@pytest.mark.parametrize("seed", range(4))
+def test_ai_games_match_the_list_grid(size, seed, num_games=5, max_pieces=500):
+    #Every other game is played with PARITY_PARAMETERS, the rest with random weights, until game over or max_pieces
+    engine = None if size is None else get_engine(*size)
+    width, height, shapes = (GRID_WIDTH, GRID_HEIGHT, SHAPES) if engine is None else (engine.width, engine.height, engine.shapes)
+    rng = random.Random(seed)
+    compared = 0
+    for game_idx in range(num_games):
+        parameters = PARITY_PARAMETERS if game_idx % 2 == 0 else tuple(rng.gauss(0, 1) for _ in range(4))
+        grid = tetris.create_empty_grid(width=width, height=height)
+        board = BitBoard(width, height, engine=engine)
+        for _ in range(max_pieces):
+            shape = rng.choice(shapes)
+            x, y = width // 2 - len(shape[0]) // 2, 0
+            collides = tetris.check_collision(grid, shape, x, y)
+            assert collides == tetris.check_collision(board, shape, x, y), "spawn collision mismatch"
+            if collides:
+                break
+            move = get_best_move(grid, shape, x, y, parameters)
+            assert move == get_best_move(board, shape, x, y, parameters), f"move mismatch after {compared} placements"
+            if move is None:
+                break
+            rotation, x, y = move
+            for _ in range(rotation):
+                shape = rotate(shape)
+            tetris.lock_piece(grid, shape, x, y)
+            tetris.lock_piece(board, shape, x, y)
+            assert board == grid, "lock mismatch"
+            assert board.features() == list_features(grid), "features mismatch"
+            assert score_parameters(board, parameters) == score_parameters(grid, parameters), "score mismatch"
+            assert tetris.clear_lines(grid) == tetris.clear_lines(board), "lines cleared mismatch"
+            assert board == grid, "clear mismatch"
+            assert BitBoard.from_grid(grid, engine) == board, "from_grid mismatch"
+            compared += 1
+            game_over = tetris.is_game_over(grid)
+            assert game_over == tetris.is_game_over(board), "game over mismatch"
+            if game_over:
+                break
+    assert compared > 100
+
+
+def test_from_grid_keeps_the_engine():
+    engine = get_engine(14, 30)
+    board = BitBoard.from_grid(tetris.create_empty_grid(width=14, height=30), engine)
+    assert board.piece_masks is engine.piece_masks
+    assert board.orientations is engine.orientations
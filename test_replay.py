@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from tetris import create_empty_grid, spawn_piece, check_collision, lock_piece, clear_lines, rotate, get_orientations
+from utils import get_best_move, get_column_heights, landing_row
+from simulator import play_game
+from pieces import PieceSource
+from replay import ReplayLog
+
+#Recorded games replayed by replay.Replay must end on the board the game itself ended on
+
+
+def play_recorded_game(parameters, seed, max_pieces=300):
+    #simulator.play_game on a list grid, returns (moves, landing rows, final grid, placements that slid under an overhang)
+    source = PieceSource(seed)
+    grid = create_empty_grid()
+    moves, rows = [], []
+    slid = 0
+    shape, piece_x, piece_y = spawn_piece(source)
+    while len(moves) < max_pieces:
+        move = get_best_move(grid, shape, piece_x, piece_y, parameters)
+        if move is None:
+            break
+        rotation, x, y = move
+        for _ in range(rotation):
+            shape = rotate(shape)
+        slid += landing_row(get_column_heights(grid), get_orientations(shape)[0], x, len(grid)) < 0
+        moves.append((rotation, x))
+        rows.append(y)
+        lock_piece(grid, shape, x, y)
+        clear_lines(grid)
+        shape, piece_x, piece_y = spawn_piece(source)
+        if check_collision(grid, shape, piece_x, piece_y):
+            break
+    return moves, rows, grid, slid
+
+
+def test_replays_end_on_the_played_boards(tmp_path):
+    rng = random.Random(0)
+    log = ReplayLog(str(tmp_path / "replays.bin"))
+    games = []
+    for seed in range(60):
+        parameters = [rng.gauss(0, 1) for _ in range(4)]
+        moves, rows, grid, slid = play_recorded_game(parameters, seed)
+        recorded = []
+        play_game(parameters, 300, bitboard=False, seed=seed, moves=recorded)
+        assert recorded == moves
+        log.append(parameters, seed, moves)
+        games.append((rows, grid, slid))
+
+    assert sum(slid for _, _, slid in games) > 0, "no game slid a piece under an overhang"
+    for game_idx, (rows, grid, _) in enumerate(games):
+        replay = log.read(game_idx)
+        steps = [(y, board.rows[:]) for _, _, _, y, board in replay.boards()]
+        assert [y for y, _ in steps] == rows
+        assert replay.final_board() == grid
+        middle = len(rows) // 2
+        if middle:
+            assert replay.board_at(middle).rows == steps[middle - 1][1]  #Seeking from a keyframe
+
+
+def test_replay_rejects_moves_that_do_not_fit(tmp_path):
+    log = ReplayLog(str(tmp_path / "replays.bin"))
+    log.append([0, 0, 0, 0], 0, [(0, 0)] * 40)  #Every piece in column 0 overflows the board
+    with pytest.raises(ValueError):
+        log.read(0).final_board()
@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+import pytest
+
+from tetris import SHAPES, create_empty_grid, check_collision, lock_piece, clear_lines, rotate, copy_grid
+from utils import get_best_move, score_parameters, calculate_aggregate_height, count_holes, calculate_bumpiness
+from bitboard import BitBoard
+from search import get_best_move_lookahead
+
+#get_best_move must pick what the original full-rescan search picked: score every placement of a copied grid with
+#score_parameters (np.dot of the parameters and the features) and keep the first of the highest scores
+
+
+def reference_move(grid, shape, piece_y, parameters):
+    best_score = -float('inf')
+    best_move = None
+    for rotation in range(4):
+        rotated = shape
+        for _ in range(rotation):
+            rotated = rotate(rotated)
+        for x in range(len(grid[0])):
+            if check_collision(grid, rotated, x, piece_y):
+                continue
+            y = piece_y
+            while not check_collision(grid, rotated, x, y + 1):
+                y += 1
+            test_grid = copy_grid(grid)
+            lock_piece(test_grid, rotated, x, y)
+            score = score_parameters(test_grid, parameters)
+            if score > best_score:
+                best_score = score
+                best_move = (rotation, x, y)
+    return best_move
+
+
+def test_score_parameters_is_the_dot_product():
+    rng = random.Random(0)
+    for _ in range(200):
+        grid = [[int(rng.random() < 0.4) for _ in range(10)] for _ in range(20)]
+        parameters = np.array([rng.gauss(0, 1) for _ in range(4)])
+        features = np.array([calculate_aggregate_height(grid), sum(all(row) for row in grid), count_holes(grid), calculate_bumpiness(grid)])
+        assert score_parameters(grid, parameters) == np.dot(parameters, features)
+        assert score_parameters(BitBoard.from_grid(grid), parameters) == np.dot(parameters, features)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_moves_match_the_full_rescan(seed):
+    rng = random.Random(seed)
+    decisions = 0
+    for game_idx in range(10):
+        parameters = np.array([rng.gauss(0, 1) for _ in range(4)])
+        if game_idx % 2:
+            parameters = np.round(parameters, 1)  #Short decimals give many exact and near ties
+        grid = create_empty_grid()
+        for _ in range(100):
+            shape = rng.choice(SHAPES)
+            piece_x = len(grid[0]) // 2 - len(shape[0]) // 2
+            if check_collision(grid, shape, piece_x, 0):
+                break
+            move = reference_move(grid, shape, 0, parameters)
+            board = BitBoard.from_grid(grid)
+            assert get_best_move(grid, shape, piece_x, 0, parameters) == move
+            assert get_best_move(board, shape, piece_x, 0, parameters) == move
+            assert get_best_move(grid, shape, piece_x, 0, parameters, vectorized=True) == move
+            assert get_best_move_lookahead(board, shape, piece_x, 0, parameters, depth=1) == move
+            decisions += 1
+            if move is None:
+                break
+            rotation, x, y = move
+            for _ in range(rotation):
+                shape = rotate(shape)
+            lock_piece(grid, shape, x, y)
+            clear_lines(grid)
+    assert decisions > 100
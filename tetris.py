@@ -1,6 +1,6 @@
 import random
 import os
-import pygame
+from collections import namedtuple
 
 #Screen and grid dimensions
 GRID_WIDTH, GRID_HEIGHT = 10, 20
@@ -19,13 +19,25 @@ SHAPES = [
     [[1, 1, 1], [1, 0, 0]]   #J shape
 ]
 
+#One distinct orientation of a Tetrimino, see build_orientations
+Orientation = namedtuple("Orientation", ["rotation", "shape", "width", "height", "bottom", "top", "column_cells", "row_cells", "x_range"])
+
 #Basic colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-def create_empty_grid():
-    #Create an empty grid filled with zeros
-    return [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+def create_empty_grid(bitboard=False, width=GRID_WIDTH, height=GRID_HEIGHT):
+    #Create an empty grid filled with zeros, or an empty bitboard (see bitboard.py)
+    if bitboard:
+        from bitboard import BitBoard
+        return BitBoard(width, height)
+    return [[0 for _ in range(width)] for _ in range(height)]
+
+def copy_grid(grid):
+    #Copy a grid of either engine
+    if isinstance(grid, list):
+        return [row[:] for row in grid]
+    return grid.copy()
 
 def update_high_score(score, high_score):
     #Update the high score if the current score is higher
@@ -48,20 +60,23 @@ def save_high_score(score):
 
 def draw_grid(screen, grid):
     #Draw the game grid on the screen
+    import pygame  #Imported here so the engine itself never loads Pygame
     for x in range(GRID_WIDTH):
         for y in range(GRID_HEIGHT):
             rect = pygame.Rect(x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)
             pygame.draw.rect(screen, WHITE, rect, 1 if grid[y][x] == 0 else 0)
 
-def spawn_piece():
-    #Randomly select a Tetrimino shape and initialize its position
-    shape = random.choice(SHAPES)
-    piece_x = GRID_WIDTH // 2 - len(shape[0]) // 2
+def spawn_piece(source=None, grid_width=GRID_WIDTH):
+    #Select the next Tetrimino shape and initialize its position
+    #source is a piece source from pieces.py, without one the shape is drawn from the global random module
+    shape = random.choice(SHAPES) if source is None else source.next_shape()
+    piece_x = grid_width // 2 - len(shape[0]) // 2
     piece_y = 0
     return shape, piece_x, piece_y
 
 def draw_piece(screen, shape, x, y, color=WHITE):
     #Draw the Tetrimino piece on the screen
+    import pygame
     for row_idx, row in enumerate(shape):
         for col_idx, cell in enumerate(row):
             if cell:
@@ -69,6 +84,7 @@ def draw_piece(screen, shape, x, y, color=WHITE):
 
 def draw_preview(screen, shape, preview_x, preview_y):
     #Draw a preview of the upcoming Tetrimino
+    import pygame
     for row_idx, row in enumerate(shape):
         for col_idx, cell in enumerate(row):
             if cell:
@@ -76,17 +92,23 @@ def draw_preview(screen, shape, preview_x, preview_y):
 
 def check_collision(grid, shape, x, y):
     #Check if the Tetrimino piece collides with the grid boundaries or other pieces
+    if not isinstance(grid, list):
+        return grid.check_collision(shape, x, y)
+    grid_width = len(grid[0])
+    grid_height = len(grid)
     for row_idx, row in enumerate(shape):
         for col_idx, cell in enumerate(row):
             if cell:
                 grid_x = x + col_idx
                 grid_y = y + row_idx
-                if grid_x < 0 or grid_x >= GRID_WIDTH or grid_y >= GRID_HEIGHT or grid[grid_y][grid_x]:
+                if grid_x < 0 or grid_x >= grid_width or grid_y >= grid_height or grid[grid_y][grid_x]:
                     return True
     return False
 
 def lock_piece(grid, shape, x, y):
     #Lock the Tetrimino piece into the grid
+    if not isinstance(grid, list):
+        return grid.lock_piece(shape, x, y)
     for row_idx, row in enumerate(shape):
         for col_idx, cell in enumerate(row):
             if cell:
@@ -94,6 +116,7 @@ def lock_piece(grid, shape, x, y):
 
 def display_final_score(screen, score, high_score):
     #Display the final score and high score on the screen
+    import pygame
     font = pygame.font.SysFont(None, 55)
     text = font.render(f"Final Score: {score}", True, WHITE)
     high_score_text = font.render(f"High Score: {high_score}", True, WHITE)
@@ -107,6 +130,7 @@ def display_final_score(screen, score, high_score):
 
 def handle_end_of_game(score):
     #Handle the end of the game, update and display high score
+    import pygame
     high_score = load_high_score()
     
     #Update high score if necessary
@@ -128,21 +152,74 @@ def drop_piece(grid, shape, piece_x, piece_y):
 
 def is_game_over(grid):
     #Check if the game is over by checking if any blocks are in the top row
-    return any(grid[0][x] for x in range(GRID_WIDTH))
+    if not isinstance(grid, list):
+        return grid.is_game_over()
+    return any(grid[0])
 
 def rotate(shape):
     #Rotate the Tetrimino piece 90 degrees clockwise
     return [list(row) for row in zip(*shape[::-1])]
 
+def shape_key(shape):
+    #Hashable key for a (possibly rotated) Tetrimino shape
+    return tuple(tuple(row) for row in shape)
+
+def build_orientations(shape, grid_width=GRID_WIDTH):
+    #Distinct orientations of the shape in rotation order, duplicates (O, and I/S/Z after two turns) are dropped
+    #rotation is the number of rotate() calls from the given shape, bottom[c] / top[c] are the lowest / highest
+    #filled rows of column c, column_cells and row_cells count the filled cells per column and per row
+    orientations = []
+    seen = set()
+    rotated = shape
+    for rotation in range(4):
+        key = shape_key(rotated)
+        if key not in seen:
+            seen.add(key)
+            width = len(key[0])
+            bottom = tuple(max(row_idx for row_idx, row in enumerate(key) if row[col_idx]) for col_idx in range(width))
+            top = tuple(min(row_idx for row_idx, row in enumerate(key) if row[col_idx]) for col_idx in range(width))
+            column_cells = tuple(sum(row[col_idx] for row in key) for col_idx in range(width))
+            row_cells = tuple(sum(row) for row in key)
+            orientations.append(Orientation(rotation, key, width, len(key), bottom, top, column_cells, row_cells, range(grid_width - width + 1)))
+        rotated = rotate(rotated)
+    return tuple(orientations)
+
+def build_orientation_table(shapes, grid_width=GRID_WIDTH):
+    #Orientation table for every rotation of every shape, keyed by shape_key
+    table = {}
+    for shape in shapes:
+        rotated = shape
+        for _ in range(4):
+            table.setdefault(shape_key(rotated), build_orientations(rotated, grid_width))
+            rotated = rotate(rotated)
+    return table
+
+def orientation_table(grid_width=GRID_WIDTH):
+    #Orientation table of SHAPES on a board of grid_width columns, built once per width
+    table = _orientation_tables.get(grid_width)
+    if table is None:
+        table = build_orientation_table(SHAPES, grid_width)
+        _orientation_tables[grid_width] = table
+    return table
+
+def get_orientations(shape, grid_width=GRID_WIDTH):
+    #Look up the distinct orientations of a shape, building them for shapes outside SHAPES
+    orientations = orientation_table(grid_width).get(shape_key(shape))
+    if orientations is None:
+        orientations = build_orientations(shape, grid_width)
+    return orientations
+
 def clear_lines(grid):
     #Clear complete lines from the grid and return the number of lines cleared
+    if not isinstance(grid, list):
+        return grid.clear_lines()
     lines_to_clear = [i for i, row in enumerate(grid) if all(row)]
     num_lines_cleared = len(lines_to_clear)
     lines_cleared = num_lines_cleared  #Update lines_cleared locally
     
     for line in lines_to_clear:
         del grid[line]
-        grid.insert(0, [0] * GRID_WIDTH)
+        grid.insert(0, [0] * len(grid[0]))
     
     return lines_cleared
 
@@ -158,6 +235,14 @@ def update_score(score, num_lines_cleared):
         score += 1000
     return score
 
+def fall_interval(level):
+    #Milliseconds between two fall steps at the given level, the game loops move the piece once this has elapsed
+    return 500 - (level - 1) * 50
+
+#Precomputed, immutable orientation table used by the move generator in utils.get_best_move
+ORIENTATIONS = build_orientation_table(SHAPES)
+_orientation_tables = {GRID_WIDTH: ORIENTATIONS}
+
 def draw_ghost_piece(screen, grid, shape, piece_x, piece_y):
     #Draw a ghost piece to show where the Tetrimino would land
     ghost_y = piece_y
@@ -1,61 +1,288 @@
 import numpy as np
 
+import instrumentation
+
 #Import necessary functions from tetris (assuming you have them there)
-from tetris import rotate, check_collision, lock_piece, clear_lines, GRID_WIDTH, GRID_HEIGHT
+from tetris import check_collision, get_orientations, GRID_HEIGHT
 
-def get_best_move(grid, shape, piece_x, piece_y, parameters):
+def get_best_move(grid, shape, piece_x, piece_y, parameters, vectorized=False):
     #Find the best move for the Tetrimino based on score parameters
+    #vectorized=True scores all afterstates at once with NumPy (see get_best_move_vectorized)
+    if vectorized:
+        return get_best_move_vectorized(grid, shape, piece_x, piece_y, parameters)
+    if instrumentation.enabled:
+        return get_best_move_instrumented(grid, shape, piece_y, parameters)
+
     best_score = -float('inf')
-    best_move = None
+    near = []  #(score, features, move) of the candidates within tolerance of the best so far
+    features = BoardFeatures(grid)
+    weights = [float(weight) for weight in parameters]
+    tolerance = tie_tolerance(weights, features.grid_width, features.grid_height)
+
+    #Test every distinct, in-bounds placement
+    for orientation, x, test_y in generate_placements(grid, shape, piece_y, features.heights):
+        #Evaluate this position as a delta from the current board, without copying the grid
+        placement = features.placement_features(orientation, x, test_y)
+        score = weighted_score(weights, placement)
+
+        if score >= best_score - tolerance:
+            near.append((score, placement, (orientation.rotation, x, test_y)))
+            if score > best_score:
+                best_score = score
 
-    #Test all possible actions
-    for rotation in range(4):
-        rotated_shape = shape
-        for _ in range(rotation):
-            rotated_shape = rotate(rotated_shape)  #Rotate the piece 90 degrees
+    return break_near_ties(near, best_score, tolerance, parameters)
 
-        for x in range(GRID_WIDTH):
-            if not check_collision(grid, rotated_shape, x, piece_y):
-                #Drop the piece to the lowest possible position
+def get_best_move_instrumented(grid, shape, piece_y, parameters):
+    #get_best_move with move generation and feature scoring timed separately (same placements, same move)
+    start = instrumentation.clock()
+    features = BoardFeatures(grid)
+    placements = list(generate_placements(grid, shape, piece_y, features.heights))
+    generated = instrumentation.clock()
+
+    best_score = -float('inf')
+    near = []
+    weights = [float(weight) for weight in parameters]
+    tolerance = tie_tolerance(weights, features.grid_width, features.grid_height)
+    for orientation, x, test_y in placements:
+        placement = features.placement_features(orientation, x, test_y)
+        score = weighted_score(weights, placement)
+        if score >= best_score - tolerance:
+            near.append((score, placement, (orientation.rotation, x, test_y)))
+            if score > best_score:
+                best_score = score
+    best_move = break_near_ties(near, best_score, tolerance, parameters)
+
+    instrumentation.add_time("move_generation", generated - start)
+    instrumentation.add_time("feature_scoring", instrumentation.clock() - generated)
+    instrumentation.count("placements", len(placements))
+    return best_move
+
+def generate_placements(grid, shape, piece_y, heights=None):
+    #Yield (orientation, x, landing_y) for every distinct, in-bounds placement of the shape
+    #Bitboards carry the orientation table of their own width and piece set, list grids use the one of their width
+    grid_height = len(grid)
+    if heights is None:
+        heights = get_column_heights(grid)
+    for orientation in (get_orientations(shape, len(grid[0])) if isinstance(grid, list) else grid.get_orientations(shape)):
+        rotated_shape = orientation.shape
+        for x in orientation.x_range:
+            #Landing row from the bottom profile against the column heights
+            test_y = landing_row(heights, orientation, x, grid_height)
+            if test_y < piece_y:
+                #The piece starts below the stack surface here, so drop it step by step from piece_y
+                if check_collision(grid, rotated_shape, x, piece_y):
+                    continue
                 test_y = piece_y
                 while not check_collision(grid, rotated_shape, x, test_y + 1):
                     test_y += 1
+            yield orientation, x, test_y
+
+def build_afterstates(grid, shape, piece_y):
+    #Stack every legal afterstate of the piece into a uint8 array of shape (N, GRID_HEIGHT, GRID_WIDTH)
+    #Returns the moves as (rotation, x, y) in get_best_move order and the boards (lines are not cleared)
+    placements = list(generate_placements(grid, shape, piece_y))
+    base = np.array(grid if isinstance(grid, list) else grid.to_grid(), dtype=np.uint8)
+    boards = np.repeat(base[np.newaxis], len(placements), axis=0)
+    board_idx, row_idx, col_idx = [], [], []
+    for n, (orientation, x, y) in enumerate(placements):
+        for cell_row, row in enumerate(orientation.shape):
+            for cell_col, cell in enumerate(row):
+                if cell:
+                    board_idx.append(n)
+                    row_idx.append(y + cell_row)
+                    col_idx.append(x + cell_col)
+    boards[board_idx, row_idx, col_idx] = 1
+    moves = [(orientation.rotation, x, y) for orientation, x, y in placements]
+    return moves, boards
+
+def batch_features(boards):
+    #Aggregate height (filled cells), complete lines, holes and bumpiness of a (N, H, W) board stack, shape (N, 4)
+    grid_height, grid_width = boards.shape[1:]
+    aggregate_height = boards.sum(axis=(1, 2), dtype=np.int64)
+    complete_lines = (boards.sum(axis=2, dtype=np.int64) == grid_width).sum(axis=1)
+    #Every cell at or below the first filled cell of its column is "seen", holes are the empty seen cells
+    seen = np.maximum.accumulate(boards, axis=1)
+    holes = (seen - boards).sum(axis=(1, 2), dtype=np.int64)
+    column_heights = np.where(seen[:, -1, :] > 0, grid_height - boards.argmax(axis=1), 0)
+    bumpiness = np.abs(np.diff(column_heights, axis=1)).sum(axis=1)
+    return np.stack([aggregate_height, complete_lines, holes, bumpiness], axis=1)
+
+def batch_weighted_scores(features, parameters):
+    #Matrix-vector product of (..., 4) features and (4,) or (K, 4) parameters, summed term by term
+    #in weighted_score order (ties are broken afterwards by rescore_near_ties)
+    features = features.astype(np.float64)
+    parameters = np.asarray(parameters, dtype=np.float64).T
+    scores = features[..., 0, np.newaxis] * parameters[0]
+    for feature_idx in range(1, 4):
+        scores = scores + features[..., feature_idx, np.newaxis] * parameters[feature_idx]
+    return scores[..., 0] if parameters.ndim == 1 else scores
+
+def rescore_near_ties(scores, features, parameters, grid_width, grid_height):
+    #Batch version of break_near_ties: scores (B, N) are weighted_score sums of features (B, N, 4) with parameters
+    #(B, 4). Where a row has a finite candidate within tie_tolerance of its best with other features than the best,
+    #the row's near candidates are scored again with dot_score, in place, so argmax picks what score_parameters picks
+    rows = np.arange(len(scores))
+    best = scores.argmax(axis=1)
+    best_scores = scores[rows, best]
+    cells = grid_width * grid_height
+    tolerance = 2.0 ** -40 * (np.abs(parameters) @ np.array([cells, grid_height, cells, cells], dtype=np.float64))
+    near = np.isfinite(scores) & (scores >= (best_scores - tolerance)[:, np.newaxis])
+    differs = near & (features != features[rows, best][:, np.newaxis, :]).any(axis=2)
+    for row in np.nonzero(differs.any(axis=1))[0]:
+        for candidate in np.nonzero(near[row])[0]:
+            scores[row, candidate] = dot_score(parameters[row], features[row, candidate])
+    return scores
+
+def get_best_move_vectorized(grid, shape, piece_x, piece_y, parameters):
+    #Score every afterstate with one matrix-vector product
+    #parameters may be a (K, 4) matrix, then one best move per parameter row is returned
+    moves, boards = build_afterstates(grid, shape, piece_y)
+    if not moves:
+        return None if np.ndim(parameters) == 1 else [None] * len(parameters)
+    features = batch_features(boards)
+    rows = np.atleast_2d(np.asarray(parameters, dtype=np.float64))
+    scores = batch_weighted_scores(features, rows).T
+    rescore_near_ties(scores, np.broadcast_to(features, (len(rows),) + features.shape), rows, boards.shape[2], boards.shape[1])
+    best = np.argmax(scores, axis=1)
+    if np.ndim(parameters) == 1:
+        return moves[int(best[0])]
+    return [moves[int(idx)] for idx in best]
+
+def landing_row(heights, orientation, x, grid_height=GRID_HEIGHT):
+    #Row where the orientation comes to rest at column x when dropped from above the stack
+    return min(grid_height - heights[x + col_idx] - 1 - bottom for col_idx, bottom in enumerate(orientation.bottom))
+
+def get_column_heights(grid):
+    #Height of every column, 0 for an empty column
+    if not isinstance(grid, list):
+        return grid.column_heights()
+    grid_height = len(grid)
+    column_heights = [0] * len(grid[0])
+    for col_idx in range(len(grid[0])):
+        for row_idx in range(grid_height):
+            if grid[row_idx][col_idx]:
+                column_heights[col_idx] = grid_height - row_idx
+                break
+    return column_heights
+
+class BoardFeatures:
+    #Column heights, per-column hole counts and row fill counts of a grid, kept so that the four
+    #score_parameters features of any placement can be computed as a delta in O(piece size)
+
+    def __init__(self, grid):
+        #Bitboards get heights and holes from one pass over the row masks (BitBoard.column_profile), not per cell
+        self.grid_height = len(grid)
+        if isinstance(grid, list):
+            self.grid_width = len(grid[0])
+            self.heights = get_column_heights(grid)
+            self.row_counts = [row.count(1) for row in grid]
+            self.column_counts = [sum(row[col_idx] for row in grid) for col_idx in range(self.grid_width)]
+            self.column_holes = [height - count for height, count in zip(self.heights, self.column_counts)]
+        else:
+            self.grid_width = grid.width
+            self.heights, self.column_holes = grid.column_profile()
+            self.row_counts = [row.bit_count() for row in grid.rows]
+            self.column_counts = [height - holes for height, holes in zip(self.heights, self.column_holes)]
+        self.aggregate_height = sum(self.row_counts)
+        self.complete_lines = self.row_counts.count(self.grid_width)
+        self.holes = sum(self.column_holes)
+        self.bumpiness = sum(abs(self.heights[i] - self.heights[i + 1]) for i in range(self.grid_width - 1))
+
+    def features(self):
+        #Features of the board itself, same order as score_parameters
+        return self.aggregate_height, self.complete_lines, self.holes, self.bumpiness
+
+    def placement_features(self, orientation, x, y):
+        #Features of the board after locking the orientation at (x, y), lines are not cleared (as in get_best_move)
+        heights = self.heights
+        grid_height = self.grid_height
 
-                #Evaluate this position
-                test_grid = [row[:] for row in grid]
-                lock_piece(test_grid, rotated_shape, x, test_y)
-                score = score_parameters(test_grid, parameters)
+        complete_lines = self.complete_lines
+        row_counts = self.row_counts
+        for row_idx, cells in enumerate(orientation.row_cells):
+            if row_counts[y + row_idx] + cells == self.grid_width:
+                complete_lines += 1
 
-                if score > best_score:
-                    best_score = score
-                    best_move = (rotation, x, test_y)
+        holes = self.holes
+        new_heights = {}
+        for col_idx, top in enumerate(orientation.top):
+            col = x + col_idx
+            height = heights[col]
+            new_height = grid_height - y - top
+            if new_height < height:
+                new_height = height
+            new_heights[col] = new_height
+            holes += (new_height - self.column_counts[col] - orientation.column_cells[col_idx]) - self.column_holes[col]
 
+        #Only the column pairs touching the piece change their bumpiness
+        bumpiness = self.bumpiness
+        for i in range(max(x - 1, 0), min(x + orientation.width, self.grid_width - 1)):
+            bumpiness -= abs(heights[i] - heights[i + 1])
+            bumpiness += abs(new_heights.get(i, heights[i]) - new_heights.get(i + 1, heights[i + 1]))
+
+        return self.aggregate_height + sum(orientation.row_cells), complete_lines, holes, bumpiness
+
+def weighted_score(parameters, features):
+    #Dot product of the parameters and the four features summed left to right, the fast score of the move search.
+    #It can differ from score_parameters' np.dot in the last bit, break_near_ties settles the candidates where that matters
+    aggregate_height, complete_lines, holes, bumpiness = features
+    return parameters[0] * aggregate_height + parameters[1] * complete_lines + parameters[2] * holes + parameters[3] * bumpiness
+
+def dot_score(parameters, features):
+    #score_parameters' arithmetic: np.dot of the parameters and the feature vector
+    x = np.array(features)
+    return np.dot(parameters, x)
+
+def tie_tolerance(weights, grid_width, grid_height):
+    #Bound on the difference between weighted_score and dot_score for the features of a grid_width x grid_height board,
+    #far above the few rounding errors of either sum
+    cells = grid_width * grid_height
+    return 2.0 ** -40 * (abs(weights[0]) * cells + abs(weights[1]) * grid_height + abs(weights[2]) * cells + abs(weights[3]) * cells)
+
+def break_near_ties(near, best_score, tolerance, parameters):
+    #Move of the best candidate by score_parameters' arithmetic among the (score, features, move) candidates in
+    #search order, only the ones within tolerance of best_score can be it. The first of equal scores wins.
+    tied = [(features, move) for score, features, move in near if score >= best_score - tolerance]
+    if not tied:
+        return None
+    if all(features == tied[0][0] for features, _ in tied):
+        return tied[0][1]  #Same features, same score
+    best_dot = -float('inf')
+    best_move = None
+    for features, move in tied:
+        score = dot_score(parameters, features)
+        if best_move is None or score > best_dot:
+            best_dot = score
+            best_move = move
     return best_move
 
 def score_parameters(grid, parameters):
     #Calculate the score based on the grid and parameters
+    if not isinstance(grid, list):
+        #Bitboards compute all four features in one pass over the row masks
+        return dot_score(parameters, grid.features())
+
     aggregate_height = calculate_aggregate_height(grid)
-    complete_lines = sum(row.count(1) == GRID_WIDTH for row in grid)
+    complete_lines = sum(row.count(1) == len(row) for row in grid)
     holes = count_holes(grid)
     bumpiness = calculate_bumpiness(grid)
-    
-    x = np.array([aggregate_height, complete_lines, holes, bumpiness])
-    return np.dot(parameters, x)
+
+    return dot_score(parameters, (aggregate_height, complete_lines, holes, bumpiness))
 
 def calculate_aggregate_height(grid):
     #Calculate the sum of heights of all columns
     aggregate_height = 0
-    for col_idx in range(GRID_WIDTH):
-        col_height = sum(1 for row_idx in range(GRID_HEIGHT) if grid[row_idx][col_idx] == 1)
+    for col_idx in range(len(grid[0])):
+        col_height = sum(1 for row_idx in range(len(grid)) if grid[row_idx][col_idx] == 1)
         aggregate_height += col_height
     return aggregate_height
 
 def count_holes(grid):
     #Count the number of holes in the grid
     holes = 0
-    for col_idx in range(GRID_WIDTH):
+    for col_idx in range(len(grid[0])):
         column_has_tile = False
-        for row_idx in range(GRID_HEIGHT):
+        for row_idx in range(len(grid)):
             if grid[row_idx][col_idx] == 1:
                 column_has_tile = True
             elif grid[row_idx][col_idx] == 0 and column_has_tile:
@@ -64,14 +291,9 @@ def count_holes(grid):
 
 def calculate_bumpiness(grid):
     #Calculate the bumpiness of the grid
-    column_heights = [0] * GRID_WIDTH
-    for col_idx in range(GRID_WIDTH):
-        for row_idx in range(GRID_HEIGHT):
-            if grid[row_idx][col_idx] == 1:
-                column_heights[col_idx] = GRID_HEIGHT - row_idx
-                break
+    column_heights = get_column_heights(grid)
     bumpiness = 0
-    for i in range(GRID_WIDTH - 1):
+    for i in range(len(grid[0]) - 1):
         bumpiness += abs(column_heights[i] - column_heights[i + 1])
     return bumpiness
 